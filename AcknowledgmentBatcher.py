@@ -0,0 +1,271 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: Collects the acknowledgments that have to be retried and sends them per device in batches instead of one by one.
+             Every device has its own queue. A queue is sent when it contains the maximum batch size of its technology
+             or when its oldest acknowledgment waited the maximum wait of its technology, so batching never delays an acknowledgment for long.
+             A Wifi, LoRa or LTE batch is sent to the FiPy as one message with a list of acknowledgments, an AIS batch as one broadcast.
+             Like AcknowledgmentRace the status of a file only improves and the file is only skipped when every device failed.
+             A FiPy with older firmware does not know the batch message. When its reply is not a reply to a batch or the batch failed,
+             the acknowledgments are sent to it one by one from then on.
+
+Changelog: Frank created the file.
+           Frank added the fallback for a FiPy that does not know the batch message and submit for the retries of the RetryScheduler.
+           Frank made a failed batch also fall back to single acknowledgments and made add ignore the acknowledgments that are in flight already.
+'''
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from AcknowledgmentRace import SUCCESS_STATUSES
+from Devices.Strategy import EthernetStrategy, I2CStrategy
+from Status import Status
+
+# The maximum amount of acknowledgments in one batch and the maximum amount of seconds an acknowledgment waits for its batch, for every technology.
+# The Sodaq One can only send one acknowledgment at a time.
+DEFAULT_BATCH_POLICIES = {
+    "Wifi": (20, 1.0),
+    "LTE": (20, 2.0),
+    "LoRa": (5, 5.0),
+    "AIS": (3, 5.0),
+}
+DEFAULT_BATCH_POLICY = (10, 2.0)
+
+class LinkQueue:
+    """The acknowledgments that wait to be sent by one device."""
+
+    def __init__(self, device, max_batch_size, max_wait):
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # Contains tuples of the time the acknowledgment was added and its data
+        self.entries = []
+
+    def is_due(self, now):
+        return len(self.entries) >= self.max_batch_size or (self.entries and now - self.entries[0][0] >= self.max_wait)
+
+    def get_deadline(self):
+        return self.entries[0][0] + self.max_wait if self.entries else None
+
+    def take_batch(self):
+        batch = [data for _, data in self.entries[:self.max_batch_size]]
+        del self.entries[:self.max_batch_size]
+        return batch
+
+class AcknowledgmentBatcher(threading.Thread):
+    def __init__(self, folder, choose_device, policies=DEFAULT_BATCH_POLICIES, default_policy=DEFAULT_BATCH_POLICY, record_outcome=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.folder = folder
+        # Returns the devices to acknowledge with, like Monitor.choose_device
+        self.choose_device = choose_device
+        self.policies = policies
+        self.default_policy = default_policy
+        self.record_outcome = record_outcome
+
+        self.condition = threading.Condition()
+        # A LinkQueue for every device, with the same key as the ReachabilityCache
+        self.queues = {}
+        # Contains for every dab_id that is being acknowledged the amount of devices that did not reply yet and the best status so far
+        self.acknowledgments = {}
+        # The acknowledgments that are submitted, but are not added to the queues yet
+        self.submitted = []
+        # The keys of the devices that do not know the batch message
+        self.unbatched_devices = set()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.stopped = False
+
+    def get_policy(self, device):
+        if isinstance(device.strategy, I2CStrategy):
+            return (1, 0)
+        return self.policies.get(device.get_technology(), self.default_policy)
+
+    def get_queue(self, device):
+        key = (device.get_name(), device.get_technology())
+        if key not in self.queues:
+            self.queues[key] = LinkQueue(device, *self.get_policy(device))
+        return self.queues[key]
+
+    """
+        Add the acknowledgments of all data in data_list to the queue of every device that is chosen for them.
+        A dab_id that is being acknowledged already is left out, so the outcome of the acknowledgment that is in flight is not lost.
+    """
+    def add(self, data_list):
+        devices = self.choose_device()
+
+        added_data_list = []
+        with self.condition:
+            now = time.monotonic()
+            for data in data_list:
+                if data.get("dab_id") in self.acknowledgments:
+                    continue
+                added_data_list.append(data)
+
+                if devices:
+                    self.acknowledgments[data.get("dab_id")] = {"waiting": len(devices), "best_status": None}
+                    for device in devices:
+                        self.get_queue(device).entries.append((now, self.get_data(device, data)))
+            self.condition.notify_all()
+
+        if not devices:
+            for data in added_data_list:
+                self.folder.update_file(data.get("dab_id"), status=Status.SKIP)
+
+    """
+        Submit the acknowledgment of data without waiting for the devices to be chosen. The thread of the batcher chooses the devices once
+        for all acknowledgments that were submitted in the meantime, so retries that are due at the same time do not each choose the devices.
+    """
+    def submit(self, data):
+        with self.condition:
+            self.submitted.append(data)
+            self.condition.notify_all()
+
+    """
+        Get the data to send with device. Like AcknowledgmentRace.get_data.
+    """
+    def get_data(self, device, data):
+        if isinstance(device.strategy, I2CStrategy):
+            return {key:value for key, value in data.items() if key == "dab_id" or key == "message_type"}
+        return dict(data, technology=device.get_technology())
+
+    """
+        Send every queue that is due. When force is True every queue is sent, how long it waited does not matter.
+    """
+    def flush(self, force=False):
+        batches = []
+        with self.condition:
+            now = time.monotonic()
+            for queue in self.queues.values():
+                while queue.entries and (force or queue.is_due(now)):
+                    batches.append((queue.device, queue.take_batch()))
+
+        for device, batch in batches:
+            self.executor.submit(self.send_batch, device, batch)
+
+    """
+        Get the status and validity every dab_id in batch gets from the reply of device. Also updates the files that a Wifi reply confirms besides these files.
+    """
+    def evaluate(self, device, batch, reply):
+        if isinstance(device.strategy, EthernetStrategy):
+            if not reply:
+                return {data["dab_id"]: (Status.SKIP, None) for data in batch}
+
+            new_status = Status.CONFIRMED if device.get_technology() == "Wifi" else Status.CONFIRMATION_SENT
+            if device.get_technology() == "Wifi":
+                # Update the status and validity of the files that have been received by the server.
+                for entry in reply.get("different_ack_information", []):
+                    self.folder.update_file(entry[0], status=Status.CONFIRMED, valid=entry[1])
+
+            # A dab_id that is not in the reply was not acknowledged
+            acknowledged = {entry[0]: entry[1] for entry in reply["ack_information"]}
+            return {data["dab_id"]: (new_status, acknowledged[data["dab_id"]]) if data["dab_id"] in acknowledged else (Status.SKIP, None) for data in batch}
+
+        # A strategy without a batch message returns a reply for every data, an AIS broadcast returns one reply for the whole batch
+        replies = reply if isinstance(reply, list) else [reply] * len(batch)
+        return {data["dab_id"]: (Status.CONFIRMATION_SENT if data_reply else Status.SKIP, None) for data, data_reply in zip(batch, replies)}
+
+    """
+        Check if reply is a reply to a batch message, which contains a pair of the dab_id and validity for every acknowledged dab_id.
+    """
+    def is_batch_reply(self, reply):
+        ack_information = reply.get("ack_information") if isinstance(reply, dict) else None
+        return isinstance(ack_information, list) and all(isinstance(entry, list) and len(entry) == 2 for entry in ack_information)
+
+    """
+        Send every data in batch as its own acknowledgment, for a device that does not know the batch message.
+        Every reply is evaluated as a batch with one acknowledgment.
+    """
+    def send_one_by_one(self, device, batch):
+        results = {}
+        for data in batch:
+            try:
+                reply = device.acknowledge(data)
+                if reply:
+                    reply = {"ack_information": [reply["ack_information"]], "different_ack_information": reply.get("different_ack_information", [])}
+                results.update(self.evaluate(device, [data], reply))
+            except Exception as e:
+                print(e)
+                results[data["dab_id"]] = (Status.SKIP, None)
+        return results
+
+    def send_batch(self, device, batch):
+        start = time.monotonic()
+        key = (device.get_name(), device.get_technology())
+        try:
+            if key in self.unbatched_devices:
+                results = self.send_one_by_one(device, batch)
+            elif isinstance(device.strategy, EthernetStrategy):
+                try:
+                    reply = device.acknowledge_batch(batch)
+                except Exception as e:
+                    print(e)
+                    reply = False
+
+                if self.is_batch_reply(reply):
+                    results = self.evaluate(device, batch, reply)
+                else:
+                    # The FiPy does not know the batch message. It replied to it as to one acknowledgment, or it failed or closed the connection.
+                    print(f"{device.get_name()} does not support batches, sending the acknowledgments one by one")
+                    self.unbatched_devices.add(key)
+                    results = self.send_one_by_one(device, batch)
+            else:
+                results = self.evaluate(device, batch, device.acknowledge_batch(batch))
+        except Exception as e:
+            print(e)
+            results = {data["dab_id"]: (Status.SKIP, None) for data in batch}
+
+        if self.record_outcome is not None:
+            self.record_outcome(device, any(status in SUCCESS_STATUSES for status, _ in results.values()), time.monotonic() - start)
+
+        for dab_id, (new_status, valid) in results.items():
+            self.report(dab_id, new_status, valid)
+
+    """
+        Update the file with dab_id when the reply is better than the replies before it. The file is skipped when every device failed.
+    """
+    def report(self, dab_id, new_status, valid):
+        with self.condition:
+            acknowledgment = self.acknowledgments.get(dab_id)
+            if acknowledgment is None:
+                return
+            acknowledgment["waiting"] -= 1
+
+            best_status = acknowledgment["best_status"]
+            if new_status in SUCCESS_STATUSES and (best_status is None or SUCCESS_STATUSES.index(new_status) > SUCCESS_STATUSES.index(best_status)):
+                acknowledgment["best_status"] = new_status
+                update = {"status": new_status} if valid is None else {"status": new_status, "valid": valid}
+            elif best_status is None and acknowledgment["waiting"] == 0:
+                update = {"status": Status.SKIP}
+            else:
+                update = None
+
+            if acknowledgment["waiting"] == 0:
+                del self.acknowledgments[dab_id]
+
+        if update is not None:
+            self.folder.update_file(dab_id, **update)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if self.stopped:
+                    break
+
+                # Sleep until the first queue is due or an acknowledgment is added or submitted
+                deadlines = [queue.get_deadline() for queue in self.queues.values() if queue.entries]
+                if not self.submitted and not any(queue.is_due(time.monotonic()) for queue in self.queues.values()):
+                    self.condition.wait(max(0, min(deadlines) - time.monotonic()) if deadlines else None)
+
+                submitted = self.submitted
+                self.submitted = []
+
+            if submitted:
+                self.add(submitted)
+            self.flush()
+
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,114 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: Acknowledges a DAB message with several devices at the same time. The status of the file is updated as soon as the first device
+             succeeded, so the time to confirm is the time of the fastest device instead of the time of all devices together.
+             A later reply can only improve the status, from CONFIRMATION_SENT to CONFIRMED, other replies are ignored.
+             The file is only skipped when every device failed. The files a Wifi reply confirms besides this file are always updated.
+
+Changelog: Frank created the file.
+           Frank added record_outcome, so the LinkScheduler learns from every acknowledgment.
+'''
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Devices.Strategy import EthernetStrategy, I2CStrategy
+from Status import Status
+
+# The statuses a successful acknowledgment can give. A status later in the tuple is better.
+SUCCESS_STATUSES = (Status.CONFIRMATION_SENT, Status.CONFIRMED)
+
+class AcknowledgmentRace:
+    def __init__(self, folder, data, devices, record_outcome=None):
+        self.folder = folder
+        self.data = data
+        self.devices = devices
+        # Is called with the device, whether it succeeded and the seconds it took, for example by the LinkScheduler
+        self.record_outcome = record_outcome
+
+        self.lock = threading.Lock()
+        # Is set when the first device succeeded or when every device failed
+        self.decided = threading.Event()
+        self.best_status = None
+        self.amount_of_replies = 0
+
+    """
+        Get the data to send with device. Every device gets its own copy, because the devices send at the same time.
+    """
+    def get_data(self, device):
+        # Change data when using the Sodaq One. Otherwise add the technology used by the device.
+        if isinstance(device.strategy, I2CStrategy):
+            return {key:value for key, value in self.data.items() if key == "dab_id" or key == "message_type"}
+
+        return dict(self.data, technology=device.get_technology())
+
+    """
+        Get the status and validity the reply of device gives the file. Also updates the files that a Wifi reply confirms besides this file.
+    """
+    def evaluate(self, device, reply):
+        dab_id = self.data.get("dab_id")
+
+        if not reply:
+            # The acknowledgment failed for an unkown reason
+            return Status.SKIP, None
+
+        if isinstance(device.strategy, EthernetStrategy):
+            # The new status will be CONFIRMATION_SENT if the dab_id match and the technology is not Wifi. If the dab_id does not match the status will be SKIP.
+            new_status = Status.CONFIRMATION_SENT if dab_id == reply["ack_information"][0] else Status.SKIP
+
+            if device.get_technology() == "Wifi":
+                # Change the status to confirmed if the tech happens to be Wifi. Only for this technology you can be certain that the message was confirmed or not.
+                new_status = Status.CONFIRMED if dab_id == reply["ack_information"][0] else Status.SKIP
+
+                # Update the status and validity of the files that have been received by the server.
+                for entry in reply.get("different_ack_information"):
+                    self.folder.update_file(entry[0], status=Status.CONFIRMED, valid=entry[1])
+
+            return new_status, reply["ack_information"][1]
+
+        # implements the change status to skip or confirmed when the device used the i2c strategy.
+        return Status.CONFIRMATION_SENT, None
+
+    """
+        Acknowledge with device and update the file when the reply is better than the replies before it.
+    """
+    def acknowledge(self, device):
+        start = time.monotonic()
+        try:
+            new_status, valid = self.evaluate(device, device.acknowledge(self.get_data(device)))
+        except Exception as e:
+            print(e)
+            new_status, valid = Status.SKIP, None
+
+        if self.record_outcome is not None:
+            self.record_outcome(device, new_status in SUCCESS_STATUSES, time.monotonic() - start)
+
+        with self.lock:
+            self.amount_of_replies += 1
+
+            if new_status in SUCCESS_STATUSES and (self.best_status is None or SUCCESS_STATUSES.index(new_status) > SUCCESS_STATUSES.index(self.best_status)):
+                self.best_status = new_status
+                update = {"status": new_status} if valid is None else {"status": new_status, "valid": valid}
+                self.folder.update_file(self.data.get("dab_id"), **update)
+                self.decided.set()
+            elif self.best_status is None and self.amount_of_replies == len(self.devices):
+                # Every device failed
+                self.folder.update_file(self.data.get("dab_id"), status=Status.SKIP)
+                self.decided.set()
+
+    """
+        Acknowledge with all devices at the same time and wait until the first device succeeded or every device failed.
+        The devices that did not reply yet keep running in the background. Returns the status the file got.
+    """
+    def run(self):
+        executor = ThreadPoolExecutor(max_workers=len(self.devices))
+        try:
+            for device in self.devices:
+                executor.submit(self.acknowledge, device)
+            self.decided.wait()
+        finally:
+            executor.shutdown(wait=False)
+
+        return self.best_status if self.best_status is not None else Status.SKIP
@@ -0,0 +1,69 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: The observer only detects the DAB files that are created while the system is running. Backfill finds the files
+             that arrived while the system was down. The folder is walked with os.scandir and only the first line of every file,
+             the dab_id, is read. The files are read by a pool of threads, so the scan stays short for a folder with a lot of files.
+             Files with a dab_id that is in the Folder already or that was acknowledged before it was archived are skipped.
+             The other files are handed to the normal acknowledgment in the order they arrived.
+
+Changelog: Frank created the file.
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+    Yield the DirEntry of every .txt file in directory and its subdirectories, like the patterns of the Monitor.
+"""
+def scan_directory(directory):
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from scan_directory(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(".txt"):
+                    yield entry
+    except OSError as e:
+        print(e)
+
+"""
+    Read the dab_id and the modification time of the file of entry. Returns None when the file can not be read or has no valid dab_id.
+"""
+def read_dab_id(entry):
+    try:
+        with open(entry.path, 'rt') as dab_file:
+            dab_id = int(dab_file.readline())
+        return (entry.stat().st_mtime, entry.path, dab_id)
+    except (OSError, ValueError):
+        return None
+
+"""
+    Get the dab_ids of the files in the archive of folder that were acknowledged. A file that was archived without being acknowledged is acknowledged again.
+"""
+def get_archived_dab_ids(folder):
+    if folder.archive is None:
+        return set()
+    return folder.archive.get_dab_ids()
+
+"""
+    Find the files in the folder that are not known yet and call handle_file with the path of every file, the oldest file first.
+    Returns the amount of files that are handled.
+"""
+def backfill(folder, handle_file, max_workers=8):
+    archived_dab_ids = get_archived_dab_ids(folder)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        headers = [header for header in executor.map(read_dab_id, scan_directory(folder.path)) if header is not None]
+
+    new_files = []
+    for modification_time, path, dab_id in headers:
+        if dab_id not in archived_dab_ids and not folder.find_file_by_dab_id(dab_id):
+            new_files.append((modification_time, path))
+
+    # The modification time is the time the dab-receiver was done writing the file, so it is the time of arrival
+    new_files.sort()
+    for _, path in new_files:
+        handle_file(path)
+
+    return len(new_files)
@@ -0,0 +1,172 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: Keeps the memory used by the bodies of the files in a Folder below a maximum size. The bodies and encoded lines of the files
+             are kept in a least recently used order. When they take more memory than max_size the body of the least recently used file
+             is written to disk and removed from memory together with its encoded lines. The body is read from disk again when it is needed.
+             The directory is also the body store of the FolderJournal. A body that the journal stored already is not written again,
+             so the bodies of the files that are recovered after a restart stay on disk and are only read when they are needed.
+
+Changelog: Frank created the file.
+           Frank made the FolderJournal store the bodies in the same directory.
+           Frank made touch only choose the files to evict when the Folder holds its lock, the bodies are written after the Folder released it.
+'''
+
+import os
+import threading
+from collections import OrderedDict
+
+class BodyCache:
+    def __init__(self, directory, max_size=8 * 1024 * 1024):
+        self.directory = directory
+        # The maximum amount of bytes the bodies and encoded lines may take in memory
+        self.max_size = max_size
+
+        self.lock = threading.Lock()
+        # The files that have something in memory with the amount of bytes it takes. The least recently used file is first.
+        self.entries = OrderedDict()
+        self.size = 0
+        # The files that are chosen to be evicted, but of which the body is not written to disk yet
+        self.victims = OrderedDict()
+
+    def get_filename(self, file):
+        return self.get_filename_by_sequence_number(file.sequence_number)
+
+    def get_filename_by_sequence_number(self, sequence_number):
+        return os.path.join(self.directory, f"{sequence_number}.body")
+
+    """
+        Write body to the file of file. It is written to a temporary file first, so a thread that reads the body never reads a half written body.
+        When sync is True the body is on disk when this method returns.
+    """
+    def write_body(self, file, body, sync=False):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.get_filename(file)
+        temporary_filename = f"{filename}.{threading.get_ident()}.tmp"
+
+        with open(temporary_filename, mode='wb') as body_file:
+            body_file.write(body)
+            if sync:
+                body_file.flush()
+                os.fsync(body_file.fileno())
+
+        os.replace(temporary_filename, filename)
+
+    """
+        Remove the body with sequence_number from disk. Is used by the FolderJournal when the removal of the file is written.
+    """
+    def remove_body(self, sequence_number):
+        try:
+            os.remove(self.get_filename_by_sequence_number(sequence_number))
+        except FileNotFoundError:
+            pass
+
+    def get_size(self):
+        with self.lock:
+            return self.size
+
+    """
+        Get the amount of bytes the body and encoded lines of file take in memory.
+    """
+    def get_memory_size(self, file):
+        return sum(len(value) for value in (file.body, file.encoded_lines, file.packed_lines) if value is not None)
+
+    """
+        Mark file as the most recently used file and choose the least recently used files to evict when the cache is too large.
+        When evict is False the chosen files are only evicted by the next call of evict_victims.
+        The Folder uses this while holding its lock, so no body is written to disk while the folder is blocked.
+    """
+    def touch(self, file, evict=True):
+        with self.lock:
+            # A file that is used again is not evicted
+            self.victims.pop(id(file), None)
+
+            entry = self.entries.pop(id(file), None)
+            if entry is not None:
+                self.size -= entry[1]
+
+            size = self.get_memory_size(file)
+            if size:
+                self.entries[id(file)] = (file, size)
+                self.size += size
+
+            # The most recently used file is never evicted, because it is being used
+            while self.size > self.max_size and len(self.entries) > 1:
+                _, (least_recently_used, size) = self.entries.popitem(last=False)
+                self.size -= size
+                self.victims[id(least_recently_used)] = least_recently_used
+
+        if evict:
+            self.evict_victims()
+
+    """
+        Evict the files that touch chose to evict. The bodies are written to disk without holding the lock.
+    """
+    def evict_victims(self):
+        with self.lock:
+            victims = list(self.victims.values())
+
+        for file in victims:
+            self.evict(file)
+
+    """
+        Write the body of file to disk and remove it and the encoded lines from memory. When the body can not be written it is kept in memory.
+        A file that is used again or removed while its body is written is not evicted.
+    """
+    def evict(self, file):
+        body = file.body
+
+        # A body that is stored by the FolderJournal is on disk already
+        if body is not None and not file.stored and not file.evicted:
+            try:
+                self.write_body(file, body)
+            except OSError as e:
+                print(e)
+                with self.lock:
+                    self.victims.pop(id(file), None)
+                return
+
+        with self.lock:
+            if self.victims.pop(id(file), None) is None:
+                # The body that was written for a file that is used again or removed is not needed
+                if body is not None and not file.stored and not file.evicted:
+                    self.remove_body(file.sequence_number)
+                return
+
+            # Set evicted before removing the body, so a thread that reads the body at the same time always finds it
+            if body is not None:
+                file.evicted = True
+                file.body = None
+
+            file.encoded_lines = None
+            file.packed_lines = None
+
+    """
+        Read the body of an evicted file from disk. The body is not kept in memory again, the encoded lines that are built from it are.
+    """
+    def load(self, file):
+        with open(self.get_filename(file), mode='rb') as body_file:
+            return body_file.read()
+
+    """
+        Forget file and remove its body from disk. An evicted body is read back into memory first, 
+        so a thread that still uses the removed file can read its lines.
+        A body that is stored by the FolderJournal is removed by the journal, after the removal of the file is written.
+    """
+    def remove(self, file):
+        with self.lock:
+            self.victims.pop(id(file), None)
+            entry = self.entries.pop(id(file), None)
+            if entry is not None:
+                self.size -= entry[1]
+
+            if not file.evicted:
+                return
+
+            try:
+                file.body = self.load(file)
+                file.evicted = False
+                if not file.stored:
+                    os.remove(self.get_filename(file))
+            except OSError as e:
+                print(e)
@@ -0,0 +1,163 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: The formats the onboard interface can encode its responses in. JSON prefixed with a padded text length is the default.
+             A client can ask for MessagePack prefixed with a binary length instead, which is smaller and faster to encode.
+             In MessagePack the categories and statuses are sent as numbers and the coordinates as a pair of floats.
+
+Changelog: Frank created the file and moved EncodedInformation from Request.py to this file.
+           Frank made EncodedInformation build the lines of the files only when they are needed.
+'''
+
+import json
+
+import msgpack
+
+from Category import Category
+from Status import Status
+from Interface.Framing import frame_binary_message, frame_message
+
+# The numbers that are sent instead of the categories in MessagePack. A Status is sent as its value, which is a number already.
+CATEGORY_NUMBERS = {Category.WEATHER: 1, Category.LOCATION: 2, Category.OTHER: 3, Category.CAP: 4}
+
+"""
+    Get the value of field of file. Categories are kept as Category, so every codec can encode them in its own way.
+"""
+def get_field_value(file, field):
+    value = getattr(file, field)
+
+    if field == "coordinates":
+        return list(value)
+    return value
+
+"""
+    Is used by json to encode the enums in a response.
+"""
+def encode_json_enum(value):
+    if isinstance(value, (Category, Status)):
+        return value.value
+    elif isinstance(value, EncodedInformation):
+        return value.get_values()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+"""
+    Is used by msgpack to encode the enums in a response.
+"""
+def encode_msgpack_enum(value):
+    if isinstance(value, Category):
+        return CATEGORY_NUMBERS[value]
+    elif isinstance(value, Status):
+        return value.value
+    elif isinstance(value, EncodedInformation):
+        return value.get_values()
+    raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
+class EncodedInformation:
+    """
+        The lines of files which can also give the lines as they are encoded by the files themselves.
+        So a response can be built by joining the encoded lines instead of encoding all the lines again.
+        When fields is given every file is a list with the values of these fields instead of the lines.
+        The values are only built when they are needed, so the lines of a file are not built when its encoded lines are used.
+    """
+    def __init__(self, files, fields=None):
+        self.files = files
+        self.fields = fields
+        self.values = None
+
+    """
+        Get a list with the lines or the values of the fields of every file.
+    """
+    def get_values(self):
+        if self.values is None:
+            if self.fields is None:
+                self.values = [file.get_lines() for file in self.files]
+            else:
+                self.values = [[get_field_value(file, field) for field in self.fields] for file in self.files]
+        return self.values
+
+    def __iter__(self):
+        return iter(self.get_values())
+
+    def __len__(self):
+        return len(self.files)
+
+    def __eq__(self, other):
+        if isinstance(other, EncodedInformation):
+            other = other.get_values()
+        return self.get_values() == other
+
+    """
+        Get every file encoded as json.
+    """
+    def get_json_fragments(self):
+        if self.fields is None:
+            return [file.get_encoded_lines() for file in self.files]
+
+        return ['[' + ', '.join(file.get_encoded_lines() if field == "lines" else json.dumps(get_field_value(file, field), default=encode_json_enum) for field in self.fields) + ']' for file in self.files]
+
+    """
+        Get every file encoded as MessagePack.
+    """
+    def get_msgpack_fragments(self):
+        if self.fields is None:
+            return [file.get_packed_lines() for file in self.files]
+
+        return [msgpack.packb(values, default=encode_msgpack_enum) for values in self]
+
+class JsonCodec:
+    name = "json"
+
+    """
+        Encode response with information added as the last key. When information is EncodedInformation the encoded lines are joined
+        instead of encoded again. The result is the same as json.dumps of the response with information in it.
+    """
+    def encode(self, response, information=None):
+        if isinstance(information, EncodedInformation):
+            return json.dumps(response, default=encode_json_enum)[:-1] + ', "information": [' + ', '.join(information.get_json_fragments()) + ']}'
+
+        if information is not None:
+            response["information"] = information
+        return json.dumps(response, default=encode_json_enum)
+
+    """
+        Put the request_id in the response. A response is always a json object, so the request_id can be put in front of it without decoding the response again.
+    """
+    def add_request_id(self, response, request_id):
+        return '{"request_id": ' + json.dumps(request_id) + ', ' + response[1:]
+
+    def frame(self, response, max_msg_length):
+        return frame_message(response, max_msg_length)
+
+class MessagePackCodec:
+    name = "msgpack"
+
+    """
+        Encode response with information added as the last key. When information is EncodedInformation the encoded lines are joined
+        instead of encoded again.
+    """
+    def encode(self, response, information=None):
+        if isinstance(information, EncodedInformation):
+            packer = msgpack.Packer(default=encode_msgpack_enum)
+            fragments = information.get_msgpack_fragments()
+
+            # The map header contains the amount of keys and the array header the amount of files, so they are written before the rest
+            return (packer.pack_map_header(len(response) + 1) + b"".join(packer.pack(key) + packer.pack(value) for key, value in response.items())
+                    + packer.pack("information") + packer.pack_array_header(len(fragments)) + b"".join(fragments))
+
+        if information is not None:
+            response["information"] = information
+        return msgpack.packb(response, default=encode_msgpack_enum)
+
+    """
+        Put the request_id in the response. A response is always a map with less than 15 keys, so it starts with one byte that contains the amount of keys.
+        The request_id is put after that byte and the amount of keys is increased by one.
+    """
+    def add_request_id(self, response, request_id):
+        return bytes([response[0] + 1]) + msgpack.packb("request_id") + msgpack.packb(request_id) + response[1:]
+
+    def frame(self, response, max_msg_length):
+        return frame_binary_message(response)
+
+# The codecs a client can choose from with the key codec in its request
+CODECS = {codec.name: codec for codec in (JsonCodec(), MessagePackCodec())}
+JSON_CODEC = CODECS["json"]
@@ -10,8 +10,12 @@ Changelog: Alfred made the first version.
            Frank added the fields: technology, priority and removed the other fields except for: name, branch and model.
            Frank changed the relation with the Interface class by adding a Strategy class in between.
            Frank added methods: acknowledge, has_reach and removed the other function that were left when an Interface was directly used.
+           Frank added the method acknowledge_batch.
+           Frank made close wait for the acknowledgment that is being sent, so the interface is never closed while it is used.
 '''
 
+import threading
+
 from Devices.Strategy import AISStrategy, EthernetStrategy, I2CStrategy
 
 class Device:
@@ -26,6 +30,8 @@ class Device:
         self.model = model
         self.technology = technology
         self.priority = priority
+        # Prevents the device from being used by two threads at the same time. For example by an acknowledgment and a has_reach.
+        self.lock = threading.Lock()
     
     """
         This method is used to acknowledge a message using this device. 
@@ -33,10 +39,23 @@ class Device:
     """
     def acknowledge(self, data):
         print("Confirming DAB message with dab_id: {}".format(data.get("dab_id")))
-        return self.strategy.communicate(data)
+        with self.lock:
+            return self.strategy.communicate(data)
+
+    """
+        This method is used to acknowledge multiple messages at once using this device.
+    """
+    def acknowledge_batch(self, batch):
+        print("Confirming DAB messages with dab_ids: {}".format([data.get("dab_id") for data in batch]))
+        with self.lock:
+            return self.strategy.communicate_batch(batch)
 
     """This method tries to determine if the device connected to this object is within reach of a receiver."""
     def has_reach(self):
+        with self.lock:
+            return self.ask_has_reach()
+
+    def ask_has_reach(self):
         # If the technology cannot confirm that there is a receiver in reach. Return None
         if isinstance(self.strategy, AISStrategy):
             return None
@@ -69,6 +88,14 @@ class Device:
             print("Unknown strategy to device.has_reach()!")
             return False
         
+    """
+        Close the interface of the device. Is used when the device is no longer listed or replaced.
+        Waits until the device is done with the acknowledgment it is sending.
+    """
+    def close(self):
+        with self.lock:
+            self.strategy.close()
+
     def get_strategy(self):
         return self.strategy
         
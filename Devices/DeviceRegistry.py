@@ -0,0 +1,156 @@
+'''
+project: half-duplex, slimmer maken multiconnectivity modem
+author: Alfred Espinosa Encarnación, Frank Montenij
+Description: A class which holds the devices listed in the devices csv file. The csv file is only read when it changes, 
+             so the interfaces of the devices stay open between acknowledgments instead of being opened for every DAB message.
+             The registry is a watchdog event handler, so the observer of the system can tell it when the csv file is modified.
+            
+Changelog: Frank moved attach_devices from main.py to this file and created the class DeviceRegistry.
+'''
+
+import csv
+import os
+import sys
+import threading
+
+from watchdog.events import PatternMatchingEventHandler
+
+from Devices.Device import Device
+from Devices.Strategy import AISStrategy, EthernetStrategy, I2CStrategy, SPIStrategy
+from Interface.Ethernet import Ethernet
+from Interface.I2C import I2C
+from Interface.SPI import SPI
+from Interface.UART import UART
+
+class DeviceRegistry(PatternMatchingEventHandler):
+    def __init__(self, csv_filename):
+        PatternMatchingEventHandler.__init__(self, patterns=[os.path.abspath(csv_filename)], ignore_directories=True)
+        self.csv_filename = csv_filename
+        self.lock = threading.Lock()
+        self.devices = []
+        # The (st_mtime_ns, st_ino, st_size) of the csv file when the devices were read. None when they have not been read yet.
+        self.csv_stat = None
+
+    def get_csv_filename(self):
+        return self.csv_filename
+
+    def get_directory(self):
+        return os.path.dirname(os.path.abspath(self.csv_filename))
+
+    """
+        Return the devices listed in the csv file. The csv file is only read the first time.
+    """
+    def get_devices(self):
+        with self.lock:
+            if self.csv_stat is None:
+                self.load()
+
+            return self.devices
+
+    def get_csv_stat(self):
+        try:
+            stat = os.stat(self.csv_filename)
+        except OSError:
+            return None
+
+        return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    """
+        Read the devices from the csv file and close the interfaces of the devices that are replaced.
+    """
+    def load(self):
+        old_devices = self.devices
+
+        csv_stat = self.get_csv_stat()
+        self.devices = read_devices(self.csv_filename)
+        self.csv_stat = csv_stat
+
+        for device in old_devices:
+            device.close()
+
+    """
+        Read the devices again when the mtime, inode or size of the csv file changed since the last time it was read.
+    """
+    def reload_if_changed(self):
+        with self.lock:
+            if self.csv_stat is not None and self.get_csv_stat() != self.csv_stat:
+                print(f"{self.csv_filename} changed, reloading the devices")
+
+                # Keep using the old devices when the new csv file can not be read. For example when a serial port does not exist.
+                try:
+                    self.load()
+                except Exception as e:
+                    print(e)
+
+    def on_created(self, event):
+        self.reload_if_changed()
+
+    def on_modified(self, event):
+        self.reload_if_changed()
+
+    def on_moved(self, event):
+        self.reload_if_changed()
+
+"""
+    This function reads all the device information from a csv file. Then converts that infromation to a Device object. 
+    It returns the list of devices, which is empty when no devices are listed or the file could not be read.
+"""
+def read_devices(csv_parameter):
+    listed_devices = []
+
+    try:
+        with open(csv_parameter, mode='r') as csv_file:
+            csv_reader = csv.DictReader(csv_file)
+            line_count = 0
+            for row in csv_reader:
+                if line_count == 0:
+                    print(f'Column names are {", ".join(row)}')
+                    line_count += 1
+                    
+                device = Device(row["name"], row["branch"], row["model"], row["technology"], int(row["priority"]))
+                if int(row["interface_type"]) == 0:
+                    interface = UART()
+                    interface.init_serial(row["address"], int(row["setting"]))
+                    strategy = AISStrategy(interface)
+                    listed_devices.append(device)
+
+                if int(row["interface_type"]) == 1:
+                    interface = I2C()
+                    interface.init_i2c(int(row["address"]))
+                    strategy = I2CStrategy(interface)
+                    listed_devices.append(device)
+
+                if int(row["interface_type"]) == 2:
+                    interface = Ethernet()
+                    interface.init_socket(row["address"], int(row["setting"])) # Address and setting are here the ip_address and the portnumber of the target device.
+                    # The optional column keep_alive makes the device reuse its connection. The server on the device needs to support it.
+                    interface.set_keep_alive(row.get("keep_alive") == "1")
+                    strategy = EthernetStrategy(interface)
+                    listed_devices.append(device)
+
+                if int(row["interface_type"]) == 3:
+                    interface = SPI()
+                    interface.init_spi(int(row["address"]), int(row["setting"]))
+                    strategy = SPIStrategy(interface)
+                    listed_devices.append(device)
+                
+                device.set_strategy(strategy)
+               
+                line_count += 1
+            print(f'Processed {line_count} lines.')
+    except RuntimeError:
+        print("Could not open list with devices")
+
+    return listed_devices
+
+"""
+    This function reads all the devices from a csv file and stops the program when no devices are listed.
+"""
+def attach_devices(csv_parameter):
+    listed_devices = read_devices(csv_parameter)
+
+    if listed_devices:
+        return listed_devices
+    else:
+        print(f"No devices are listed. Configure {csv_parameter} and execute the program again")
+        sys.exit()
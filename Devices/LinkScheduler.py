@@ -0,0 +1,198 @@
+'''
+project: half-duplex, slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: Chooses the device to acknowledge with based on how the devices performed before, instead of only on the priority in the csv file.
+             For every device and technology the outcome and latency of the last acknowledgments are kept. The device with the lowest
+             expected time to confirm is chosen, the priority decides between devices that are expected to be equally fast.
+             A device that was not used for explore_interval seconds is chosen once, so its statistics do not get outdated.
+             The statistics are stored in a json file, so they survive a restart. The last decisions are kept in a trace for debugging.
+
+Changelog: Frank created the file.
+'''
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+class LinkScheduler:
+    def __init__(self, filename=None, window=50, explore_interval=600, trace_length=100, save_interval=60):
+        # The json file the statistics are stored in. The statistics are not stored when it is None.
+        self.filename = filename
+        # The amount of acknowledgments the statistics are calculated over
+        self.window = window
+        self.explore_interval = explore_interval
+        self.save_interval = save_interval
+
+        self.lock = threading.Lock()
+        # Contains for every device a dict with the keys outcomes, latencies, last_attempt and last_success
+        self.links = {}
+        self.trace = deque(maxlen=trace_length)
+        self.last_save = 0
+
+    """
+        The key of a device. The same device is listed once for every technology it supports.
+    """
+    def get_key(self, device):
+        return (device.get_name(), device.get_technology())
+
+    def get_link(self, device):
+        key = self.get_key(device)
+        if key not in self.links:
+            self.links[key] = {"outcomes": deque(maxlen=self.window), "latencies": deque(maxlen=self.window), "last_attempt": None, "last_success": None}
+        return self.links[key]
+
+    """
+        Store the outcome of an acknowledgment with device that took latency seconds. Only the latency of a successful acknowledgment is kept.
+    """
+    def record(self, device, success, latency, now=None):
+        now = time.time() if now is None else now
+
+        with self.lock:
+            link = self.get_link(device)
+            link["outcomes"].append(bool(success))
+            link["last_attempt"] = now
+            if success:
+                link["latencies"].append(latency)
+                link["last_success"] = now
+
+        if self.filename is not None and now - self.last_save >= self.save_interval:
+            self.save()
+
+    """
+        Get the success rate, the 50th and 95th percentile of the latency and the seconds since the last success of device.
+        A value is None when there is nothing to calculate it from.
+    """
+    def get_statistics(self, device, now=None):
+        now = time.time() if now is None else now
+
+        with self.lock:
+            link = self.links.get(self.get_key(device))
+            if link is None:
+                return {"success_rate": None, "p50": None, "p95": None, "since_success": None}
+
+            outcomes = list(link["outcomes"])
+            latencies = sorted(link["latencies"])
+            last_success = link["last_success"]
+
+        return {
+            "success_rate": sum(outcomes) / len(outcomes) if outcomes else None,
+            "p50": get_percentile(latencies, 50),
+            "p95": get_percentile(latencies, 95),
+            "since_success": now - last_success if last_success is not None else None,
+        }
+
+    """
+        The expected amount of seconds until device confirmed a message, including the failed attempts before it.
+        A failed attempt is expected to take the 95th percentile of the latency. Returns None when device was never used.
+    """
+    def get_expected_time(self, statistics):
+        if statistics["success_rate"] is None:
+            return None
+        if statistics["success_rate"] == 0:
+            return float("inf")
+
+        failed_attempts = (1 - statistics["success_rate"]) / statistics["success_rate"]
+        return statistics["p50"] + failed_attempts * statistics["p95"]
+
+    """
+        Check if device was not used for explore_interval seconds, or never.
+    """
+    def is_stale(self, device, now):
+        with self.lock:
+            link = self.links.get(self.get_key(device))
+            return link is None or link["last_attempt"] is None or now - link["last_attempt"] >= self.explore_interval
+
+    """
+        Choose the device from devices that is expected to confirm the fastest. Stale devices are chosen first, the one with the highest priority.
+        Raises a ValueError when devices is empty, like get_highest_priority_device.
+    """
+    def choose(self, devices, now=None):
+        if not devices:
+            raise ValueError("There are no devices to choose from")
+        now = time.time() if now is None else now
+
+        candidates = []
+        for device in devices:
+            statistics = self.get_statistics(device, now)
+            candidates.append({
+                "device": device.get_name(),
+                "technology": device.get_technology(),
+                "priority": device.priority,
+                "stale": self.is_stale(device, now),
+                "expected_time": self.get_expected_time(statistics),
+                **statistics,
+            })
+
+        stale_devices = [(device, candidate) for device, candidate in zip(devices, candidates) if candidate["stale"]]
+        if stale_devices:
+            chosen, chosen_candidate = min(stale_devices, key=lambda pair: pair[0].priority)
+            reason = "explore"
+        else:
+            chosen, chosen_candidate = min(zip(devices, candidates), key=lambda pair: (pair[1]["expected_time"], pair[0].priority))
+            reason = "expected_time"
+
+        with self.lock:
+            self.trace.append({"time": now, "chosen": chosen_candidate["device"], "technology": chosen_candidate["technology"],
+                               "reason": reason, "candidates": candidates})
+
+        return chosen
+
+    """
+        Get the last decisions, the oldest first. Every decision contains the chosen device, the reason and the statistics of all candidates.
+    """
+    def get_trace(self):
+        with self.lock:
+            return list(self.trace)
+
+    """
+        Write the statistics to filename. They are written to a temporary file first, so a crash never leaves a half written file behind.
+    """
+    def save(self):
+        with self.lock:
+            links = [{"name": name, "technology": technology, "outcomes": list(link["outcomes"]), "latencies": list(link["latencies"]),
+                      "last_attempt": link["last_attempt"], "last_success": link["last_success"]} for (name, technology), link in self.links.items()]
+            self.last_save = time.time()
+
+        try:
+            os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+            temporary_filename = self.filename + ".tmp"
+            with open(temporary_filename, mode='w', encoding='utf-8') as links_file:
+                json.dump({"links": links}, links_file)
+            os.replace(temporary_filename, self.filename)
+        except OSError as e:
+            print(e)
+
+    """
+        Read the statistics that were saved before the restart. Nothing is read when the file does not exist or can not be read.
+    """
+    def load(self):
+        if self.filename is None or not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename, mode='r', encoding='utf-8') as links_file:
+                links = json.load(links_file)["links"]
+        except (OSError, ValueError, KeyError) as e:
+            print(e)
+            return
+
+        with self.lock:
+            for link in links:
+                self.links[(link["name"], link["technology"])] = {
+                    "outcomes": deque(link["outcomes"], maxlen=self.window),
+                    "latencies": deque(link["latencies"], maxlen=self.window),
+                    "last_attempt": link["last_attempt"],
+                    "last_success": link["last_success"],
+                }
+
+"""
+    Get the percentile of the sorted values with the nearest rank method. Returns None when there are no values.
+"""
+def get_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+
+    rank = max(1, -(-len(sorted_values) * percentile // 100))
+    return sorted_values[int(rank) - 1]
@@ -0,0 +1,112 @@
+'''
+project: half-duplex, slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: A thread that keeps track of which devices have reach. Asking a device if it has reach can take up to 10 seconds, 
+             so the verdicts are cached and refreshed in the background when they are older than the time to live of the technology.
+             This way choosing a device does not have to wait for the slowest device to answer.
+
+Changelog: Frank created the file.
+'''
+
+import threading
+import time
+
+# The time to live in seconds of a has_reach verdict for every technology. Technologies not listed use the default_ttl.
+DEFAULT_TTLS = {
+    "Wifi": 10,
+    "LTE": 30,
+    "LoRa": 60,
+}
+
+class ReachabilityCache(threading.Thread):
+    def __init__(self, get_devices, ttls=DEFAULT_TTLS, default_ttl=30, refresh_interval=1):
+        threading.Thread.__init__(self, daemon=True)
+        self.get_devices = get_devices
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.refresh_interval = refresh_interval
+
+        self.lock = threading.Lock()
+        # Contains for every device a dict with the keys has_reach, probed_at and latency.
+        self.entries = {}
+        self.stopped = threading.Event()
+
+    """
+        The key of a device in the cache. The same device is listed once for every technology it supports.
+    """
+    def get_key(self, device):
+        return (device.get_name(), device.get_technology())
+
+    def get_ttl(self, device):
+        return self.ttls.get(device.get_technology(), self.default_ttl)
+
+    def get_entry(self, device):
+        with self.lock:
+            return self.entries.get(self.get_key(device))
+
+    def is_stale(self, device):
+        entry = self.get_entry(device)
+        return entry is None or time.time() - entry["probed_at"] >= self.get_ttl(device)
+
+    """
+        Ask the device if it has reach and store the verdict together with the time it was asked and how long it took.
+    """
+    def probe(self, device):
+        start = time.monotonic()
+        has_reach = device.has_reach()
+        latency = time.monotonic() - start
+
+        with self.lock:
+            self.entries[self.get_key(device)] = {"has_reach": has_reach, "probed_at": time.time(), "latency": latency}
+
+        return has_reach
+
+    """
+        Return the cached has_reach verdict of the device. Only when the device was never asked it is asked right away.
+        A verdict that is too old is still returned, it will be refreshed in the background.
+    """
+    def has_reach(self, device):
+        entry = self.get_entry(device)
+
+        if entry is None:
+            return self.probe(device)
+
+        return entry["has_reach"]
+
+    def get_last_probe_time(self, device):
+        entry = self.get_entry(device)
+        return entry["probed_at"] if entry else None
+
+    def get_probe_latency(self, device):
+        entry = self.get_entry(device)
+        return entry["latency"] if entry else None
+
+    """
+        Returns a copy of all the entries, so they can be shown for debugging.
+    """
+    def get_entries(self):
+        with self.lock:
+            return {key: dict(entry) for key, entry in self.entries.items()}
+
+    """
+        Ask every device with a verdict older than its time to live if it has reach.
+    """
+    def refresh(self):
+        for device in self.get_devices():
+            if self.stopped.is_set():
+                return
+
+            if self.is_stale(device):
+                self.probe(device)
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(e)
+
+            self.stopped.wait(self.refresh_interval)
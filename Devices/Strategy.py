@@ -4,12 +4,18 @@ author: Alfred Espinosa Encarnación, Frank Montenij
 Description: A class which represents the different strategies for communicating with physical devices.
             
 Changelog: Frank created the file, but used Alfred his code in the communicate methods for the classes: I2CStrategy, SPIStrategy and AISStrategy.
+           Frank added communicate_batch, so multiple acknowledgments can be sent at once.
+           Frank made AISStrategy split large messages over multiple BBM sentences and read the ABKs of the base station.
+           Frank replaced BitVector by AISArmor for converting the message to a 6-bit payload.
 '''
 
 from abc import ABC, abstractmethod
-import aisutils
+import aisutils.nmea
+import threading
 import time
 
+from Interface.AISArmor import armor_text
+
 class Strategy(ABC):
     def __init__(self, interface):
         self.interface = interface
@@ -18,6 +24,13 @@ class Strategy(ABC):
     def communicate(self, data) -> bool:
         """Subclasses need to implement this method. It must returns a bool value."""
 
+    def communicate_batch(self, batch):
+        """Sends every data in batch on its own and returns the replies in a list. Subclasses override this method when they can send a batch at once."""
+        return [self.communicate(data) for data in batch]
+
+    def close(self):
+        """Closes the interface. Subclasses override this method when their interface has something to close."""
+
 class I2CStrategy(Strategy):
     """Class to define how to communcicate with an I2C interface."""
     
@@ -74,6 +87,9 @@ class I2CStrategy(Strategy):
         else:
             return False
 
+    def close(self):
+        self.interface.close_i2c()
+
 
 class SPIStrategy(Strategy):
     """Class to define how to communcicate with a SPI interface."""
@@ -99,29 +115,171 @@ class SPIStrategy(Strategy):
             print(e)
             return False
 
+    def close(self):
+        self.interface.close_spi()
+
 class AISStrategy(Strategy):
-    """Class to define how with communicate to an AIS device."""
+    """
+        Class to define how with communicate to an AIS device.
+        A message that does not fit in one BBM sentence is split over at most MAX_SENTENCES sentences. Every message gets the next sequence id,
+        so the base station can tell which message an ABK it sends back belongs to. The ABKs are read from the UART in a separate thread,
+        so the next message can be sent without waiting for the ABK of the previous message.
+    """
+
+    # The maximum amount of BBM sentences in one message and the maximum amount of characters of payload in one sentence.
+    # With 58 characters every sentence fits in the 82 characters of a NMEA sentence, including the line ending.
+    MAX_SENTENCES = 9
+    MAX_SENTENCE_PAYLOAD = 58
+    # The type of acknowledgement in an ABK when a broadcast was transmitted. The other types mean it was not.
+    ABK_BROADCAST_COMPLETED = 3
     
-    def __init__(self, interface):
+    def __init__(self, interface, abk_timeout=10):
         super().__init__(interface)
+        # The seconds after which a message without an ABK is forgotten, so its sequence id can be used again
+        self.abk_timeout = abk_timeout
+
+        self.condition = threading.Condition()
+        self.next_seq_id = 0
+        # Contains for every sequence id the last message sent with it, as a dict with the keys dab_ids, sent_at and ack_type
+        self.transmissions = {}
+        # Callables that are called with the dab_ids of a message and whether it was broadcasted, when its ABK is read
+        self.abk_listeners = []
+        self.abk_reader = None
+        self.closed = False
 
     def communicate(self, data):
+        return self.broadcast('  ' + self.build_message(data), [data.get("dab_id")])
+
+    """
+        Sends the acknowledgments of all data in batch in one broadcast. The acknowledgments are separated by a semicolon.
+    """
+    def communicate_batch(self, batch):
+        return self.broadcast('  ' + ';'.join(self.build_message(data) for data in batch), [data.get("dab_id") for data in batch])
+
+    def build_message(self, data):
+        if data.get("message_type") == 4:
+            return 'ACK:' + str(data.get("dab_id")) + ',MSG:' + str(data.get("message_type")) + ',RSSI:' + str(data.get("dab_signal")) + ',SNR:-1'
+        return 'ACK:' + str(data.get("dab_id")) + ',MSG:' + str(data.get("message_type")) + ''
+
+    """
+        Split the 6-bit payload over BBM sentences. Only the last sentence contains fill bits, the other sentences end on a whole character.
+    """
+    def encode_sentences(self, payload, fill_bits, seq_id):
+        parts = [payload[start:start + self.MAX_SENTENCE_PAYLOAD] for start in range(0, len(payload), self.MAX_SENTENCE_PAYLOAD)] or [""]
+        if len(parts) > self.MAX_SENTENCES:
+            raise ValueError(f"A message of {len(payload)} characters does not fit in {self.MAX_SENTENCES} BBM sentences")
+
+        return [aisutils.nmea.bbmEncode(len(parts), number, seq_id, 1, 8, part, fill_bits if number == len(parts) else 0)
+                for number, part in enumerate(parts, start=1)]
+
+    """
+        Get the next sequence id. When the message that was sent with it before did not get an ABK yet, wait for it at most abk_timeout seconds.
+        Must be called while holding the condition.
+    """
+    def take_seq_id(self):
+        seq_id = self.next_seq_id
+        self.next_seq_id = (seq_id + 1) % 10
+
+        transmission = self.transmissions.get(seq_id)
+        if transmission is not None:
+            deadline = transmission["sent_at"] + self.abk_timeout
+            while transmission["ack_type"] is None and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+
+        return seq_id
+
+    def broadcast(self, msg, dab_ids=()):
         try:
-            if data.get("message_type") == 4:
-                msg = '  ACK:' + str(data.get("dab_id")) + ',MSG:' + str(data.get("message_type")) + ',RSSI:' + str(data.get("dab_signal")) + ',SNR:-1'
-            else:
-                msg = '  ACK:' + str(data.get("dab_id")) + ',MSG:' + str(data.get("message_type")) + ''
-            
             # Convert msg string to nmea string
-            aisBits = aisutils.BitVector.BitVector(textstring=msg)
-            payloadStr, pad = aisutils.binary.bitvectoais6(aisBits)  # [0]
-            buffer = aisutils.nmea.bbmEncode(1, 1, 0, 1, 8, payloadStr, pad, appendEOL=False)
-            self.interface.write(buffer)
+            payloadStr, pad = armor_text(msg)
+
+            with self.condition:
+                seq_id = self.take_seq_id()
+                # Every sentence ends with <CR><LF>, so the base station can tell the sentences of a message apart.
+                # bbmEncode ignores appendEOL, so the line ending is added here.
+                for sentence in self.encode_sentences(payloadStr, pad, seq_id):
+                    self.interface.write(sentence + aisutils.nmea.EOL)
+                self.transmissions[seq_id] = {"dab_ids": list(dab_ids), "sent_at": time.monotonic(), "ack_type": None}
+
+            self.start_abk_reader()
             return True
         except Exception as e:
             print(e)
             return False
 
+    """
+        Add a listener that is called when the ABK of a message is read. A listener is only added once.
+    """
+    def add_abk_listener(self, listener):
+        with self.condition:
+            if listener not in self.abk_listeners:
+                self.abk_listeners.append(listener)
+
+    def get_ack_type(self, seq_id):
+        with self.condition:
+            transmission = self.transmissions.get(seq_id)
+            return transmission["ack_type"] if transmission else None
+
+    """
+        Wait at most timeout seconds for the ABK of the message with seq_id and return its type of acknowledgement. None when there is no ABK.
+    """
+    def wait_for_abk(self, seq_id, timeout):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.get_ack_type(seq_id) is None and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return self.get_ack_type(seq_id)
+
+    """
+        Handle a sentence read from the base station. Sentences that are not a valid ABK of a BBM are ignored.
+        An ABK looks like: $AIABK,mmsi,channel,message id,sequence id,type of acknowledgement*checksum
+    """
+    def handle_sentence(self, sentence):
+        sentence = sentence.strip()
+        if not sentence[3:6] == "ABK" or not aisutils.nmea.isChecksumValid(sentence):
+            return
+
+        fields = sentence.split("*")[0].split(",")
+        try:
+            message_id, seq_id, ack_type = int(fields[3]), int(fields[4]), int(fields[5])
+        except (IndexError, ValueError):
+            return
+        if message_id != 8:
+            return
+
+        with self.condition:
+            transmission = self.transmissions.get(seq_id)
+            if transmission is None or transmission["ack_type"] is not None:
+                return
+            transmission["ack_type"] = ack_type
+            self.condition.notify_all()
+            listeners = list(self.abk_listeners)
+
+        for listener in listeners:
+            listener(transmission["dab_ids"], ack_type == self.ABK_BROADCAST_COMPLETED)
+
+    def start_abk_reader(self):
+        with self.condition:
+            if self.abk_reader is not None:
+                return
+            self.abk_reader = threading.Thread(target=self.read_abks, daemon=True)
+        self.abk_reader.start()
+
+    def read_abks(self):
+        while not self.closed:
+            try:
+                line = self.interface.read_rs232()
+            except Exception as e:
+                print(e)
+                return
+
+            if line:
+                self.handle_sentence(line.decode("ascii", errors="ignore") if isinstance(line, bytes) else line)
+
+    def close(self):
+        self.closed = True
+        self.interface.close_rs232()
+
 class EthernetStrategy(Strategy):
     """Class to define how to communcicate with an ethernet interface."""
 
@@ -134,11 +292,15 @@ class EthernetStrategy(Strategy):
             max_msg_length = 10 
 
             reply = {"reply": False}
-            self.interface.init_socket(self.interface.ip_address, self.interface.socket_port)
-            with self.interface.sock:
-                self.interface.connect_socket() 
-                self.interface.write(data, max_msg_length)
-                reply = self.interface.read_socket(max_msg_length)
+            if self.interface.get_keep_alive():
+                # Reuse a connection to the device instead of connecting for every message
+                reply = self.interface.request(data, max_msg_length)
+            else:
+                self.interface.init_socket(self.interface.ip_address, self.interface.socket_port)
+                with self.interface.sock:
+                    self.interface.connect_socket() 
+                    self.interface.write(data, max_msg_length)
+                    reply = self.interface.read_socket(max_msg_length)
                 
             # If 'reply' is in reply and false return False. If 'reply' is not in reply or not False return reply.
             if reply.get('reply') == False:
@@ -147,4 +309,13 @@ class EthernetStrategy(Strategy):
                 return reply
         except Exception as e:
             print(e)
-            return False
\ No newline at end of file
+            return False
+
+    """
+        Sends all data in batch in one message. The reply contains an ack_information for every acknowledged dab_id.
+    """
+    def communicate_batch(self, batch):
+        return self.communicate({"batch": batch})
+
+    def close(self):
+        self.interface.close_socket()
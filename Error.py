@@ -11,5 +11,6 @@ class Error(enum.Enum):
     INCORRECT_JSON_DECODER = "Request was not properly send with json."
     UNKOWN_REQUEST_TYPE = "Unkown request type."
     INCORRECT_FORMAT = "The request is not in the required format. See the documentation for correct format."
+    TOO_MANY_CONNECTIONS = "The interface is handling the maximum amount of connections. Try again later."
 
 
@@ -27,17 +27,50 @@ Description: A class which represents a .txt file containing the DAB message.
 Changelog: Alfred created the file.
            Frank added different field values to it. The fields category, status, coordinates, valid, sent_to_onboard_systems and time_of_arrival are added by Frank.
            Frank also changed set_information to support different category messages.
+           Frank changed set_lines to only split the header in lines. The rest of the file is kept as one bytes object.
+           Frank added __slots__, so a File does not have a __dict__. The body can be evicted to disk by the BodyCache of the Folder.
+           Frank added time_of_confirmation and expires, which are used by Retention to decide when a file can be archived.
+           Frank added stored, so a body that is on disk already is not written again when it is evicted.
+           Frank made set_information leave the encoding of the lines to the first request of the file.
 '''
 
+import json
+import msgpack
+import re
+from datetime import datetime
 import time
 import os
 from Status import Status
 from Category import Category
 
 class File:
+    # The fields that can be used to find files with Folder.find_files_by_field.
+    FIELDS = ("filename", "lines", "dab_id", "message_type", "category", "coordinates", "status", "valid", "sent_to_onboard_systems", "time_of_arrival", "sequence_number")
+    # The fields the Folder keeps an index of. When these fields change the Folder needs to be notified.
+    INDEXED_FIELDS = ("status", "category", "valid", "sent_to_onboard_systems")
+    # The fields that are written to the journal of the Folder when they change.
+    JOURNALED_FIELDS = INDEXED_FIELDS + ("time_of_confirmation",)
+    # The amount of lines at the start of a file that contain the dab_id, message_type and category.
+    HEADER_LENGTH = 3
+    # A location message also contains the coordinates in its header.
+    LOCATION_HEADER_LENGTH = 5
+    # Finds the time a CAP alert expires, with or without the namespace prefix
+    EXPIRES_PATTERN = re.compile(rb"<(?:\w+:)?expires>\s*([^<]+?)\s*</(?:\w+:)?expires>")
+
+    # A lot of files are kept for the life of the process, so the attributes are stored in slots instead of a __dict__.
+    __slots__ = ("filename", "header", "body", "evicted", "stored", "dab_id", "message_type", "category", "coordinates", "status", "valid", 
+                 "sent_to_onboard_systems", "time_of_arrival", "time_of_confirmation", "expires", "folder", "sequence_number", "encoded_lines", "packed_lines")
+
     def __init__(self, filename, status=Status.CONFIRMING, category=Category.OTHER):
         self.filename = filename
-        self.lines = []
+        # The header lines of the file. The lines after the header are kept as one bytes object in body, 
+        # because a large body would otherwise be kept as a lot of separate strings. body is None when there are no lines after the header.
+        self.header = []
+        self.body = None
+        # True when the body is written to disk by the BodyCache of the folder and removed from memory.
+        self.evicted = False
+        # True when the body is written to the body store on disk by the FolderJournal, so it can be evicted without writing it.
+        self.stored = False
         self.dab_id = 0
         self.message_type = 0
         self.category = category
@@ -46,37 +79,182 @@ class File:
         self.valid = True
         self.sent_to_onboard_systems = False
         self.time_of_arrival = time.time()
+        # The time the status changed to CONFIRMED
+        self.time_of_confirmation = None
+        # The time a CAP alert expires. None when the file does not expire.
+        self.expires = None
+        # The Folder that has this file in its index
+        self.folder = None
+        # The position of the file in the order files were added to the Folder. Is given by the Folder.
+        self.sequence_number = None
+        # lines encoded as json. Is encoded the first time it is needed, so the onboard interface does not encode the lines for every request.
+        self.encoded_lines = None
+        # lines encoded as MessagePack. Is only encoded when a client asks for MessagePack.
+        self.packed_lines = None
+
+    """
+        The lines of the file. Are built from the header and the body, so only use it when all lines are needed.
+    """
+    @property
+    def lines(self):
+        body = self.get_body()
+
+        if body is None:
+            return list(self.header)
+        return self.header + body.decode().split("\n")
 
+    @lines.setter
+    def lines(self, lines):
+        header_length = self.get_header_length(lines)
+        self.header = list(lines[:header_length])
+        self.body = "\n".join(lines[header_length:]).encode() if len(lines) > header_length else None
+        self.evicted = False
+        self.stored = False
+
+        self.encoded_lines = None
+        self.packed_lines = None
+
+    """
+        Get the amount of header lines of a file that starts with lines. 
+    """
+    def get_header_length(self, lines):
+        if len(lines) > 2 and lines[2] == Category.LOCATION.value:
+            return self.LOCATION_HEADER_LENGTH
+        return self.HEADER_LENGTH
+
+    """
+        Read the file. Only the header is read line by line, the rest of the file is read at once. 
+        So the time it takes does not grow with the amount of lines in the body.
+    """
     def set_lines(self, path):
+        header = []
+
         with open(str(path+self.filename), 'rt') as my_file: 
-            for my_line in my_file: 
-                # add the line to lines without the lineseperator in the string. Works for all operating systems
-                self.lines.append(my_line.strip(os.linesep))
+            while len(header) < self.get_header_length(header):
+                my_line = my_file.readline()
+                if not my_line:
+                    break
+
+                # add the line to header without the lineseperator in the string. Works for all operating systems
+                header.append(my_line.strip(os.linesep))
+
+            body = my_file.read()
+
+        self.header = header
+        # The body is split on the lineseperator when the lines are needed, so the lineseperator after the last line is left out.
+        self.body = body[:-1].encode() if body.endswith("\n") else (body.encode() if body else None)
+        self.evicted = False
+        self.stored = False
+
+        self.encoded_lines = None
+        self.packed_lines = None
 
     """
         This method will extract the data from the lines and put it in the corresponding field.
     """
     def set_information(self):
-        self.dab_id = int(self.lines[0])
-        self.message_type = int(self.lines[1])
-        self.category = Category(self.lines[2]) 
+        old_dab_id = self.dab_id
+        old_category = self.category
+
+        self.dab_id = int(self.header[0])
+        self.message_type = int(self.header[1])
+        self.category = Category(self.header[2]) 
+
+        self.notify_folder("dab_id", old_dab_id)
+        self.notify_folder("category", old_category)
+
+        if len(self.header) > 3 and self.category == Category.LOCATION:  
+            self.coordinates = (float(self.header[3]), float(self.header[4]))
+
+        if self.category == Category.CAP:
+            self.expires = self.find_expires(self.body)
+
+        # The lines are encoded the first time the file is requested, so reading a file does not take longer for a larger body
+        self.encoded_lines = None
+        self.packed_lines = None
 
-        if len(self.lines) > 3 and self.category == Category.LOCATION:  
-            self.coordinates = (float(self.lines[3]), float(self.lines[4]))
+    """
+        Find the time the CAP alert in body expires as a timestamp. Returns None when the alert does not contain a valid expires.
+    """
+    def find_expires(self, body):
+        match = self.EXPIRES_PATTERN.search(body) if body is not None else None
+        if match is None:
+            return None
+
+        try:
+            return datetime.fromisoformat(match.group(1).decode()).timestamp()
+        except ValueError:
+            return None
+
+    """
+        Let the folder know that the value of field changed, so it can update its index.
+    """
+    def notify_folder(self, field, old_value):
+        if self.folder is not None:
+            self.folder.file_changed(self, field, old_value)
 
     def set_status(self, status):
         if type(status) == type(self.status):
+            old_status = self.status
             self.status = status
+            self.notify_folder("status", old_status)
+
+            if status == Status.CONFIRMED and old_status != Status.CONFIRMED:
+                old_time_of_confirmation = self.time_of_confirmation
+                self.time_of_confirmation = time.time()
+                self.notify_folder("time_of_confirmation", old_time_of_confirmation)
 
     def set_valid(self, valid):
+        old_valid = self.valid
         self.valid = valid
+        self.notify_folder("valid", old_valid)
 
     def set_sent_to_onboard_systems(self, sent):
+        old_sent = self.sent_to_onboard_systems
         self.sent_to_onboard_systems = sent
+        self.notify_folder("sent_to_onboard_systems", old_sent)
 
     def get_lines(self):
         return self.lines
 
+    def get_header(self):
+        return self.header
+
+    """
+        Get the body of the file. When the body is evicted it is read from disk.
+    """
+    def get_body(self):
+        body = self.body
+        if self.evicted:
+            body = self.folder.body_cache.load(self)
+        return body
+
+    """
+        The encoded lines can be removed by the BodyCache at any moment, so they are kept in a local variable.
+    """
+    def get_encoded_lines(self):
+        encoded_lines = self.encoded_lines
+        if encoded_lines is None:
+            encoded_lines = self.encoded_lines = json.dumps(self.lines)
+
+        self.notify_body_cache()
+        return encoded_lines
+
+    def get_packed_lines(self):
+        packed_lines = self.packed_lines
+        if packed_lines is None:
+            packed_lines = self.packed_lines = msgpack.packb(self.lines)
+
+        self.notify_body_cache()
+        return packed_lines
+
+    """
+        Let the BodyCache of the folder know that the body or encoded lines are used, so they are evicted last.
+    """
+    def notify_body_cache(self):
+        if self.folder is not None and self.folder.body_cache is not None:
+            self.folder.body_cache.touch(self)
+
     def get_dab_id(self):
         return self.dab_id
 
@@ -101,3 +279,12 @@ class File:
     def get_time_of_arrival(self):
         return self.time_of_arrival
 
+    def get_time_of_confirmation(self):
+        return self.time_of_confirmation
+
+    def get_expires(self):
+        return self.expires
+
+    def get_sequence_number(self):
+        return self.sequence_number
+
@@ -27,6 +27,9 @@ Description: A class which represents a folder which contains File objects.
 Changelog: Alfred created the file.
            Frank added the methods: find_file_by_dab_id, find_files_by_field and update_file.
            He also added a lock to prevent error when the half-duplex system and interface are accessing the folder at the same time.
+           Frank added remove_files, so old files can be moved to the FolderArchive.
+           Frank made add_file call the other file listeners when one of them fails.
+           Frank made the BodyCache write the evicted bodies after the lock is released instead of while holding it.
 '''
 
 from File import File
@@ -37,6 +40,32 @@ class Folder:
         self.lock = threading.Lock()
         self.path = path
         self.files = []
+        # Callables that are called with the File whenever update_file changes the status of a file.
+        self.status_listeners = []
+        # Callables that are called with the File whenever a file is added with add_file.
+        self.file_listeners = []
+        # When set every added file and every change to a file is written to the journal. See FolderJournal.
+        self.journal = None
+        # When set the bodies of the files that are not used recently are evicted to disk. See BodyCache.
+        self.body_cache = None
+        # When set the files that are removed by Retention are moved to the archive. See FolderArchive.
+        self.archive = None
+
+        """
+            Indexes of the files, so finding files does not require looping through all the files.
+            files_by_dab_id contains the first file for every dab_id. indexes contains for every field in File.INDEXED_FIELDS
+            a dict which maps every value of that field to the files with that value. positions contains the position of every file in files.
+            Positions only go up, so they stay in the right order when files are removed.
+            The indexes are synchronized with files when files is searched, so files can still be appended to directly.
+        """
+        self.indexed_files = None
+        self.indexed_count = 0
+        self.next_position = 0
+        # The sequence number the next file that is added gets. Sequence numbers only go up, so files can be requested since a sequence number.
+        self.next_sequence_number = 1
+        self.files_by_dab_id = {}
+        self.positions = {}
+        self.indexes = {}
 
     def get_path(self):
         return self.path
@@ -47,33 +76,195 @@ class Folder:
     def get_list_files(self):
         return self.files
 
+    def add_status_listener(self, listener):
+        self.status_listeners.append(listener)
+
+    def add_file_listener(self, listener):
+        self.file_listeners.append(listener)
+
+    def add_file(self, file):
+        with self.lock:
+            self.files.append(file)
+            self.sync_index()
+
+            if self.journal is not None:
+                self.journal.file_added(file)
+
+        self.evict_bodies()
+
+        # A failing listener must not stop the other listeners, the file is stored already
+        for listener in self.file_listeners:
+            try:
+                listener(file)
+            except Exception as e:
+                print(e)
+
+    """
+        Add the files that are appended to files since the last synchronization to the indexes. 
+        The indexes are rebuilt when files was replaced by a different list or files were removed from it.
+        Must be called while holding the lock.
+    """
+    def sync_index(self):
+        if self.files is not self.indexed_files or len(self.files) < self.indexed_count:
+            self.indexed_files = self.files
+            self.indexed_count = 0
+            self.next_position = 0
+            self.files_by_dab_id = {}
+            self.positions = {}
+            self.indexes = {field: {} for field in File.INDEXED_FIELDS}
+
+        for file in self.files[self.indexed_count:]:
+            self.index_file(file, self.next_position)
+            self.next_position += 1
+
+        self.indexed_count = len(self.files)
+
+    def index_file(self, file, position):
+        file.folder = self
+
+        if file.sequence_number is None:
+            file.sequence_number = self.next_sequence_number
+        self.next_sequence_number = max(self.next_sequence_number, file.sequence_number + 1)
+
+        self.positions[id(file)] = position
+        self.files_by_dab_id.setdefault(file.dab_id, file)
+
+        for field in File.INDEXED_FIELDS:
+            self.indexes[field].setdefault(getattr(file, field), {})[id(file)] = file
+
+        # The bodies are only written to disk after the lock is released, by evict_bodies
+        if self.body_cache is not None:
+            self.body_cache.touch(file, evict=False)
+
+    """
+        Evict the bodies that the BodyCache chose to evict while the lock was held. Must be called without holding the lock.
+    """
+    def evict_bodies(self):
+        if self.body_cache is not None:
+            self.body_cache.evict_victims()
+
+    """
+        Remove files from the folder. Only the removed files are taken out of the indexes, so removing a few files does not rebuild the indexes.
+        Returns the files that were removed.
+    """
+    def remove_files(self, files):
+        with self.lock:
+            self.sync_index()
+
+            removed_files = {id(file): file for file in files if id(file) in self.positions}
+            if not removed_files:
+                return []
+
+            # Change the list itself, so it stays the list that is indexed
+            self.files[:] = [file for file in self.files if id(file) not in removed_files]
+            self.indexed_count = len(self.files)
+
+            removed_dab_ids = set()
+            for file in removed_files.values():
+                del self.positions[id(file)]
+
+                for field in File.INDEXED_FIELDS:
+                    index = self.indexes[field]
+                    files_with_value = index.get(getattr(file, field), {})
+                    files_with_value.pop(id(file), None)
+
+                    if not files_with_value:
+                        index.pop(getattr(file, field), None)
+
+                if self.files_by_dab_id.get(file.dab_id) is file:
+                    del self.files_by_dab_id[file.dab_id]
+                    removed_dab_ids.add(file.dab_id)
+
+                if self.journal is not None:
+                    self.journal.file_removed(file)
+
+                if self.body_cache is not None:
+                    self.body_cache.remove(file)
+
+                file.folder = None
+
+            # Another file with the same dab_id becomes the first file with that dab_id
+            for file in self.files:
+                if file.dab_id in removed_dab_ids:
+                    self.files_by_dab_id.setdefault(file.dab_id, file)
+
+        self.evict_bodies()
+        return list(removed_files.values())
+
+    """
+        This method is called by a File when one of its indexed fields changed. It moves the file to the right place in the index.
+    """
+    def file_changed(self, file, field, old_value):
+        with self.lock:
+            if self.journal is not None and field in File.JOURNALED_FIELDS:
+                self.journal.file_changed(file, field)
+
+            # The file is not (or no longer) part of the index. It will be added with its new values when the index is synchronized.
+            if self.positions.get(id(file)) is None or self.indexed_files is not self.files:
+                return
+
+            new_value = getattr(file, field)
+
+            if field == "dab_id":
+                # Another file could have the old dab_id as well. This rarely happens, so rebuild the indexes at the next synchronization.
+                self.indexed_files = None
+            elif field in self.indexes:
+                index = self.indexes[field]
+                files_with_old_value = index.get(old_value, {})
+                files_with_old_value.pop(id(file), None)
+
+                if not files_with_old_value:
+                    index.pop(old_value, None)
+
+                index.setdefault(new_value, {})[id(file)] = file
+
     def find_file_by_dab_id(self, dab_id):
-        for file in self.files:
-            if file.dab_id == dab_id:
-                return file
-            else:
-                continue
-        return False
+        with self.lock:
+            self.sync_index()
+            file = self.files_by_dab_id.get(dab_id)
+
+        self.evict_bodies()
+        return file if file else False
 
     """
-        Pass along a field and a value to find and return the first file that matches those values.
+        Pass along a field and a value to find and return all the files that matches those values. In the order they were added.
     """
     def find_files_by_field(self, field, value):
-        found_files = []
-
         # If True field is not an attribute of File, so return False
-        if not field in vars(File("")).keys():
+        if not field in File.FIELDS:
             return False
 
-        for file in self.files:
-            with self.lock:
-                attributes = vars(file)
+        with self.lock:
+            self.sync_index()
 
-            if attributes[field] == value:
-                found_files.append(file)
+            if field in self.indexes:
+                found_files = list(self.indexes[field].get(value, {}).values())
+                found_files.sort(key=lambda file: self.positions[id(file)])
             else:
-                continue
-        
+                found_files = [file for file in self.files if getattr(file, field) == value]
+
+        self.evict_bodies()
+        return found_files
+
+    """
+        Return the files with a sequence number higher than sequence_number. Files are in the order of their sequence number, 
+        so the first of those files is found with a binary search and only the new files are looped through.
+    """
+    def find_files_since(self, sequence_number):
+        with self.lock:
+            self.sync_index()
+
+            low, high = 0, len(self.files)
+            while low < high:
+                middle = (low + high) // 2
+                if self.files[middle].sequence_number <= sequence_number:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            found_files = self.files[low:]
+
+        self.evict_bodies()
         return found_files
 
     """
@@ -90,10 +281,15 @@ class Folder:
         for field_in_file, value in kwargs.items():
             if field_in_file == "status":
                 file.set_status(value)
+
+                for listener in self.status_listeners:
+                    listener(file)
             elif field_in_file == "valid":
                 file.set_valid(value)
 
-        
+    def set_status(self, dab_id, status):
+        self.update_file(dab_id, status=status)
+
     # def set_list_files(self):
     #     files = []
     #     for x in os.listdir(self.path):
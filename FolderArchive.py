@@ -0,0 +1,109 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: An archive on disk for the files that are removed from a Folder by Retention. Every archived file is appended as one line of json,
+             so the archive does not take memory. The onboard interface can still request the archived files with an archive request,
+             for which the archive is read from disk.
+
+Changelog: Frank created the file.
+           Frank added get_dab_ids for the backfill at startup.
+           Frank added contains_dab_id with a cached set of the dab_ids, so an archived message that is received again is not acknowledged again.
+           Frank made only the dab_ids of the archived files that were acknowledged count, so a message that was never acknowledged is acknowledged when it is received again.
+'''
+
+import json
+import os
+import threading
+
+from FolderJournal import file_to_record, record_to_file
+from Status import Status
+
+# The statuses of an archived file that was acknowledged. Retention also archives files that were never acknowledged.
+HANDLED_STATUSES = (Status.CONFIRMED, Status.CONFIRMATION_SENT)
+
+class FolderArchive:
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        # The dab_ids of the archived files that were acknowledged. Is read from disk the first time it is needed and kept up to date by add_files.
+        self.dab_ids = None
+
+    """
+        Append files to the archive. The files are written with one fsync, so they are on disk before they are removed from the Folder.
+    """
+    def add_files(self, files):
+        records = "".join(json.dumps(file_to_record(file)) + "\n" for file in files)
+
+        with self.lock:
+            os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+            with open(self.filename, mode='a', encoding='utf-8') as archive_file:
+                archive_file.write(records)
+                archive_file.flush()
+                os.fsync(archive_file.fileno())
+
+            if self.dab_ids is not None:
+                self.dab_ids.update(file.dab_id for file in files if file.status in HANDLED_STATUSES)
+
+    """
+        Read the archived files with category that were added after the file with sequence number since, in the order they were added.
+        When category or since is None the files are not filtered on it. A line that can not be read is skipped.
+    """
+    def find_files(self, category=None, since=None):
+        records = {}
+
+        with self.lock:
+            if not os.path.exists(self.filename):
+                return []
+
+            with open(self.filename, mode='r', encoding='utf-8') as archive_file:
+                for line in archive_file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+                    if category is not None and record["category"] != category.value:
+                        continue
+                    if since is not None and record["sequence_number"] <= since:
+                        continue
+
+                    # A file can be archived twice when the system stopped before its removal was written to the journal
+                    records[record["sequence_number"]] = record
+
+        return [record_to_file(records[sequence_number]) for sequence_number in sorted(records)]
+
+    """
+        Get the dab_ids of the archived files that were acknowledged, without building the files themselves.
+    """
+    def get_dab_ids(self):
+        with self.lock:
+            return set(self.load_dab_ids())
+
+    """
+        Check if a file with dab_id was acknowledged before it was archived. Only reads the archive the first time.
+    """
+    def contains_dab_id(self, dab_id):
+        with self.lock:
+            return dab_id in self.load_dab_ids()
+
+    """
+        Read the dab_ids of the archived files into the cache when it is not read yet. Must be called while holding the lock.
+    """
+    def load_dab_ids(self):
+        if self.dab_ids is not None:
+            return self.dab_ids
+
+        self.dab_ids = set()
+        if not os.path.exists(self.filename):
+            return self.dab_ids
+
+        with open(self.filename, mode='r', encoding='utf-8') as archive_file:
+            for line in archive_file:
+                try:
+                    record = json.loads(line)
+                    if Status(record["status"]) in HANDLED_STATUSES:
+                        self.dab_ids.add(record["dab_id"])
+                except (json.JSONDecodeError, KeyError, ValueError):
+                    continue
+
+        return self.dab_ids
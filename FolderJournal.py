@@ -0,0 +1,315 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: A thread that makes the state of the files in a Folder survive a restart. Every change of a File is appended to a journal.
+             The journal is written in batches, so all the changes that came in while writing the previous batch are written with one fsync.
+             When the journal grows too long a snapshot of the complete Folder is written and the journal is started over.
+             At startup the snapshot and the journal are read to restore the files in the Folder.
+             The journal and the snapshot only contain the header and the state of a file. The body is written once to the body store,
+             which is the directory of the BodyCache of the Folder. So a snapshot does not write the bodies again, an evicted body does not
+             need to be written again and the recovered files only read their body from the store when it is needed.
+
+Changelog: Frank created the file.
+           Frank moved the bodies out of the journal and the snapshot and stopped writing a snapshot at every startup.
+           Frank made the journal share its body store with the BodyCache and recover the bodies lazily.
+'''
+
+import json
+import os
+import threading
+
+from BodyCache import BodyCache
+from Category import Category
+from File import File
+from Status import Status
+
+"""
+    Convert a File to a dict that can be written as json.
+"""
+def file_to_record(file):
+    record = file_to_record_without_lines(file)
+    record["lines"] = file.lines
+    return record
+
+def file_to_record_without_lines(file):
+    return {
+        "op": "add",
+        "filename": file.filename,
+        "dab_id": file.dab_id,
+        "message_type": file.message_type,
+        "category": file.category.value,
+        "coordinates": list(file.coordinates),
+        "status": file.status.value,
+        "valid": file.valid,
+        "sent_to_onboard_systems": file.sent_to_onboard_systems,
+        "time_of_arrival": file.time_of_arrival,
+        "time_of_confirmation": file.time_of_confirmation,
+        "expires": file.expires,
+        "sequence_number": file.sequence_number,
+    }
+
+"""
+    Convert a File to a dict for the journal. Only the header is included, the body is referred to by the dab_id of the file.
+"""
+def file_to_journal_record(file):
+    record = file_to_record_without_lines(file)
+    record["header"] = list(file.header)
+    record["body"] = file.body is not None or file.evicted
+    return record
+
+"""
+    Convert a dict written by file_to_record or file_to_journal_record back to a File.
+    The body of a journal record is not restored, the FolderJournal reads it from its own file.
+"""
+def record_to_file(record):
+    file = File(record["filename"], status=Status(record["status"]), category=Category(record["category"]))
+    if "lines" in record:
+        file.lines = record["lines"]
+    else:
+        file.header = list(record["header"])
+    file.dab_id = record["dab_id"]
+    file.message_type = record["message_type"]
+    file.coordinates = tuple(record["coordinates"])
+    file.valid = record["valid"]
+    file.sent_to_onboard_systems = record["sent_to_onboard_systems"]
+    file.time_of_arrival = record["time_of_arrival"]
+    file.time_of_confirmation = record.get("time_of_confirmation")
+    file.expires = record.get("expires")
+    file.sequence_number = record.get("sequence_number")
+
+    return file
+
+"""
+    Convert the value of a field of a File so it can be written as json.
+"""
+def field_to_record(field, value):
+    if field == "status" or field == "category":
+        return value.value
+    return value
+
+class FolderJournal(threading.Thread):
+    def __init__(self, directory, snapshot_interval=1000):
+        threading.Thread.__init__(self, daemon=True)
+        self.directory = directory
+        self.journal_filename = os.path.join(directory, "journal.log")
+        self.snapshot_filename = os.path.join(directory, "snapshot.json")
+        # The BodyCache of the folder, or a BodyCache of its own when the folder does not have one. Is set by recover.
+        self.body_store = None
+        # The amount of records in the journal after which a snapshot is written.
+        self.snapshot_interval = snapshot_interval
+
+        self.folder = None
+        self.condition = threading.Condition()
+        self.pending_records = []
+        # The added files with the body that still has to be written to the body store
+        self.pending_bodies = []
+        self.records_in_journal = 0
+        # The amount of records that are appended and the amount that are written to disk. Used to wait until a record is written.
+        self.appended_count = 0
+        self.written_count = 0
+        self.running = True
+
+    """
+        Restore the files of folder from the snapshot and the journal. After that every change to folder is written to the journal.
+        Files that were being confirmed when the system stopped are marked as UNCONFIRMED, so they will be retried.
+    """
+    def recover(self, folder):
+        os.makedirs(self.directory, exist_ok=True)
+        self.body_store = folder.body_cache if folder.body_cache is not None else BodyCache(os.path.join(self.directory, "bodies"))
+
+        files = {}
+        for record in self.read_records():
+            if record.get("op") == "add":
+                files[record["dab_id"]] = record
+            elif record.get("op") == "update" and record.get("dab_id") in files:
+                files[record["dab_id"]][record["field"]] = record["value"]
+            elif record.get("op") == "remove":
+                files.pop(record.get("dab_id"), None)
+
+        recovered_files = []
+        for record in files.values():
+            file = record_to_file(record)
+            if record.get("body"):
+                self.recover_body(file, folder)
+
+            if file.status == Status.CONFIRMING:
+                file.status = Status.UNCONFIRMED
+
+            recovered_files.append(file)
+
+        folder.files = recovered_files + folder.files
+        folder.journal = self
+        self.folder = folder
+
+        print(f"Recovered {len(recovered_files)} files from {self.directory}")
+        return recovered_files
+
+    """
+        The body of a recovered file is in the body store. When the folder has a BodyCache the file is marked as evicted,
+        so the body is only read when it is needed. Otherwise the body is read right away.
+    """
+    def recover_body(self, file, folder):
+        file.stored = True
+        if folder.body_cache is not None:
+            file.evicted = True
+            return
+
+        try:
+            file.body = self.body_store.load(file)
+        except OSError as e:
+            print(e)
+            file.stored = False
+
+    """
+        Read the records of the snapshot followed by the records of the journal.
+        A record that can not be read is skipped. This happens when the system stopped while writing the last record.
+    """
+    def read_records(self):
+        records = []
+
+        if os.path.exists(self.snapshot_filename):
+            with open(self.snapshot_filename, mode='r', encoding='utf-8') as snapshot_file:
+                records.extend(json.load(snapshot_file)["files"])
+
+        if os.path.exists(self.journal_filename):
+            with open(self.journal_filename, mode='r', encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+
+        return records
+
+    """
+        This method is called by the Folder when a file is added.
+    """
+    def file_added(self, file):
+        record = file_to_journal_record(file)
+        with self.condition:
+            if record["body"]:
+                self.pending_bodies.append((file, file.get_body()))
+            self.pending_records.append(record)
+            self.appended_count += 1
+            self.condition.notify_all()
+
+    """
+        This method is called by the Folder when a field of a file changed.
+    """
+    def file_changed(self, file, field):
+        self.append({"op": "update", "dab_id": file.dab_id, "field": field, "value": field_to_record(field, getattr(file, field))})
+
+    """
+        This method is called by the Folder when a file is removed.
+    """
+    def file_removed(self, file):
+        self.append({"op": "remove", "dab_id": file.dab_id, "sequence_number": file.sequence_number})
+
+    """
+        Queue a record to be written. Does not wait for the record to be written, so updating a file is never slowed down by the disk.
+    """
+    def append(self, record):
+        with self.condition:
+            self.pending_records.append(record)
+            self.appended_count += 1
+            self.condition.notify_all()
+
+    """
+        Wait until all the records appended before calling this method are written to disk.
+    """
+    def flush(self):
+        with self.condition:
+            target = self.appended_count
+            while self.written_count < target and self.running:
+                self.condition.wait()
+
+    def stop(self):
+        self.flush()
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    """
+        Write the bodies of the added files to the body store before the records that refer to them.
+        A body that is stored already, for example by a snapshot, is not written again.
+    """
+    def write_bodies(self, bodies):
+        for file, body in bodies:
+            if not file.stored:
+                self.body_store.write_body(file, body, sync=True)
+                file.stored = True
+
+    """
+        Remove the bodies of the removed files from the body store after the records that remove them are written.
+    """
+    def remove_bodies(self, records):
+        for record in records:
+            if record.get("op") == "remove" and record.get("sequence_number") is not None:
+                self.body_store.remove_body(record["sequence_number"])
+
+    def write_records(self, records):
+        with open(self.journal_filename, mode='a', encoding='utf-8') as journal_file:
+            journal_file.write("".join(json.dumps(record) + "\n" for record in records))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+        self.records_in_journal += len(records)
+
+    """
+        Write the current state of all the files to a new snapshot and start a new empty journal.
+        The snapshot is written to a temporary file first, so a crash never leaves a half written snapshot behind.
+        Only the list of files is copied while holding the lock of the folder, so the folder is not blocked while the records are built.
+    """
+    def write_snapshot(self):
+        with self.folder.lock:
+            files = list(self.folder.files)
+
+        # The snapshot can contain files of which the record, and so the body, is not written yet. Their bodies are written first.
+        for file in files:
+            body = file.body
+            if body is not None and not file.stored:
+                self.body_store.write_body(file, body, sync=True)
+                file.stored = True
+
+        records = [file_to_journal_record(file) for file in files]
+
+        temporary_filename = self.snapshot_filename + ".tmp"
+        with open(temporary_filename, mode='w', encoding='utf-8') as snapshot_file:
+            json.dump({"files": records}, snapshot_file)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+
+        os.replace(temporary_filename, self.snapshot_filename)
+
+        # The snapshot contains everything in the journal, so the journal can be emptied.
+        open(self.journal_filename, mode='w').close()
+        self.records_in_journal = 0
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending_records:
+                    self.condition.wait()
+
+                if not self.running:
+                    return
+
+                records = self.pending_records
+                bodies = self.pending_bodies
+                self.pending_records = []
+                self.pending_bodies = []
+
+            try:
+                self.write_bodies(bodies)
+                self.write_records(records)
+                self.remove_bodies(records)
+
+                if self.records_in_journal >= self.snapshot_interval:
+                    self.write_snapshot()
+            except OSError as e:
+                print(e)
+
+            with self.condition:
+                self.written_count += len(records)
+                self.condition.notify_all()
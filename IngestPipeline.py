@@ -0,0 +1,267 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: A pipeline that handles the DAB files detected by the observer in stages, so the observer thread never waits for a slow device.
+             1. The observer submits the path of every event. A path is only passed on when the file is closed after writing
+                or did not change for settle_time seconds, so a file that is still being written is never read.
+                Events for a path that is already waiting are merged into one.
+             2. Parser workers read the settled files and store them in the Folder.
+             3. Ack workers acknowledge the stored files. A file with a dab_id that is already being acknowledged is skipped.
+             Every stage has a maximum size. When a stage is full the previous stage waits, the time it waited is kept in the metrics.
+
+Changelog: Frank created the file.
+'''
+
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class PendingPath:
+    """A path that waits until the file is settled."""
+    __slots__ = ("deadline", "signature", "closed")
+
+    def __init__(self, deadline):
+        # The time after which the file is checked again
+        self.deadline = deadline
+        # The size and modification time of the file at the previous check
+        self.signature = None
+        # True when the writer closed the file
+        self.closed = False
+
+class IngestPipeline:
+    def __init__(self, ingest_file, acknowledge_file, settle_time=0.5, max_pending=1000, max_queue_length=100, parser_workers=2, ack_workers=4):
+        # ingest_file reads the file at a path, stores it and returns the File or None. acknowledge_file acknowledges a File.
+        self.ingest_file = ingest_file
+        self.acknowledge_file = acknowledge_file
+        self.settle_time = settle_time
+        self.max_pending = max_pending
+        self.parser_workers = parser_workers
+        self.ack_workers = ack_workers
+
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.parse_queue = queue.Queue(maxsize=max_queue_length)
+        # The signature of the files that were read recently, so an event for a file that did not change is ignored
+        self.processed = OrderedDict()
+        self.max_processed = 1000
+
+        # The dab_ids that are being acknowledged and the amount of free places for files that wait to be acknowledged
+        self.in_flight = set()
+        self.ack_slots = threading.BoundedSemaphore(max_queue_length)
+        self.ack_executor = None
+
+        self.metrics = {
+            "events": 0,
+            "merged_events": 0,
+            "unchanged_files": 0,
+            "ingested": 0,
+            "parse_errors": 0,
+            "duplicate_dab_ids": 0,
+            "acknowledged": 0,
+            "max_pending": 0,
+            "max_parse_queue": 0,
+            "observer_wait": 0.0,
+            "settle_wait": 0.0,
+            "parser_wait": 0.0,
+        }
+        self.metrics_lock = threading.Lock()
+        self.running = True
+
+    def count(self, metric, amount=1):
+        with self.metrics_lock:
+            self.metrics[metric] += amount
+
+    """
+        Get the metrics together with the current amount of files in every stage.
+    """
+    def get_metrics(self):
+        with self.metrics_lock:
+            metrics = dict(self.metrics)
+
+        with self.condition:
+            metrics["pending"] = len(self.pending)
+            metrics["acks_in_flight"] = len(self.in_flight)
+        metrics["parse_queue"] = self.parse_queue.qsize()
+
+        return metrics
+
+    """
+        Get the size and modification time of the file at path. Returns None when the file does not exist (anymore).
+    """
+    def get_signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    """
+        Is called by the observer for every event of path. Waits when max_pending paths are waiting already.
+    """
+    def submit(self, path):
+        self.count("events")
+
+        with self.condition:
+            if path in self.pending:
+                # Writing to the file is not done yet, so wait settle_time again
+                self.pending[path].deadline = time.monotonic() + self.settle_time
+                self.count("merged_events")
+                return
+
+            started_waiting = time.monotonic()
+            while len(self.pending) >= self.max_pending and self.running:
+                self.condition.wait()
+            self.count("observer_wait", time.monotonic() - started_waiting)
+
+            self.pending[path] = PendingPath(time.monotonic() + self.settle_time)
+            with self.metrics_lock:
+                self.metrics["max_pending"] = max(self.metrics["max_pending"], len(self.pending))
+            self.condition.notify_all()
+
+    """
+        Is called by the observer when the writer closed the file at path. The file is settled, so it does not have to wait for settle_time.
+    """
+    def file_closed(self, path):
+        with self.condition:
+            if path not in self.pending:
+                self.submit(path)
+
+            self.pending[path].closed = True
+            self.pending[path].deadline = time.monotonic()
+            self.condition.notify_all()
+
+    """
+        Return the paths that are settled and remove them from pending. A file is settled when it is closed or when it did not change
+        between two checks that are settle_time apart. Files that do not exist anymore are forgotten.
+        Must be called while holding the condition.
+    """
+    def take_settled(self, now):
+        settled = []
+
+        for path, pending_path in list(self.pending.items()):
+            if pending_path.deadline > now:
+                continue
+
+            signature = self.get_signature(path)
+            if signature is None:
+                del self.pending[path]
+            elif pending_path.closed or signature == pending_path.signature:
+                settled.append((path, signature))
+                del self.pending[path]
+            else:
+                pending_path.signature = signature
+                pending_path.deadline = now + self.settle_time
+
+        if settled:
+            self.condition.notify_all()
+
+        return settled
+
+    """
+        Check if the file was read before with the same signature. Otherwise remember the signature.
+    """
+    def is_unchanged(self, path, signature):
+        with self.condition:
+            if self.processed.get(path) == signature:
+                return True
+
+            self.processed[path] = signature
+            self.processed.move_to_end(path)
+            if len(self.processed) > self.max_processed:
+                self.processed.popitem(last=False)
+
+            return False
+
+    def run_settler(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+
+                now = time.monotonic()
+                settled = self.take_settled(now)
+
+                if not settled:
+                    # Sleep until the first pending path has to be checked or a new path is submitted
+                    deadlines = [pending_path.deadline for pending_path in self.pending.values()]
+                    self.condition.wait(max(0, min(deadlines) - now) if deadlines else None)
+                    continue
+
+            for path, signature in settled:
+                if self.is_unchanged(path, signature):
+                    self.count("unchanged_files")
+                    continue
+
+                started_waiting = time.monotonic()
+                self.parse_queue.put(path)
+                self.count("settle_wait", time.monotonic() - started_waiting)
+
+                with self.metrics_lock:
+                    self.metrics["max_parse_queue"] = max(self.metrics["max_parse_queue"], self.parse_queue.qsize())
+
+    def run_parser(self):
+        while True:
+            path = self.parse_queue.get()
+            if path is None:
+                return
+
+            try:
+                file = self.ingest_file(path)
+            except (OSError, ValueError, IndexError) as e:
+                print(f"Could not read {path}: {e}")
+                self.count("parse_errors")
+                continue
+
+            if file is None:
+                continue
+            self.count("ingested")
+
+            with self.condition:
+                if file.get_dab_id() in self.in_flight:
+                    self.count("duplicate_dab_ids")
+                    continue
+                self.in_flight.add(file.get_dab_id())
+
+            # Wait until there is room for another file to acknowledge
+            started_waiting = time.monotonic()
+            self.ack_slots.acquire()
+            self.count("parser_wait", time.monotonic() - started_waiting)
+
+            self.ack_executor.submit(self.run_acknowledge, file)
+
+    def run_acknowledge(self, file):
+        try:
+            self.acknowledge_file(file)
+            self.count("acknowledged")
+        except Exception as e:
+            print(e)
+        finally:
+            with self.condition:
+                self.in_flight.discard(file.get_dab_id())
+            self.ack_slots.release()
+
+    def start(self):
+        self.ack_executor = ThreadPoolExecutor(max_workers=self.ack_workers)
+        self.threads = [threading.Thread(target=self.run_settler, daemon=True)]
+        self.threads += [threading.Thread(target=self.run_parser, daemon=True) for _ in range(self.parser_workers)]
+
+        for thread in self.threads:
+            thread.start()
+
+    """
+        Stop the pipeline. The files that are read already are still acknowledged.
+    """
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        for _ in range(self.parser_workers):
+            self.parse_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        self.ack_executor.shutdown(wait=True)
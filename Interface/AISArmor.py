@@ -0,0 +1,63 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: Converts between bytes and the 6-bit armored payload of AIS sentences, the same as BitVector with binary.bitvectoais6 from aisutils.
+             The 6-bit armoring splits the bits in groups of 6 like base64 does, only with a different alphabet. So the bits are grouped by
+             base64 and the base64 characters are replaced by the AIS characters with a precomputed translation table.
+             This is much faster than slicing a BitVector 6 bits at a time.
+
+Changelog: Frank created the file.
+'''
+
+import base64
+
+BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+# The character of every 6-bit value in an AIS payload, like binary.encode of aisutils
+AIS_ALPHABET = bytes(range(48, 88)) + bytes(range(96, 120))
+
+ARMOR_TABLE = bytes.maketrans(BASE64_ALPHABET, AIS_ALPHABET)
+DEARMOR_TABLE = bytes.maketrans(AIS_ALPHABET, BASE64_ALPHABET)
+# The 6-bit value of every AIS character, the other characters are None
+DEARMOR_VALUES = [None] * 256
+for value, character in enumerate(AIS_ALPHABET):
+    DEARMOR_VALUES[character] = value
+
+"""
+    Armor data as an AIS payload. Returns the payload and the amount of fill bits that were added to the last character.
+"""
+def armor(data):
+    payload = base64.b64encode(data).rstrip(b"=").translate(ARMOR_TABLE).decode("ascii")
+    return payload, -len(data) * 8 % 6
+
+"""
+    Armor text of which every character is sent as 8 bits, like BitVector(textstring=text).
+"""
+def armor_text(text):
+    return armor(text.encode("latin-1"))
+
+"""
+    Get the bytes of an AIS payload. Raises a ValueError when the payload contains an invalid character
+    or when the payload without its fill bits is not a whole amount of bytes.
+"""
+def dearmor(payload, fill_bits=0):
+    encoded_payload = payload.encode("ascii")
+    if any(DEARMOR_VALUES[character] is None for character in encoded_payload):
+        raise ValueError(f"{payload} is not a valid AIS payload")
+    if (len(payload) * 6 - fill_bits) % 8:
+        raise ValueError(f"A payload of {len(payload)} characters with {fill_bits} fill bits does not contain whole bytes")
+
+    base64_payload = encoded_payload.translate(DEARMOR_TABLE)
+    return base64.b64decode(base64_payload + b"=" * (-len(base64_payload) % 4))
+
+"""
+    Get the bits of an AIS payload as an int together with the amount of bits, without the fill bits.
+"""
+def dearmor_bits(payload, fill_bits=0):
+    value = 0
+    for character in payload.encode("ascii"):
+        character_value = DEARMOR_VALUES[character]
+        if character_value is None:
+            raise ValueError(f"{payload} is not a valid AIS payload")
+        value = value << 6 | character_value
+
+    return value >> fill_bits, len(payload) * 6 - fill_bits
@@ -4,25 +4,89 @@ author: Alfred Espinosa Encarnación, Frank Montenij
 Description: A class which represents an connection using Ethernet.
             
 Changelog: Alfred created the file and Frank rewrote write and read. Also Frank added a helper function pad_msg_length.
+           Frank added the keep alive mode, which reuses connections from a ConnectionPool instead of connecting for every message.
+           Frank limited the length of a reply, so a broken length does not allocate a lot of memory.
 '''
 
+import select
 import socket
 import json
+import threading
+import time
+
+from Interface.Framing import pad_msg_length, read_message, write_message
+
+# The maximum amount of bytes of a reply of the FiPy. A reply only contains the acknowledged dab_ids.
+MAX_REPLY_LENGTH = 1024 * 1024
 
 """
-    pad the var msg_length to the padding size. 
-    So that the message containing the msg_length has a fixed size of padding size.
+    A pool of open connections for every (ip_address, socket_port). 
+    A connection is only kept open when the server replied with "keep_alive": True, otherwise the server closes the connection after replying.
 """
-def pad_msg_length(padding_size, msg_length):
-    msg_length = str(msg_length).encode()
-    msg_length += b' ' * (padding_size - len(msg_length))
-    return msg_length
+class ConnectionPool:
+    def __init__(self, idle_timeout=30, max_idle_connections=2):
+        self.lock = threading.Lock()
+        self.idle_timeout = idle_timeout
+        self.max_idle_connections = max_idle_connections
+        # Contains for every address a list of (socket, time the socket was last used)
+        self.idle_connections = {}
+
+    """
+        A connection is healthy when it has not been idle for too long and the server did not close it.
+        A server that closed the connection makes the socket readable with no data to read.
+    """
+    def is_healthy(self, sock, last_used):
+        if time.monotonic() - last_used > self.idle_timeout:
+            return False
+
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if readable and not sock.recv(1, socket.MSG_PEEK):
+                return False
+        except (OSError, ValueError):
+            return False
+
+        return True
+
+    """
+        Return an idle healthy connection to address or None when there is none.
+    """
+    def acquire(self, address):
+        with self.lock:
+            connections = self.idle_connections.get(address, [])
+
+            while connections:
+                sock, last_used = connections.pop()
+                if self.is_healthy(sock, last_used):
+                    return sock
+                sock.close()
+
+        return None
+
+    def release(self, address, sock):
+        with self.lock:
+            connections = self.idle_connections.setdefault(address, [])
+
+            if len(connections) >= self.max_idle_connections:
+                sock.close()
+            else:
+                connections.append((sock, time.monotonic()))
+
+    def close(self, address):
+        with self.lock:
+            for sock, _ in self.idle_connections.pop(address, []):
+                sock.close()
+
+# The pool is shared, because one device (for example the FiPy) can be listed once for every technology it supports.
+connection_pool = ConnectionPool()
 
 class Ethernet:
     def __init__(self):
         self.ip_address = ""
         self.socket_port = 0
         self.sock = socket.socket()
+        # When True connections are reused for more than one message. The server needs to opt in by replying with "keep_alive": True.
+        self.keep_alive = False
 
     def get_ip_address(self):
         return self.ip_address
@@ -36,6 +100,12 @@ class Ethernet:
     def set_port(self, new_socket_port):
         self.socket_port = new_socket_port
 
+    def get_keep_alive(self):
+        return self.keep_alive
+
+    def set_keep_alive(self, keep_alive):
+        self.keep_alive = keep_alive
+
     def init_socket(self, ip_address, socket_port):
         self.ip_address = ip_address
         self.socket_port = socket_port
@@ -47,20 +117,54 @@ class Ethernet:
     def close_socket(self):
         self.sock.close()
 
+        if self.keep_alive:
+            connection_pool.close((self.ip_address, self.socket_port))
+
     """
         This method is used to send the confirmation_dict using the socket connection of this class.
         The method is also responsible for retrieving the reply message.
     """
     def write(self, dict, max_msg_length):
         buffer = json.dumps(dict)
-        self.sock.send(pad_msg_length(max_msg_length, len(buffer)))
-        self.sock.send(buffer.encode())
+        write_message(self.sock, buffer, max_msg_length)
     
     def read_socket(self, max_msg_length):
-        reply_length = self.sock.recv(max_msg_length).decode()
-        reply = self.sock.recv(int(reply_length)).decode()
+        reply = read_message(self.sock, max_msg_length, MAX_REPLY_LENGTH).decode()
         reply = reply.replace("'", '"') # Change from single quotes to double quotes otherwise loads crashes
         reply = json.loads(reply)
         print("Client Sent : ", reply)
 
-        return reply
\ No newline at end of file
+        return reply
+
+    """
+        This method sends data and returns the reply over a connection from the connection pool. When there is no connection
+        a new one is made. The data contains "keep_alive": True to ask the server to keep the connection open after replying.
+        When a reused connection turns out to be broken the request is sent again over a new connection.
+    """
+    def request(self, data, max_msg_length):
+        address = (self.ip_address, self.socket_port)
+        sock = connection_pool.acquire(address)
+        reused = sock is not None
+
+        if not reused:
+            self.init_socket(self.ip_address, self.socket_port)
+            self.connect_socket()
+            sock = self.sock
+
+        self.sock = sock
+        try:
+            self.write(dict(data, keep_alive=True), max_msg_length)
+            reply = self.read_socket(max_msg_length)
+        except (OSError, ValueError):
+            sock.close()
+
+            if reused:
+                return self.request(data, max_msg_length)
+            raise
+
+        if reply.get("keep_alive") == True:
+            connection_pool.release(address, sock)
+        else:
+            sock.close()
+
+        return reply
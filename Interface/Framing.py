@@ -0,0 +1,114 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: Functions to send and receive messages that are prefixed with their length. The length is sent as text padded with spaces
+             to a fixed size (max_msg_length). This is the format the FiPy, the onboard interface and its clients use.
+             TCP can return less bytes than asked for, so the receiving functions keep reading until the complete message is received.
+             The message is read into one preallocated buffer, so large messages are not built by concatenating bytes over and over.
+             Binary messages are prefixed with their length as a 4 byte unsigned big endian int instead.
+
+Changelog: Frank created the file and moved pad_msg_length from Ethernet.py to this file.
+           Frank added the functions for binary messages.
+           Frank added max_length to read_message, so a length that is not a number or too large is rejected before anything is allocated.
+'''
+
+import struct
+
+# The header of a binary message, which contains the length of the message
+BINARY_HEADER = struct.Struct("!I")
+
+"""
+    This error is raised when the connection is closed before the complete message is received.
+    It is a ConnectionError, so it is handled everywhere an OSError of a socket is handled.
+"""
+class ConnectionClosedError(ConnectionError):
+    def __init__(self, received):
+        super().__init__(f"Connection closed after receiving {received} bytes")
+        # The amount of bytes received before the connection closed
+        self.received = received
+
+"""
+    This error is raised when the length in front of a message is not a number or larger than the maximum length.
+    It is a ValueError, so it is handled everywhere a message that can not be parsed is handled.
+"""
+class InvalidLengthError(ValueError):
+    pass
+
+"""
+    pad the var msg_length to the padding size. 
+    So that the message containing the msg_length has a fixed size of padding size.
+"""
+def pad_msg_length(padding_size, msg_length):
+    msg_length = str(msg_length).encode()
+    msg_length += b' ' * (padding_size - len(msg_length))
+    return msg_length
+
+"""
+    Fill view with bytes received from sock. Raises ConnectionClosedError when the connection closes before view is full.
+"""
+def recv_into_exact(sock, view):
+    received = 0
+    size = len(view)
+
+    while received < size:
+        amount = sock.recv_into(view[received:], size - received)
+        if amount == 0:
+            raise ConnectionClosedError(received)
+        received += amount
+
+    return received
+
+"""
+    Receive exactly size bytes from sock.
+"""
+def recv_exact(sock, size):
+    buffer = bytearray(size)
+    recv_into_exact(sock, memoryview(buffer))
+    return buffer
+
+"""
+    Receive one message. First the length of the message is received, after that the message itself.
+    Raises InvalidLengthError when the length is not a number or larger than max_length, before the memory for the message is allocated.
+"""
+def read_message(sock, max_msg_length, max_length=None):
+    header = recv_exact(sock, max_msg_length)
+    try:
+        message_length = int(header)
+    except ValueError:
+        raise InvalidLengthError(f"The length {bytes(header)!r} is not a number")
+
+    if message_length < 0 or (max_length is not None and message_length > max_length):
+        raise InvalidLengthError(f"A message of {message_length} bytes is not allowed")
+
+    return recv_exact(sock, message_length)
+
+"""
+    Prefix message with its length padded to max_msg_length.
+"""
+def frame_message(message, max_msg_length):
+    if isinstance(message, str):
+        message = message.encode()
+
+    return pad_msg_length(max_msg_length, len(message)) + message
+
+"""
+    Send one message prefixed with its length. The length and message are sent with one sendall, so they are never sent partially.
+"""
+def write_message(sock, message, max_msg_length):
+    sock.sendall(frame_message(message, max_msg_length))
+
+"""
+    Prefix message with its length as a binary header.
+"""
+def frame_binary_message(message):
+    return BINARY_HEADER.pack(len(message)) + message
+
+"""
+    Receive one binary message. First the binary header is received, after that the message itself.
+"""
+def read_binary_message(sock):
+    (message_length,) = BINARY_HEADER.unpack(recv_exact(sock, BINARY_HEADER.size))
+    return recv_exact(sock, message_length)
+
+def write_binary_message(sock, message):
+    sock.sendall(frame_binary_message(message))
@@ -44,6 +44,9 @@ class I2C:
         self.target_address = target_address
         self.bus = SMBus(1)
 
+    def close_i2c(self):
+        self.bus.close()
+
     def list_i2c(self):
         for device in range(128):
             try:
@@ -6,36 +6,59 @@ Description: This is the interface which is able to receive requests of data tha
              First it will validate the message.
             
 Changelog: Frank created the file.
+           Frank added AsyncInterfaceOnboardSystems, which serves the same requests using asyncio instead of a thread per connection.
+           Frank added sessions. A connection that starts with a session request stays open for more requests until the client sends a disconnect request.
+           Frank added subscriptions. A connection that starts with a subscribe request receives every new file as soon as it is stored.
+           Frank added limit, offset and fields to the requests, so a client can receive the files in pages and only the fields it needs.
+           Frank added codecs. The first request of a connection can ask for MessagePack instead of JSON for all responses on that connection.
+           Frank added the archive request to request the files that Retention moved to the archive.
+           Frank made the asyncio interface close the connections over the limit right away and gave the subscriptions their own limit.
+           Frank limited the amount of requests of a session that wait to be handled by the threaded interface.
+           Frank made the threaded interface reject a request with a length that is not a number or too large, like the asyncio interface.
+           Frank made publish drop the subscriptions of which the event loop is closed.
 '''
 
+import asyncio
+import select
 import socket
 import threading
 import json
+from concurrent.futures import ThreadPoolExecutor
 from Error import Error
-from Request import CategoryRequest, LatestRequest, TestRequest
-from Interface.Ethernet import pad_msg_length
+from Codec import CODECS, JSON_CODEC, EncodedInformation
+from Request import PROJECTION_FIELDS, ArchiveRequest, CategoryRequest, LatestRequest, TestRequest
+from Subscription import Subscription
+from Interface.Framing import ConnectionClosedError, InvalidLengthError, read_message
 
 class ClientClosedConnectionError(Exception):
     """This error is raised when the client closes the connection without the disconnect message."""
 
 class InterfaceOnboardSystems(threading.Thread):
-    def __init__(self, folder, max_msg_length = 10):
+    def __init__(self, folder, max_msg_length = 10, host = "192.168.178.68", port = 8001, max_session_workers = 4, max_request_length = 65536):
         threading.Thread.__init__(self)
         self.folder = folder
         self.max_msg_length = max_msg_length
+        # Requests that are larger than any valid request are rejected before they are received
+        self.max_request_length = max_request_length
+        self.host = host
+        self.port = port
+        # The amount of requests of one session that are handled at the same time
+        self.max_session_workers = max_session_workers
+
+        # The subscriptions of the connected onboard systems. New files in the folder are offered to every subscription.
+        self.subscriptions = set()
+        self.subscriptions_lock = threading.Lock()
+        self.max_subscription_queue_length = 100
+        self.folder.add_file_listener(self.publish)
     
     def receive_message(self, conn):
-        # Receive the length of the request
-        message_length = conn.recv(self.max_msg_length).decode()
-        
-        # Check if they closed the connection the wrong way. If so raise an custom error
-        if len(message_length) == 0:
+        try:
+            # Receive the length of the request followed by the request itself
+            message = read_message(conn, self.max_msg_length, self.max_request_length).decode()
+        except ConnectionClosedError:
+            # Check if they closed the connection the wrong way. If so raise an custom error
             raise (ClientClosedConnectionError)
 
-        # Now you know that they sent a message and not an conn.close(), so convert the message_length to an int.
-        message_length = int(message_length)
-        message = conn.recv(message_length).decode()
-
         return message
 
     def extract_request(self, message):
@@ -62,22 +85,59 @@ class InterfaceOnboardSystems(threading.Thread):
                 return Error.INCORRECT_FORMAT
             elif "valid" in request_keys and not type(request["valid"]) == bool:
                 return Error.INCORRECT_FORMAT
+            elif "request_id" in request_keys and not type(request["request_id"]) in (int, str):
+                return Error.INCORRECT_FORMAT
+            elif "since" in request_keys and not (type(request["since"]) == int and request["since"] >= 0):
+                return Error.INCORRECT_FORMAT
+            elif "limit" in request_keys and not (type(request["limit"]) == int and request["limit"] > 0):
+                return Error.INCORRECT_FORMAT
+            elif "offset" in request_keys and not (type(request["offset"]) == int and request["offset"] >= 0):
+                return Error.INCORRECT_FORMAT
+            elif "fields" in request_keys and not self.is_valid_fields(request["fields"]):
+                return Error.INCORRECT_FORMAT
+            elif "codec" in request_keys and not (isinstance(request["codec"], str) and request["codec"] in CODECS):
+                return Error.INCORRECT_FORMAT
             else: 
                 return request
         else:
             return Error.INCORRECT_FORMAT
       
     
-    def send_error(self, conn, error):
-        error_message = json.dumps({"reply": False, "error_message": error.value})
+    """
+        Check if fields is a list of fields a client can ask for, without duplicates.
+    """
+    def is_valid_fields(self, fields):
+        return isinstance(fields, list) and len(fields) > 0 and all(field in PROJECTION_FIELDS for field in fields) and len(set(fields)) == len(fields)
 
-        self.send_response(conn, error_message)
-    
-    def send_response(self, conn, response):
-        response_length = pad_msg_length(self.max_msg_length, len(response))
+    """
+        Choose the codec the responses on a connection are encoded with. Is decided by the first request of the connection.
+    """
+    def choose_codec(self, dict_request):
+        if isinstance(dict_request, dict):
+            return CODECS[dict_request.get("codec", JSON_CODEC.name)]
+        return JSON_CODEC
+
+    def build_error(self, error, codec = JSON_CODEC):
+        return codec.encode({"reply": False, "error_message": error.value})
+
+    """
+        Put the request_id in the response, so the client knows which request the response belongs to. 
+        The codec puts it in without decoding the response again.
+    """
+    def add_request_id(self, response, request_id, codec = JSON_CODEC):
+        return codec.add_request_id(response, request_id)
 
-        conn.send(response_length)
-        conn.send(response.encode())
+    def is_request_type(self, dict_request, request_type):
+        return isinstance(dict_request, dict) and dict_request.get("request_type") == request_type
+
+    def send_error(self, conn, error, codec = JSON_CODEC):
+        error_message = self.build_error(error, codec)
+
+        self.send_response(conn, error_message, codec)
+    
+    def send_response(self, conn, response, codec = JSON_CODEC):
+        # The length and response are sent with one sendall, so they are never sent partially.
+        conn.sendall(codec.frame(response, self.max_msg_length))
 
     def close_connection(self, conn):
         print("[Client handler] closing connection ... ")
@@ -85,16 +145,94 @@ class InterfaceOnboardSystems(threading.Thread):
         print("[Client handler] connection closed")
         print()
 
-    def choose_request(self, request_type, category = [], valid = True, **kwargs):
+    def choose_request(self, request_type, category = [], valid = True, since = None, limit = None, offset = 0, fields = None, **kwargs):
         if request_type == "latest":
-            return LatestRequest(self.folder, valid)
+            return LatestRequest(self.folder, valid, since, limit, offset, fields)
         elif request_type == "by_category":
-            return CategoryRequest(self.folder, valid, category)
+            return CategoryRequest(self.folder, valid, category, since, limit, offset, fields)
+        elif request_type == "archive" and self.folder.archive is not None:
+            return ArchiveRequest(self.folder, valid, category if category else None, since, limit, offset, fields)
         elif request_type == "test":
             return TestRequest(self.folder)
         else:
             return Error.UNKOWN_REQUEST_TYPE
 
+    """
+        Validate the message, find the request it asks for and return the response to send back. 
+        When the message is invalid the response is an error message.
+    """
+    def handle_message(self, message):
+        # Validates the request. If the request would be invalid it could cause the interface to crash.
+        return self.handle_request(self.extract_request(message))
+
+    """
+        Find the request that dict_request asks for and return the response to send back.
+        dict_request is the result of extract_request, so it can be an Error as well.
+    """
+    def handle_request(self, dict_request, codec = JSON_CODEC):
+        if isinstance(dict_request, Error):
+            print("[Client handler] sent message invalid")
+            return self.build_error(dict_request, codec)
+        print("[Client handler] message is validated properly")
+
+        try:
+            request = self.choose_request(**dict_request)
+        except ValueError:
+            # For example a category that does not exist
+            print("[Client handler] request contains an invalid value!")
+            response = self.build_error(Error.INCORRECT_FORMAT, codec)
+        else:
+            if isinstance(request, Error):
+                print("[Client handler] request_type not found!")
+                response = self.build_error(request, codec)
+            else:
+                print("[Client handler] found request_type")
+                
+                information = request.parse()
+                response = request.build_response(information, codec)
+                print("[Client handler] request parsed")
+
+        if "request_id" in dict_request:
+            response = self.add_request_id(response, dict_request["request_id"], codec)
+
+        return response
+
+    def build_session_response(self, dict_request, codec = JSON_CODEC):
+        return self.add_request_id(codec.encode({"reply": True, "request_type": dict_request["request_type"]}), dict_request.get("request_id"), codec)
+
+    """
+        Offer a new file to all subscriptions. Is called by the folder when a file is added.
+        A subscription of which the event loop is closed is dropped.
+    """
+    def publish(self, file):
+        with self.subscriptions_lock:
+            subscriptions = list(self.subscriptions)
+
+        for subscription in subscriptions:
+            if not subscription.offer(file):
+                self.unsubscribe(subscription)
+
+    """
+        Create a subscription for the subscribe request dict_request. Returns an Error when the request contains an invalid value.
+    """
+    def subscribe(self, dict_request):
+        try:
+            subscription = Subscription(dict_request.get("category"), dict_request.get("valid", True), self.max_subscription_queue_length)
+        except ValueError:
+            return Error.INCORRECT_FORMAT
+
+        with self.subscriptions_lock:
+            self.subscriptions.add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.subscriptions_lock:
+            self.subscriptions.discard(subscription)
+
+    def build_subscription_response(self, files, dropped, codec = JSON_CODEC):
+        return codec.encode({"reply": True, "request_type": "subscribe", "dropped": dropped}, EncodedInformation(files))
+
     def handle_client(self, conn):
         try:
             message = self.receive_message(conn)
@@ -103,42 +241,110 @@ class InterfaceOnboardSystems(threading.Thread):
             print("[Client handler] client closed connection before sending the complete message")
             self.close_connection(conn)
             return
-        
-        # Validates the request. If the request would be invalid it could cause the interface to crash.
+        except InvalidLengthError as e:
+            print(f"[Client handler] {e}")
+            try:
+                self.send_error(conn, Error.INCORRECT_FORMAT)
+            except OSError:
+                pass
+            self.close_connection(conn)
+            return
+
         dict_request = self.extract_request(message)
+        codec = self.choose_codec(dict_request)
 
-        if isinstance(dict_request, Error):
-            print("[Client handler] sent message invalid")
+        if self.is_request_type(dict_request, "session"):
+            self.handle_session(conn, dict_request)
+        elif self.is_request_type(dict_request, "subscribe"):
+            self.handle_subscription(conn, dict_request)
+        else:
+            response = self.handle_request(dict_request, codec)
 
-            # Send an error message as reply
-            self.send_error(conn, dict_request)
-            self.close_connection(conn)
-            return
-        print("[Client handler] message is validated properly")
+            self.send_response(conn, response, codec)
+            print("[Client handler] response sent")
+
+        self.close_connection(conn)
 
-        request = self.choose_request(**dict_request)
+    """
+        Handle the requests of a session until the client sends a disconnect request or closes the connection.
+        The requests are handled at the same time, so the responses can be sent in a different order than the requests came in.
+        The client uses the request_id in the responses to match them with its requests.
+    """
+    def handle_session(self, conn, dict_request):
+        codec = self.choose_codec(dict_request)
+        send_lock = threading.Lock()
+        # Allow at most max_session_workers requests of this session to be handled at the same time, like the asyncio version
+        session_slots = threading.Semaphore(self.max_session_workers)
 
-        if isinstance(request, Error):
-            print("[Client handler] request_type not found!")
+        def handle_session_request(dict_request):
+            try:
+                response = self.handle_request(dict_request, codec)
+                with send_lock:
+                    self.send_response(conn, response, codec)
+            except OSError as e:
+                print(e)
+            finally:
+                session_slots.release()
 
-            # Send an error message as reply
-            self.send_error(conn, request)
-            self.close_connection(conn)
+        self.send_response(conn, self.build_session_response(dict_request, codec), codec)
+        print("[Client handler] session started")
+
+        with ThreadPoolExecutor(max_workers=self.max_session_workers) as executor:
+            while True:
+                try:
+                    message = self.receive_message(conn)
+                except (ClientClosedConnectionError, ValueError, OSError):
+                    print("[Client handler] client closed the session without the disconnect message")
+                    return
+
+                dict_request = self.extract_request(message)
+
+                if self.is_request_type(dict_request, "disconnect"):
+                    break
+
+                # Stop reading new requests while the maximum amount of requests is being handled, so the queue of the executor stays short
+                session_slots.acquire()
+                executor.submit(handle_session_request, dict_request)
+
+        # Leaving the with statement waited for all requests to be answered, so the disconnect response is the last response
+        self.send_response(conn, self.build_session_response(dict_request, codec), codec)
+        print("[Client handler] session closed by the client")
+
+    """
+        Send every new file that matches the subscription to the client until it sends a disconnect request or closes the connection.
+    """
+    def handle_subscription(self, conn, dict_request):
+        codec = self.choose_codec(dict_request)
+        subscription = self.subscribe(dict_request)
+
+        if isinstance(subscription, Error):
+            self.send_error(conn, subscription, codec)
             return
-        print("[Client handler] found request_type")
-        
-        information = request.parse()
-        response = request.build_response(information)
-        
-        print("[Client handler] request parsed")
-        self.send_response(conn, response)
-        print("[Client handler] response sent")
 
-        self.close_connection(conn)
+        try:
+            self.send_response(conn, self.build_session_response(dict_request, codec), codec)
+            print("[Client handler] subscription started")
+
+            while True:
+                if subscription.wait(timeout=1):
+                    self.send_response(conn, self.build_subscription_response(*subscription.take_all(), codec), codec)
+
+                # The client does not send anything except for the disconnect request. So when conn is readable the subscription ends.
+                readable, _, _ = select.select([conn], [], [], 0)
+                if readable:
+                    dict_request = self.extract_request(self.receive_message(conn))
+                    if self.is_request_type(dict_request, "disconnect"):
+                        self.send_response(conn, self.build_session_response(dict_request, codec), codec)
+                    print("[Client handler] subscription ended")
+                    return
+        except (ClientClosedConnectionError, ValueError, OSError):
+            print("[Client handler] client closed the subscription without the disconnect message")
+        finally:
+            self.unsubscribe(subscription)
 
     def run(self):
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.bind(("192.168.178.68", 8001))
+        server.bind((self.host, self.port))
         server.listen()
 
         while True:
@@ -148,3 +354,223 @@ class InterfaceOnboardSystems(threading.Thread):
             print("[Server] starting client handler")
             client_thread = threading.Thread(target=self.handle_client, args=[conn])
             client_thread.start()
+
+class AsyncInterfaceOnboardSystems(InterfaceOnboardSystems):
+    """
+        The same interface as InterfaceOnboardSystems, but it serves the clients with asyncio instead of a thread per connection.
+        At most max_connections clients are handled at the same time, a client that connects when all of them are in use gets an error and is disconnected.
+        A subscription stays open for a long time, so the subscriptions have their own limit of max_subscriptions.
+        A client that does not send its request within read_timeout seconds after it connected is disconnected.
+        serve can be awaited on an event loop that is shared with other parts of the system. 
+        start still runs it in its own thread with its own event loop.
+    """
+    def __init__(self, folder, max_msg_length = 10, host = "192.168.178.68", port = 8001, max_connections = 16, read_timeout = 10, max_request_length = 65536, session_timeout = 60, max_subscriptions = 16):
+        super().__init__(folder, max_msg_length, host, port, max_request_length=max_request_length)
+        self.max_connections = max_connections
+        self.max_subscriptions = max_subscriptions
+        self.read_timeout = read_timeout
+        # The time a session may be idle before it is closed
+        self.session_timeout = session_timeout
+        self.server = None
+
+    async def receive_message_async(self, reader):
+        # Receive the length of the request followed by the request itself
+        message_length = int(await reader.readexactly(self.max_msg_length))
+
+        # Do not allocate memory for requests that are larger than any valid request
+        if message_length > self.max_request_length:
+            raise ValueError(f"Request of {message_length} bytes is too large")
+
+        message = await reader.readexactly(message_length)
+        return message.decode()
+
+    async def send_response_async(self, writer, response, codec = JSON_CODEC):
+        writer.write(codec.frame(response, self.max_msg_length))
+
+        # Wait until the client has read enough of the response, so slow clients do not fill up the memory
+        await writer.drain()
+
+    """
+        Take a slot of slots for a connection. Returns False when all slots are in use, so the client does not wait for a slot with an open connection.
+        The event loop does not switch to another client in between, so the check and the acquire are done together.
+    """
+    async def take_slot(self, slots):
+        if slots.locked():
+            return False
+        await slots.acquire()
+        return True
+
+    async def handle_client_async(self, reader, writer):
+        # The client has read_timeout seconds from the moment it connected to send its request
+        deadline = asyncio.get_running_loop().time() + self.read_timeout
+        slots = None
+
+        try:
+            if not await self.take_slot(self.connection_slots):
+                print("[Client handler] too many connections, the client is disconnected")
+                await self.send_response_async(writer, self.build_error(Error.TOO_MANY_CONNECTIONS))
+                return
+            slots = self.connection_slots
+
+            try:
+                message = await asyncio.wait_for(self.receive_message_async(reader), deadline - asyncio.get_running_loop().time())
+                print("[Client handler] received message properly!")
+            except asyncio.IncompleteReadError:
+                print("[Client handler] client closed connection before sending the complete message")
+                return
+            except asyncio.TimeoutError:
+                print("[Client handler] client did not send the complete message in time")
+                return
+            except ValueError:
+                await self.send_response_async(writer, self.build_error(Error.INCORRECT_FORMAT))
+                return
+
+            dict_request = self.extract_request(message)
+            codec = self.choose_codec(dict_request)
+
+            if self.is_request_type(dict_request, "session"):
+                await self.handle_session_async(reader, writer, dict_request)
+                return
+            elif self.is_request_type(dict_request, "subscribe"):
+                # Exchange the connection slot for a subscription slot, so the subscriptions do not take the slots of the other requests
+                slots.release()
+                slots = None
+                if not await self.take_slot(self.subscription_slots):
+                    print("[Client handler] too many subscriptions, the client is disconnected")
+                    await self.send_response_async(writer, self.build_error(Error.TOO_MANY_CONNECTIONS, codec), codec)
+                    return
+                slots = self.subscription_slots
+
+                await self.handle_subscription_async(reader, writer, dict_request)
+                return
+
+            # Parsing takes the lock of the folder, so do it in a different thread to keep the event loop free for other clients.
+            response = await asyncio.get_running_loop().run_in_executor(None, self.handle_request, dict_request, codec)
+
+            await self.send_response_async(writer, response, codec)
+            print("[Client handler] response sent")
+        except ConnectionError as e:
+            print(e)
+        finally:
+            if slots is not None:
+                slots.release()
+
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            print("[Client handler] connection closed")
+
+    """
+        The asyncio version of handle_session. Every request is handled in its own task and answered as soon as it is done.
+    """
+    async def handle_session_async(self, reader, writer, dict_request):
+        codec = self.choose_codec(dict_request)
+        loop = asyncio.get_running_loop()
+        send_lock = asyncio.Lock()
+        # Allow at most max_session_workers requests of this session to be handled at the same time
+        session_slots = asyncio.Semaphore(self.max_session_workers)
+        tasks = set()
+
+        async def handle_session_request(dict_request):
+            try:
+                response = await loop.run_in_executor(None, self.handle_request, dict_request, codec)
+                async with send_lock:
+                    await self.send_response_async(writer, response, codec)
+            except ConnectionError as e:
+                print(e)
+            finally:
+                session_slots.release()
+
+        await self.send_response_async(writer, self.build_session_response(dict_request, codec), codec)
+        print("[Client handler] session started")
+
+        while True:
+            try:
+                message = await asyncio.wait_for(self.receive_message_async(reader), self.session_timeout)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                print("[Client handler] client closed the session without the disconnect message")
+                break
+
+            dict_request = self.extract_request(message)
+
+            if self.is_request_type(dict_request, "disconnect"):
+                # Answer the disconnect request after all other requests are answered
+                await asyncio.gather(*tasks)
+                await self.send_response_async(writer, self.build_session_response(dict_request, codec), codec)
+                print("[Client handler] session closed by the client")
+                return
+
+            # Stop reading new requests while the maximum amount of requests is being handled
+            await session_slots.acquire()
+            task = asyncio.create_task(handle_session_request(dict_request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        await asyncio.gather(*tasks)
+
+    """
+        The asyncio version of handle_subscription.
+    """
+    async def handle_subscription_async(self, reader, writer, dict_request):
+        codec = self.choose_codec(dict_request)
+        subscription = self.subscribe(dict_request)
+
+        if isinstance(subscription, Error):
+            await self.send_response_async(writer, self.build_error(subscription, codec), codec)
+            return
+
+        subscription.use_event_loop()
+        read_task = asyncio.create_task(self.receive_message_async(reader))
+
+        try:
+            await self.send_response_async(writer, self.build_session_response(dict_request, codec), codec)
+            print("[Client handler] subscription started")
+
+            while True:
+                # Files could be added before use_event_loop was called, so check the queue before waiting
+                files, dropped = subscription.take_all()
+                if files:
+                    await self.send_response_async(writer, self.build_subscription_response(files, dropped, codec), codec)
+                    continue
+
+                wait_task = asyncio.create_task(subscription.wait_async())
+                done, _ = await asyncio.wait({wait_task, read_task}, return_when=asyncio.FIRST_COMPLETED)
+
+                # The client does not send anything except for the disconnect request. So when a message is received the subscription ends.
+                if read_task in done:
+                    wait_task.cancel()
+                    dict_request = self.extract_request(read_task.result())
+                    if self.is_request_type(dict_request, "disconnect"):
+                        await self.send_response_async(writer, self.build_session_response(dict_request, codec), codec)
+                    print("[Client handler] subscription ended")
+                    return
+        except (asyncio.IncompleteReadError, ValueError):
+            print("[Client handler] client closed the subscription without the disconnect message")
+        finally:
+            read_task.cancel()
+            self.unsubscribe(subscription)
+
+    async def serve(self):
+        self.connection_slots = asyncio.Semaphore(self.max_connections)
+        self.subscription_slots = asyncio.Semaphore(self.max_subscriptions)
+        self.server = await asyncio.start_server(self.handle_client_async, self.host, self.port)
+        print("[Server] listening on {}:{}".format(self.host, self.port))
+
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                # The server was closed by stop
+                print("[Server] stopped")
+
+    """
+        Stop the server. Can be called from any thread.
+    """
+    def stop(self):
+        if self.server is not None:
+            self.server.get_loop().call_soon_threadsafe(self.server.close)
+
+    def run(self):
+        asyncio.run(self.serve())
@@ -6,72 +6,159 @@ Description: These classes represent the different requests the interface suppor
 Changelog: Frank created the file.
 '''
 
-import json
 from abc import ABC, abstractmethod
 
 from Category import Category
+from Codec import JSON_CODEC, EncodedInformation
+
+# The fields of a File that a client can ask for instead of the complete lines.
+PROJECTION_FIELDS = ("lines", "dab_id", "message_type", "category", "coordinates", "time_of_arrival", "sequence_number")
 
 class Request(ABC):
-    def __init__(self, folder, valid):
+    def __init__(self, folder, valid, limit=None, offset=0, fields=None):
         self.folder = folder
         self.valid = valid
+        # The maximum amount of files in the response and the amount of matching files to skip
+        self.limit = limit
+        self.offset = offset
+        # The fields of every file in the response. When fields is None the lines are sent.
+        self.fields = fields
+        # The sequence number of the last file in the response when more files match than fit in limit. Is sent to the client as since for the next page.
+        self.continuation = None
 
     @abstractmethod
     def parse(self):
         """A method to parse a request"""
 
     """
-        Get all the files for wich the field has the value value and is valid
+        Get all the files for wich the field has the value value and is valid. Only the files of the requested page are returned.
+        When since is given only the files added after the file with sequence number since are returned.
     """
-    def get_files(self, field, value, valid):
+    def get_files(self, field, value, valid, since=None):
         files = self.folder.find_files_by_field(field, value)
         
         # Filter all the File objects out of the list that are not valid
         files = [file for file in files if file.get_valid() == valid]
 
+        if since is not None:
+            files = [file for file in files if file.get_sequence_number() > since]
+
+        files = self.paginate(files)
+
         # Update the field sent_to_onboard_systems for every file in files.
         [file.set_sent_to_onboard_systems(True) for file in files]
 
         return files
 
+    """
+        Skip the first offset files and keep at most limit files. When files are left out at the end, continuation is set 
+        to the sequence number of the last file that is kept.
+    """
+    def paginate(self, files):
+        files = files[self.offset:]
+
+        if self.limit is not None and len(files) > self.limit:
+            files = files[:self.limit]
+            self.continuation = files[-1].get_sequence_number()
+
+        return files
+
     def build_information_list(self, files):
-        information = []
-        for file in files:
-            information.append(file.get_lines())
+        return EncodedInformation(files, self.fields)
+
+    """
+        Encode response with codec with information added as the last key.
+        When the request has a limit the response contains the continuation, which is null when the last page is sent.
+    """
+    def encode_response(self, response, information, codec):
+        if self.limit is not None:
+            response["continuation"] = self.continuation
 
-        return information
+        return codec.encode(response, information)
 
-    def build_response(self, information):
+    def build_response(self, information, codec=JSON_CODEC):
         """A general method to build a response"""
 
-        return json.dumps({"reply": True, "information": information})
+        return self.encode_response({"reply": True}, information, codec)
 
 class LatestRequest(Request):
-    def __init__(self, folder, valid):
-        super().__init__(folder, valid)
+    def __init__(self, folder, valid, since=None, limit=None, offset=0, fields=None):
+        super().__init__(folder, valid, limit, offset, fields)
+        # The sequence number of the last file the client received. When since is None the field sent_to_onboard_systems is used instead.
+        self.since = since
+        self.cursor = since
 
     def parse(self):
         """A request to get the latest unsent valid information."""     
 
-        files = self.get_files('sent_to_onboard_systems', False, self.valid)
+        if self.since is None:
+            files = self.get_files('sent_to_onboard_systems', False, self.valid)
+        else:
+            files = self.get_files_since(self.since, self.valid)
 
         return self.build_information_list(files)
 
+    """
+        Get the valid files that were added after the file with sequence number since. Does not change the files, 
+        so every client can keep track of what it received by sending the cursor of the previous response as since.
+    """
+    def get_files_since(self, since, valid):
+        files = self.folder.find_files_since(since)
+
+        if files:
+            self.cursor = files[-1].get_sequence_number()
+
+        files = self.paginate([file for file in files if file.get_valid() == valid])
+
+        # Not all files fit in the response, so the next request has to continue after the last file that is sent
+        if self.continuation is not None:
+            self.cursor = self.continuation
+
+        return files
+
+    def build_response(self, information, codec=JSON_CODEC):
+        """A method to build a response for a LatestRequest. Contains the cursor to use as since in the next request when since is used."""
+        if self.since is None:
+            return super().build_response(information, codec)
+
+        return self.encode_response({"reply": True, "cursor": self.cursor}, information, codec)
+
 class CategoryRequest(Request):
-    def __init__(self, folder, valid, category):
-        super().__init__(folder, valid)
+    def __init__(self, folder, valid, category, since=None, limit=None, offset=0, fields=None):
+        super().__init__(folder, valid, limit, offset, fields)
         self.category = Category(category)
+        # Only files added after the file with sequence number since are sent. Is used to get the page after a continuation.
+        self.since = since
 
     def parse(self):
         """A request to get the information from the files that belong to category"""
 
-        files = self.get_files('category', self.category, self.valid)
+        files = self.get_files('category', self.category, self.valid, self.since)
         
         return self.build_information_list(files)
     
-    def build_response(self, information):
+    def build_response(self, information, codec=JSON_CODEC):
         """A method to build a response for a CategoryRequest"""
-        return json.dumps({"reply": True, "category": self.category.value, "information": information})
+        return self.encode_response({"reply": True, "category": self.category}, information, codec)
+
+class ArchiveRequest(Request):
+    def __init__(self, folder, valid, category=None, since=None, limit=None, offset=0, fields=None):
+        super().__init__(folder, valid, limit, offset, fields)
+        # Only the archived files with this category are sent. When category is None the archived files of every category are sent.
+        self.category = Category(category) if category is not None else None
+        self.since = since
+
+    def parse(self):
+        """A request to get the information from the files that are moved to the archive of the folder"""
+
+        files = self.folder.archive.find_files(self.category, self.since)
+        files = self.paginate([file for file in files if file.get_valid() == self.valid])
+
+        return self.build_information_list(files)
+
+    def build_response(self, information, codec=JSON_CODEC):
+        """A method to build a response for an ArchiveRequest"""
+        return self.encode_response({"reply": True, "request_type": "archive"}, information, codec)
 
 class TestRequest(Request):
     def __init__(self, folder):
@@ -0,0 +1,97 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: A thread that keeps the amount of files in a Folder bounded. A file is moved to the archive of the Folder when
+             there are more than max_entries files, when it is older than max_age seconds, when it was confirmed more than
+             confirmed_retention seconds ago or when its CAP alert expired. Files that are being confirmed are never removed.
+             Every tick only a part of the files is checked and at most batch_size files are removed, so the Folder is never locked for long.
+
+Changelog: Frank created the file.
+'''
+
+import threading
+import time
+
+from Status import Status
+
+class Retention(threading.Thread):
+    def __init__(self, folder, max_entries=None, max_age=None, confirmed_retention=None, batch_size=50, scan_size=500, interval=1.0):
+        threading.Thread.__init__(self, daemon=True)
+        self.folder = folder
+        # A limit that is None is not used
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.confirmed_retention = confirmed_retention
+        # The maximum amount of files that are removed and the amount of files that are checked every tick
+        self.batch_size = batch_size
+        self.scan_size = scan_size
+        self.interval = interval
+
+        # The position in the files of the Folder where the next tick continues checking
+        self.cursor = 0
+        self.stopped = threading.Event()
+
+    """
+        Check if file can be removed because of its age, its confirmation or its expiration.
+    """
+    def is_expired(self, file, now):
+        if self.max_age is not None and now - file.time_of_arrival > self.max_age:
+            return True
+        if self.confirmed_retention is not None and file.status == Status.CONFIRMED and file.time_of_confirmation is not None \
+                and now - file.time_of_confirmation > self.confirmed_retention:
+            return True
+        return file.expires is not None and file.expires < now
+
+    """
+        Select at most batch_size files to remove. First the oldest files above max_entries, after that the expired files
+        in the next scan_size files after the cursor.
+    """
+    def select_files(self, now):
+        with self.folder.lock:
+            amount_of_files = len(self.folder.files)
+            excess = amount_of_files - self.max_entries if self.max_entries is not None else 0
+            oldest_files = self.folder.files[:max(0, excess)]
+
+            if self.cursor >= amount_of_files:
+                self.cursor = 0
+            scanned_files = self.folder.files[self.cursor:self.cursor + self.scan_size]
+            self.cursor += self.scan_size
+
+        selected_files = {}
+        for file in oldest_files:
+            if len(selected_files) >= self.batch_size:
+                break
+            if file.status != Status.CONFIRMING:
+                selected_files[id(file)] = file
+
+        for file in scanned_files:
+            if len(selected_files) >= self.batch_size:
+                break
+            if file.status != Status.CONFIRMING and self.is_expired(file, now):
+                selected_files[id(file)] = file
+
+        return list(selected_files.values())
+
+    """
+        Move the selected files to the archive. The files are archived before they are removed, so a file is never lost.
+        Returns the removed files.
+    """
+    def tick(self, now=None):
+        files = self.select_files(time.time() if now is None else now)
+        if not files:
+            return []
+
+        if self.folder.archive is not None:
+            self.folder.archive.add_files(files)
+
+        return self.folder.remove_files(files)
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(e)
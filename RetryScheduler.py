@@ -0,0 +1,110 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: A thread that schedules the retries of failed acknowledgments. Every file that needs a retry is put in a priority queue
+             ordered by the time of the next attempt. The delay between attempts grows exponentially per file and contains some jitter,
+             so the retries of a burst of failed acknowledgments do not all happen at the same moment.
+             The thread sleeps on a condition variable until the next attempt is due or a new retry is scheduled.
+
+Changelog: Frank created the file.
+'''
+
+import heapq
+import random
+import threading
+import time
+
+class RetryScheduler(threading.Thread):
+    def __init__(self, retry_callback, base_delay=1.0, max_delay=300.0, jitter=0.2):
+        threading.Thread.__init__(self, daemon=True)
+        self.retry_callback = retry_callback
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+        self.condition = threading.Condition()
+        self.queue = []
+        # The time of the next attempt for every scheduled dab_id. Entries in the queue that do not match are outdated.
+        self.scheduled = {}
+        self.attempts = {}
+        self.running = True
+
+    """
+        Calculate the delay before the next attempt of dab_id. The delay doubles every attempt until it reaches max_delay.
+    """
+    def get_delay(self, dab_id):
+        attempts = self.attempts.get(dab_id, 0)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempts)
+
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    """
+        Schedule a retry for dab_id. When a retry is already scheduled for dab_id the earliest attempt is kept.
+    """
+    def schedule(self, dab_id):
+        with self.condition:
+            next_attempt_time = time.monotonic() + self.get_delay(dab_id)
+
+            if dab_id in self.scheduled and self.scheduled[dab_id] <= next_attempt_time:
+                return
+
+            self.scheduled[dab_id] = next_attempt_time
+            heapq.heappush(self.queue, (next_attempt_time, dab_id))
+            self.condition.notify()
+
+    """
+        Forget dab_id. Is used when a file is confirmed, so the backoff starts over when the file ever needs a retry again.
+    """
+    def cancel(self, dab_id):
+        with self.condition:
+            self.scheduled.pop(dab_id, None)
+            self.attempts.pop(dab_id, None)
+
+    def is_scheduled(self, dab_id):
+        with self.condition:
+            return dab_id in self.scheduled
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    """
+        Wait until the first retry in the queue is due and return its dab_id. Returns None when the scheduler is stopped.
+    """
+    def next_due(self):
+        with self.condition:
+            while self.running:
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+
+                next_attempt_time, dab_id = self.queue[0]
+
+                # Skip entries that were cancelled or replaced by an earlier attempt.
+                if self.scheduled.get(dab_id) != next_attempt_time:
+                    heapq.heappop(self.queue)
+                    continue
+
+                timeout = next_attempt_time - time.monotonic()
+                if timeout > 0:
+                    self.condition.wait(timeout)
+                    continue
+
+                heapq.heappop(self.queue)
+                del self.scheduled[dab_id]
+                self.attempts[dab_id] = self.attempts.get(dab_id, 0) + 1
+                return dab_id
+
+            return None
+
+    def run(self):
+        while True:
+            dab_id = self.next_due()
+            if dab_id is None:
+                return
+
+            try:
+                self.retry_callback(dab_id)
+            except Exception as e:
+                print(e)
@@ -0,0 +1,90 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: A class which represents an onboard system that subscribed to new DAB messages. Instead of asking for the latest messages
+             over and over, new files are put in the queue of the subscription as soon as they are stored in the Folder.
+             The queue has a maximum length. When an onboard system reads slower than new messages come in the oldest message is dropped
+             and the amount of dropped messages is sent along with the next messages.
+
+Changelog: Frank created the file.
+           Frank made offer report a subscriber whose event loop is closed, so it can be dropped.
+'''
+
+import asyncio
+import threading
+from collections import deque
+
+from Category import Category
+
+class Subscription:
+    def __init__(self, category=None, valid=True, max_queue_length=100):
+        # Only files with this category are sent. When category is None files of every category are sent.
+        self.category = Category(category) if category is not None else None
+        self.valid = valid
+        # A deque with a maxlen drops the oldest file when a new file is appended to a full queue
+        self.queue = deque(maxlen=max_queue_length)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+        # Used to wake up a subscriber that runs on an asyncio event loop
+        self.loop = None
+        self.event = None
+
+    """
+        Let a subscriber that runs on an asyncio event loop wait with wait_async instead of wait. Must be called on that event loop.
+    """
+    def use_event_loop(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def matches(self, file):
+        if self.category is not None and file.get_category() != self.category:
+            return False
+        return file.get_valid() == self.valid
+
+    """
+        Put the file in the queue when the subscriber is interested in it. Is called from the thread that stores the file.
+        Returns False when the event loop of the subscriber is closed, so the subscriber is gone and can be dropped.
+    """
+    def offer(self, file):
+        if not self.matches(file):
+            return True
+
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(file)
+            self.condition.notify()
+
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.event.set)
+            except RuntimeError:
+                # The event loop is closed
+                return False
+
+        return True
+
+    """
+        Wait at most timeout seconds for a file in the queue. Returns True when there are files in the queue.
+    """
+    def wait(self, timeout):
+        with self.condition:
+            if not self.queue:
+                self.condition.wait(timeout)
+            return len(self.queue) > 0
+
+    async def wait_async(self):
+        await self.event.wait()
+        self.event.clear()
+
+    """
+        Take all files out of the queue. Returns the files and the amount of files that were dropped since the last time.
+    """
+    def take_all(self):
+        with self.condition:
+            files = list(self.queue)
+            self.queue.clear()
+            dropped, self.dropped = self.dropped, 0
+
+        return files, dropped
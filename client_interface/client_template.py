@@ -2,6 +2,7 @@
 project: slimmer maken multiconnectivity modem
 author: Frank Montenij
 Description: A template that can be used to request data from the half-duplex system. 
+             Set use_session to True to send more than one request over the same connection.
 '''
 
 import socket
@@ -14,22 +15,65 @@ def pad_msg_length(padding_size, message_length):
     message_length += b' ' * (padding_size - len(message_length))
     return message_length
 
+# recv can return less bytes than asked for, so keep receiving until all bytes are received. 
+# The framing is copied from the half-duplex system, so this file can be used on its own.
+def recv_exact(client, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        received = client.recv(size - len(buffer))
+        if not received:
+            raise ConnectionError(f"Connection closed after receiving {len(buffer)} bytes")
+        buffer += received
+    return buffer
+
+def read_message(client, max_msg_length):
+    message_length = int(recv_exact(client, max_msg_length))
+    return recv_exact(client, message_length)
+
+def write_message(client, message, max_msg_length):
+    if isinstance(message, str):
+        message = message.encode()
+    client.sendall(pad_msg_length(max_msg_length, len(message)) + message)
+
+use_session = False
+
+def send_request(client, request):
+    message = json.dumps(request).encode()
+    write_message(client, message, max_msg_length)
+
+def receive_reply(client):
+    reply = read_message(client, max_msg_length).decode()
+    return json.loads(reply)
+
 # Connect to interface
 client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 client.connect(("192.168.178.68", 8001))
 
-# Build message
-message = json.dumps({"request_type": "latest"}).encode()
-message_length = pad_msg_length(max_msg_length, len(message))
+if not use_session:
+    # Send one request. The interface closes the connection after the reply.
+    send_request(client, {"request_type": "latest"})
+    reply_dict = receive_reply(client)
+    print(reply_dict)
+else:
+    # Start a session. The connection stays open until the disconnect request is sent.
+    send_request(client, {"request_type": "session"})
+    print(receive_reply(client))
+
+    # Send all requests at once. Every request gets its own request_id, because the replies can arrive in a different order.
+    requests = {
+        1: {"request_type": "latest"},
+        2: {"request_type": "by_category", "category": "CAP"},
+        3: {"request_type": "test"},
+    }
+    for request_id, request in requests.items():
+        send_request(client, dict(request, request_id=request_id))
 
-# Send message 
-client.send(message_length)
-client.send(message)
+    for _ in requests:
+        reply_dict = receive_reply(client)
+        print(f"reply to {requests[reply_dict['request_id']]}: {reply_dict}")
 
-# Receive reply
-reply_length = int(client.recv(max_msg_length).decode())
-reply = client.recv(reply_length).decode()
+    # End the session. The disconnect reply is sent after the replies to all other requests.
+    send_request(client, {"request_type": "disconnect"})
+    print(receive_reply(client))
 
-# Extract reply
-reply_dict = json.loads(reply)
-print(reply)
\ No newline at end of file
+client.close()
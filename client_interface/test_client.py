@@ -9,10 +9,30 @@ import json
 
 max_msg_length = 10
 
-def pad_msg_length(padding_size, msg_length):
-    msg_length = str(msg_length).encode()
-    msg_length += b' ' * (padding_size - len(msg_length))
-    return msg_length
+def pad_msg_length(padding_size, message_length):
+    message_length = str(message_length).encode()
+    message_length += b' ' * (padding_size - len(message_length))
+    return message_length
+
+# recv can return less bytes than asked for, so keep receiving until all bytes are received. 
+# The framing is copied from the half-duplex system, so this file can be used on its own.
+def recv_exact(client, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        received = client.recv(size - len(buffer))
+        if not received:
+            raise ConnectionError(f"Connection closed after receiving {len(buffer)} bytes")
+        buffer += received
+    return buffer
+
+def read_message(client, max_msg_length):
+    message_length = int(recv_exact(client, max_msg_length))
+    return recv_exact(client, message_length)
+
+def write_message(client, message, max_msg_length):
+    if isinstance(message, str):
+        message = message.encode()
+    client.sendall(pad_msg_length(max_msg_length, len(message)) + message)
 
 def setupSocket():
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -21,15 +41,10 @@ def setupSocket():
     return client
 
 def send_msg(msg, client):
-    msg_length = pad_msg_length(max_msg_length, len(msg))
-
-    client.send(msg_length)
-    client.send(msg.encode())
+    write_message(client, msg, max_msg_length)
 
 def receive_msg(client):
-    reply_length = int(client.recv(max_msg_length).decode())
-    reply = client.recv(reply_length).decode()
-    return reply
+    return read_message(client, max_msg_length).decode()
 
 def test_receive():
     client = setupSocket()
@@ -9,28 +9,44 @@ Changelog: Alfred created the file.
            Frank added the part making the system able to use WiFi as a supported technology.
            Frank improved the system by moving the statement that attaches the devices which increases the uptime.
            Frank improved the code for more details see the commits in the github.
+           Frank moved the reading and acknowledging of new files to the ingest pipeline, so the observer thread is never blocked.
+           Frank added the backfill of the files that arrived while the system was down.
+           Frank made the devices acknowledge at the same time instead of one after another.
+           Frank added the link scheduler, which chooses the device on the measured success rate and latency.
+           Frank added the batching mode, which sends the retried acknowledgments in batches.
+           Frank made the files of an AIS broadcast that failed according to the base station be retried.
+           Frank made a message that is archived already not be acknowledged again.
+           Frank made the retries of the retry scheduler be submitted to the batcher in batching mode.
+           Frank made the link scheduler opt-in with --link-scheduler, so by default the device with the highest priority is chosen as soon as it answers.
 '''
 
 import os
-import sys
 import argparse
-import csv
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from watchdog.observers import Observer
 from watchdog.events import PatternMatchingEventHandler
 
-from Devices.Device import Device
-from Devices.Strategy import AISStrategy, EthernetStrategy, I2CStrategy, SPIStrategy
-from Interface.Ethernet import Ethernet
-from Interface.I2C import I2C
-from Interface.SPI import SPI
-from Interface.UART import UART
+from AcknowledgmentBatcher import AcknowledgmentBatcher
+from AcknowledgmentRace import AcknowledgmentRace
+from Backfill import backfill
+from BodyCache import BodyCache
+from Devices.DeviceRegistry import DeviceRegistry
+from Devices.LinkScheduler import LinkScheduler
+from Devices.Strategy import AISStrategy
+from Devices.ReachabilityCache import ReachabilityCache
 from Folder import Folder
 from File import File
-from InterfaceOnboardSystems import InterfaceOnboardSystems
+from FolderArchive import FolderArchive
+from FolderJournal import FolderJournal
+from IngestPipeline import IngestPipeline
+from InterfaceOnboardSystems import AsyncInterfaceOnboardSystems, InterfaceOnboardSystems
 from Status import Status
 from SenderID import SenderID
+from Retention import Retention
+from RetryScheduler import RetryScheduler
 
 class Monitor(PatternMatchingEventHandler):
     """A Class to handle incoming DAB files."""
@@ -41,6 +57,24 @@ class Monitor(PatternMatchingEventHandler):
         self.folder = folder
         self.devices = []
         self.devices_csv_filename = ""
+        self.device_registry = None
+        # When set the has_reach verdicts are read from the cache instead of asking every device
+        self.reachability_cache = None
+        # Ask all devices at the same time if they have reach. A device that did not answer within probe_timeout seconds has no reach.
+        self.concurrent_probing = False
+        self.probe_timeout = 15
+        # When set the device is chosen on the measured success rate and latency instead of only on the priority
+        self.link_scheduler = None
+        # When set retries are sent in batches, see AcknowledgmentBatcher
+        self.acknowledgment_batcher = None
+
+        # Retry failed acknowledgments when the status of a file changes to UNCONFIRMED or SKIP
+        self.retry_scheduler = RetryScheduler(self.retry_confirmation)
+        self.folder.add_status_listener(self.on_status_changed)
+
+        # When set new files are read and acknowledged by the ingest pipeline instead of the observer thread
+        self.ingest_pipeline = None
+        self.ingest_lock = threading.Lock()
 
     """
         This method creates the confirmation dictionary
@@ -64,37 +98,49 @@ class Monitor(PatternMatchingEventHandler):
         return confirmation_dict
 
     """
-        This method will be called when the observer detects a file being created in the folder that it observes.
+        Read the DAB file at path and store it in the folder. Returns the File that has to be acknowledged,
+        or None when a file with the same dab_id is confirmed already.
     """
-    def on_created(self, event):
-        print(event.src_path, event.event_type)
-
+    def ingest_file(self, path):
         # Save new DAB+ message as File object and fill it with the data from the .txt file.
-        new_file = File(str(event.src_path).replace(self.folder.path, ""))
+        new_file = File(str(path).replace(self.folder.path, ""))
         new_file.set_lines(self.folder.path)
         new_file.set_information()
 
-        # Get DAB+ ID ,Message Type and time_of_arrival
-        dab_id = new_file.get_dab_id()
-        message_type = new_file.get_message_type()
-        time_of_arrival = new_file.get_time_of_arrival()
-
         """
             Check if File is already in folder and confirmed, if so abort the confirmation and do not store the file.
+            A File that was acknowledged before it was archived is not confirmed again either.
+            Retention also archives files that were never acknowledged, those are acknowledged again.
             If the File is not in the folder store the new_file in the folder. 
             Else do not append the file and continue confirming the file.
+            The check and the storing are done together, so two parser workers never store the same dab_id twice.
         """
-        file_in_folder = self.folder.find_file_by_dab_id(dab_id)
-        if file_in_folder and file_in_folder.status == Status.CONFIRMED:
-            return
-        elif not file_in_folder:
-            # Add new DAB+ message to the Folder object
-            self.folder.files.append(new_file)
-
-        # Show the contents of the file
-        for line in new_file.get_lines():
+        with self.ingest_lock:
+            if self.folder.archive is not None and self.folder.archive.contains_dab_id(new_file.get_dab_id()):
+                return None
+
+            file_in_folder = self.folder.find_file_by_dab_id(new_file.get_dab_id())
+            if file_in_folder and file_in_folder.status == Status.CONFIRMED:
+                return None
+            elif not file_in_folder:
+                # Add new DAB+ message to the Folder object
+                self.folder.add_file(new_file)
+
+        # Show the header of the file. The body can be very long, for example for CAP messages.
+        for line in new_file.get_header():
             print(f'line: {line}')
 
+        return new_file
+
+    """
+        Choose the devices to acknowledge file with and start the acknowledgment.
+    """
+    def acknowledge_file(self, file):
+        # Get DAB+ ID ,Message Type and time_of_arrival
+        dab_id = file.get_dab_id()
+        message_type = file.get_message_type()
+        time_of_arrival = file.get_time_of_arrival()
+
         # Build the confirmation dict which contains all the necessary information to acknowledge a DAB messsage
         data = self.create_confirmation_dict(dab_id, message_type, time_of_arrival)
         
@@ -108,6 +154,52 @@ class Monitor(PatternMatchingEventHandler):
             # Start the acknowledgment
             self.acknowledge(data, devices)
 
+    """
+        This method will be called when the observer detects a file being created in the folder that it observes.
+        When the ingest pipeline is running the file is handed to the pipeline, so the observer can handle the next event right away.
+    """
+    def on_created(self, event):
+        print(event.src_path, event.event_type)
+
+        if self.ingest_pipeline is not None:
+            self.ingest_pipeline.submit(event.src_path)
+            return
+
+        self.handle_file(event.src_path)
+
+    """
+        The dab-receiver can still be writing to a new file. Every write delays the reading of the file until it is settled.
+    """
+    def on_modified(self, event):
+        if self.ingest_pipeline is not None:
+            self.ingest_pipeline.submit(event.src_path)
+
+    """
+        The dab-receiver is done writing the file, so the pipeline can read it without waiting for the settle time.
+    """
+    def on_closed(self, event):
+        if self.ingest_pipeline is not None:
+            self.ingest_pipeline.file_closed(event.src_path)
+
+    """
+        Handle the files that arrived while the system was down. The files are already closed, so the ingest pipeline does not wait for them to settle.
+    """
+    def backfill(self):
+        if self.ingest_pipeline is not None:
+            amount_of_files = backfill(self.folder, self.ingest_pipeline.file_closed)
+        else:
+            amount_of_files = backfill(self.folder, self.handle_file)
+
+        print(f"Found {amount_of_files} new files in {self.folder.path}")
+
+    """
+        Read the file at path and acknowledge it.
+    """
+    def handle_file(self, path):
+        new_file = self.ingest_file(path)
+        if new_file is not None:
+            self.acknowledge_file(new_file)
+
     """
         This method splits one list in two list, because there are two different process of acknowledging a message. 
         Which method needs to be used depends on wheter the device has reach or not.
@@ -119,7 +211,7 @@ class Monitor(PatternMatchingEventHandler):
 
         # Fill the lists with the correct devices
         for device in self.devices: 
-            has_reach = device.has_reach()
+            has_reach = self.get_has_reach(device)
             if has_reach:
                 devices_have_reach.append(device)  
             elif has_reach == None:
@@ -130,9 +222,73 @@ class Monitor(PatternMatchingEventHandler):
         return devices_have_reach, no_has_reach_devices
 
     """
-        This method retrieves the device with the highest priority. Which means the lowest self.priority from a list of devices
+        This method does the same as filter_devices_on_reach, but asks all devices at the same time.
+        It returns as soon as the device with the highest priority that has reach answered. The answers of the devices with a lower priority are ignored.
+        When there is a link scheduler it waits for all devices instead, so the link scheduler can choose from every device that has reach.
+        A device that does not answer within self.probe_timeout seconds is handled as a device without reach.
+    """
+    def filter_devices_on_reach_concurrently(self):
+        if not self.devices:
+            return [], []
+
+        # Sort the devices by priority, so the first device that has reach in this list is the device with the highest priority
+        devices = sorted(self.devices, key=lambda device: device.priority)
+        results = {}
+
+        executor = ThreadPoolExecutor(max_workers=len(devices))
+        futures = {executor.submit(self.get_has_reach, device): device for device in devices}
+        deadline = time.monotonic() + self.probe_timeout
+        pending = set(futures)
+
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+
+                # Nothing was done before the deadline. So the devices that did not answer have no reach.
+                if not done:
+                    break
+
+                for future in done:
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as e:
+                        print(e)
+                        results[futures[future]] = False
+
+                # With a link scheduler every device that has reach is a candidate, so wait for all answers until the deadline
+                if self.link_scheduler is not None:
+                    continue
+
+                # Stop when every device with a higher priority answered that it has no reach.
+                for device in devices:
+                    if device not in results:
+                        break
+                    elif results[device]:
+                        no_has_reach_devices = [other for other in devices if other in results and results[other] == None]
+                        return [device], no_has_reach_devices
+        finally:
+            # Do not wait for the devices that did not answer yet
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        devices_have_reach = [device for device in devices if results.get(device)]
+        no_has_reach_devices = [device for device in devices if device in results and results[device] == None]
+
+        return devices_have_reach, no_has_reach_devices
+
+    """
+        Returns the has_reach verdict of the device. From the cache if there is one, otherwise by asking the device.
+    """
+    def get_has_reach(self, device):
+        return self.reachability_cache.has_reach(device) if self.reachability_cache else device.has_reach()
+
+    """
+        This method retrieves the device with the highest priority. Which means the lowest self.priority from a list of devices.
+        When there is a link scheduler the device that is expected to confirm the fastest is chosen instead, the priority only decides between equal devices.
     """
     def get_highest_priority_device(self, devices):
+        if self.link_scheduler is not None:
+            return self.link_scheduler.choose(devices)
+
         return min(devices, key= lambda device: device.priority)
 
     """
@@ -140,14 +296,22 @@ class Monitor(PatternMatchingEventHandler):
         To choose the device that fits best for the current situation
     """
     def choose_device(self):
-        # Load the available devices
-        self.devices = attach_devices(self.devices_csv_filename)
+        # Get the available devices. The devices are only read from the csv file again when it changed.
+        self.devices = self.get_device_registry().get_devices()
+
+        # Retry the acknowledgments that the AIS base station could not broadcast
+        for device in self.devices:
+            if isinstance(device.strategy, AISStrategy):
+                device.strategy.add_abk_listener(self.on_abk)
 
         if not self.devices:
             return []
 
         # split devices in two list wheter they have reach or not
-        devices_have_reach, no_has_reach_devices = self.filter_devices_on_reach()
+        if self.concurrent_probing:
+            devices_have_reach, no_has_reach_devices = self.filter_devices_on_reach_concurrently()
+        else:
+            devices_have_reach, no_has_reach_devices = self.filter_devices_on_reach()
 
         # Find the device with the highest priority. Highest priority is the lowest device.priority value
         if devices_have_reach:
@@ -162,8 +326,18 @@ class Monitor(PatternMatchingEventHandler):
             # If there is no device within reach or no device in devices_not_able_to_calc_reach. return False
             return []
 
+    """
+        Returns the registry of the devices listed in devices_csv_filename. A new registry is created when the filename changed.
+    """
+    def get_device_registry(self):
+        if self.device_registry is None or self.device_registry.get_csv_filename() != self.devices_csv_filename:
+            self.device_registry = DeviceRegistry(self.devices_csv_filename)
+
+        return self.device_registry
+
     """
         This method is responsible for acknowledging the DAB file with all the best device available. Can be one or multiple devices.
+        Multiple devices acknowledge at the same time, see AcknowledgmentRace.
     """
     def acknowledge(self, data, devices):
         if not devices:
@@ -171,39 +345,9 @@ class Monitor(PatternMatchingEventHandler):
             self.folder.update_file(data.get("dab_id"), status=Status.SKIP)
             return
 
-        for device in devices:
-            # Change data when using the Sodaq One. Otherwise add the technology used by the device.
-            if isinstance(device.strategy, I2CStrategy):
-                data = {key:value for key, value in data.items() if key == "dab_id" or key == "message_type"}
-            else:
-                data["technology"] = device.get_technology()
-
-            # Get the result of the acknowledgment
-            reply = device.acknowledge(data)
-
-            if not reply:
-                # Update the file to SKIP, because the acknowledgment failed for an unkown reason
-                self.folder.update_file(data.get("dab_id"), status=Status.SKIP)
-                return
-
-            if isinstance(device.strategy, EthernetStrategy):
-                # The new status will be CONFIRMATION_SENT if the dab_id match and the technology is not Wifi. If the dab_id does not match the status will be SKIP.
-                new_status = Status.CONFIRMATION_SENT if data.get("dab_id") == reply["ack_information"][0] else Status.SKIP
-
-                if device.get_technology() == "Wifi":
-                    # Change the status to confirmed if the tech happens to be Wifi. Only for this technology you can be certain that the message was confirmed or not.
-                    new_status = Status.CONFIRMED if data.get("dab_id") == reply["ack_information"][0] else Status.SKIP
-                    
-                    # Update the status and validity of the files that have been received by the server.
-                    for entry in reply.get("different_ack_information"):
-                        self.folder.update_file(entry[0], status=Status.CONFIRMED, valid=entry[1])
-
-                # Update the status of the file that this confirmation tries to confirm to new_status. Which is CONFIRMATION_SENT when the technology is not Wifi otherwise it will be CONFIRMED.
-                self.folder.update_file(data.get("dab_id"), status=new_status, valid=reply["ack_information"][1])
-            else:
-                # implements the change status to skip or confirmed when the device used the i2c strategy.
-                new_status = Status.CONFIRMATION_SENT if reply else Status.SKIP
-                self.folder.update_file(data.get("dab_id"), status=new_status)
+        # Send with all devices at the same time. The first device that succeeds decides the status of the file.
+        record_outcome = self.link_scheduler.record if self.link_scheduler is not None else None
+        AcknowledgmentRace(self.folder, data, devices, record_outcome).run()
 
         # print the status for every file
         print("\nStatus of files (dab_id, file status")
@@ -211,26 +355,91 @@ class Monitor(PatternMatchingEventHandler):
             print(file.get_dab_id(), file.get_status())
         print()
 
+    """
+        This method is called by the folder whenever the status of a file changes. 
+        A retry is scheduled for files that need to be acknowledged again and forgotten for files that are confirmed.
+    """
+    def on_status_changed(self, file):
+        if file.get_status() in (Status.UNCONFIRMED, Status.SKIP):
+            self.retry_scheduler.schedule(file.get_dab_id())
+        elif file.get_status() == Status.CONFIRMED:
+            self.retry_scheduler.cancel(file.get_dab_id())
+
+    """
+        This method is called by an AIS device when the base station sent the ABK of a broadcast. 
+        The files of a broadcast that failed are skipped, so they are retried.
+    """
+    def on_abk(self, dab_ids, broadcasted):
+        if broadcasted:
+            return
+
+        for dab_id in dab_ids:
+            file = self.folder.find_file_by_dab_id(dab_id)
+            if file and file.get_status() == Status.CONFIRMATION_SENT:
+                self.folder.update_file(dab_id, status=Status.SKIP)
+
+    """
+        This method schedules a retry for every file that still needs to be acknowledged and has no retry scheduled yet.
+        The retry scheduler calls retry_confirmation when the retry is due.
+        In batching mode all these files are acknowledged right away instead, with one batch per device.
+    """
     def retry_failed_confirmation(self):
+        if self.acknowledgment_batcher is not None:
+            self.retry_failed_confirmation_in_batches()
+            return
+
         for file in self.folder.files:
-            if file.get_status() == Status.UNCONFIRMED:
-                """
-                    Change status to CONFIRMING. 
-                    So if the loop goes faster than the acknowledgment it wont reacknowledge it again
-                """
+            if file.get_status() in (Status.UNCONFIRMED, Status.SKIP) and not self.retry_scheduler.is_scheduled(file.get_dab_id()):
+                self.retry_scheduler.schedule(file.get_dab_id())
+
+    """
+        This method is called by the retry scheduler when the retry of the file with dab_id is due.
+    """
+    def retry_confirmation(self, dab_id):
+        file = self.folder.find_file_by_dab_id(dab_id)
+
+        # The file could be confirmed in the meantime. For example by the different_ack_information of a Wifi reply.
+        if not file or file.get_status() not in (Status.UNCONFIRMED, Status.SKIP):
+            return
+
+        """
+            Change status to CONFIRMING. 
+            So the file will not be scheduled again while the acknowledgment is in progress
+        """
+        file.set_status(Status.CONFIRMING)
+
+        # Build the confirmation dict which contains all the necessary information to acknowledge a DAB messsage
+        data = self.create_confirmation_dict(file.get_dab_id(), file.get_message_type(), file.get_time_of_arrival())
+
+        # The batcher chooses the device once for all retries that are submitted at the same time
+        if self.acknowledgment_batcher is not None:
+            self.acknowledgment_batcher.submit(data)
+            return
+
+        # Choose the device and acknowledge in a different thread, so a slow device does not delay the other retries.
+        thread = threading.Thread(target=self.retry_acknowledge, args=(data,))
+        thread.start()
+
+    """
+        Collect all files that still need to be acknowledged and send them with one batch per device. 
+    """
+    def retry_failed_confirmation_in_batches(self):
+        data_list = []
+        for file in list(self.folder.files):
+            if file.get_status() in (Status.UNCONFIRMED, Status.SKIP):
+                # The file is CONFIRMING now, so a retry that is still scheduled for it does nothing
                 file.set_status(Status.CONFIRMING)
-                
-                # Build the confirmation dict which contains all the necessary information to acknowledge a DAB messsage
-                data = self.create_confirmation_dict(file.get_dab_id(), file.get_message_type(), file.get_time_of_arrival())
-                
-                # Get the device or devices to use
-                devices = self.choose_device()
-
-                thread = threading.Thread(target=self.acknowledge, args=(data, devices))
-                thread.start()
-            elif file.get_status() == Status.SKIP:
-                # Skip ones acknowledge the message the next time you come along.
-                file.set_status(Status.UNCONFIRMED)
+                data_list.append(self.create_confirmation_dict(file.get_dab_id(), file.get_message_type(), file.get_time_of_arrival()))
+
+        if data_list:
+            self.acknowledgment_batcher.add(data_list)
+            self.acknowledgment_batcher.flush(force=True)
+
+    def retry_acknowledge(self, data):
+        # Get the device or devices to use
+        devices = self.choose_device()
+
+        self.acknowledge(data, devices)
 
 """
     This function is the main function that handles starting the monitor and observer
@@ -242,12 +451,33 @@ def execute():
     # add arguments to the parser
     parser.add_argument("devices")
     parser.add_argument("folder")
+    parser.add_argument("--state", default="state", help="folder to store the status of the DAB messages in, so it survives a restart")
+    parser.add_argument("--max-body-memory", type=int, default=8, help="the amount of MB the bodies of the DAB messages may take in memory before they are evicted to the state folder")
+    parser.add_argument("--max-entries", type=int, default=10000, help="the maximum amount of DAB messages to keep in memory, older messages are moved to the archive")
+    parser.add_argument("--max-age", type=float, default=None, help="the amount of hours after which a DAB message is moved to the archive")
+    parser.add_argument("--confirmed-retention", type=float, default=24, help="the amount of hours a confirmed DAB message is kept before it is moved to the archive")
+    parser.add_argument("--settle-time", type=float, default=0.5, help="the amount of seconds a new DAB message may not change before it is read, when the dab-receiver did not close it yet")
+    parser.add_argument("--batch-acknowledgments", action="store_true", help="send the acknowledgments that are retried in batches, one message per device")
+    parser.add_argument("--async-interface", action="store_true", help="serve the onboard systems with asyncio instead of a thread per connection")
+    parser.add_argument("--link-scheduler", action="store_true", help="choose the device that is expected to confirm the fastest instead of the device with the highest priority")
 
     # parse the arguments
     args = parser.parse_args()
 
     # Create Folder object with path of folder
     dab_folder = Folder(os.path.expanduser(args.folder))
+    dab_folder.body_cache = BodyCache(os.path.join(os.path.expanduser(args.state), "bodies"), args.max_body_memory * 1024 * 1024)
+    dab_folder.archive = FolderArchive(os.path.join(os.path.expanduser(args.state), "archive.jsonl"))
+
+    # Restore the files and their status from before the restart. From now on every change is written to the journal.
+    journal = FolderJournal(os.path.expanduser(args.state))
+    journal.recover(dab_folder)
+    journal.start()
+
+    # Move old, confirmed and expired messages to the archive, a small batch every second
+    max_age = args.max_age * 3600 if args.max_age is not None else None
+    retention = Retention(dab_folder, args.max_entries, max_age, args.confirmed_retention * 3600)
+    retention.start()
 
     # Assign folder to be monitored
     event_handler = Monitor(dab_folder)
@@ -255,81 +485,67 @@ def execute():
     observer.schedule(event_handler, path=event_handler.folder.path, recursive=True)
 
     # Startup the interface for the onboard systems
-    interface = InterfaceOnboardSystems(dab_folder)
+    interface = AsyncInterfaceOnboardSystems(dab_folder) if args.async_interface else InterfaceOnboardSystems(dab_folder)
     interface.start()
     
-    # Let the monitor no what the filename of devices is. So it can attach_devices later.
+    # Let the monitor no what the filename of devices is. So it can get the devices from the device registry later.
     event_handler.devices_csv_filename = args.devices
 
+    # Read the devices again when the csv file with the devices is changed
+    device_registry = event_handler.get_device_registry()
+    observer.schedule(device_registry, path=device_registry.get_directory(), recursive=False)
+
+    # Keep the has_reach verdicts of the devices up to date in the background
+    event_handler.reachability_cache = ReachabilityCache(device_registry.get_devices)
+    event_handler.reachability_cache.start()
+    event_handler.concurrent_probing = True
+
+    # Choose the device on how fast it confirmed messages before. The statistics are kept in the state folder.
+    if args.link_scheduler:
+        event_handler.link_scheduler = LinkScheduler(os.path.join(os.path.expanduser(args.state), "links.json"))
+        event_handler.link_scheduler.load()
+
+    # Send the retried acknowledgments in batches. Each technology has its own maximum batch size and maximum wait.
+    if args.batch_acknowledgments:
+        record_outcome = event_handler.link_scheduler.record if event_handler.link_scheduler is not None else None
+        event_handler.acknowledgment_batcher = AcknowledgmentBatcher(dab_folder, event_handler.choose_device, record_outcome=record_outcome)
+        event_handler.acknowledgment_batcher.start()
+
+    # Start retrying failed acknowledgments. The retry scheduler sleeps until a retry is due.
+    event_handler.retry_scheduler.start()
+    event_handler.retry_failed_confirmation()
+
+    # Read and acknowledge new messages in worker threads, so a burst of messages does not wait for one slow device
+    event_handler.ingest_pipeline = IngestPipeline(event_handler.ingest_file, event_handler.acknowledge_file, args.settle_time)
+    event_handler.ingest_pipeline.start()
+
     # Start the observing of the folder args.folder. When something changes start on_created in the event_handler
     observer.start()
     print("Monitoring started")
+
+    # Acknowledge the messages that arrived while the system was down. The observer is started first, so no message is missed in between.
+    event_handler.backfill()
+
     try:
         while True:
-            event_handler.retry_failed_confirmation()
+            time.sleep(1)
     except KeyboardInterrupt:
         observer.stop()
+        event_handler.ingest_pipeline.stop()
+        event_handler.retry_scheduler.stop()
+        event_handler.reachability_cache.stop()
+        if event_handler.link_scheduler is not None:
+            event_handler.link_scheduler.save()
+        if event_handler.acknowledgment_batcher is not None:
+            event_handler.acknowledgment_batcher.stop()
+        retention.stop()
+        journal.stop()
         print("Monitoring Stopped")
     observer.join()
 
 def get_dab_signal():
     return 20
 
-"""
-    This function reads all the device information from a csv file. Then converts that infromation to a Device object. 
-    And adds the object to the attribute devices belonging to Monitor.
-"""
-def attach_devices(csv_parameter):
-    listed_devices = []
-
-    try:
-        with open(csv_parameter, mode='r') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            line_count = 0
-            for row in csv_reader:
-                if line_count == 0:
-                    print(f'Column names are {", ".join(row)}')
-                    line_count += 1
-                    
-                device = Device(row["name"], row["branch"], row["model"], row["technology"], int(row["priority"]))
-                if int(row["interface_type"]) == 0:
-                    interface = UART()
-                    interface.init_serial(row["address"], int(row["setting"]))
-                    strategy = AISStrategy(interface)
-                    listed_devices.append(device)
-
-                if int(row["interface_type"]) == 1:
-                    interface = I2C()
-                    interface.init_i2c(int(row["address"]))
-                    strategy = I2CStrategy(interface)
-                    listed_devices.append(device)
-
-                if int(row["interface_type"]) == 2:
-                    interface = Ethernet()
-                    interface.init_socket(row["address"], int(row["setting"])) # Address and setting are here the ip_address and the portnumber of the target device.
-                    strategy = EthernetStrategy(interface)
-                    listed_devices.append(device)
-
-                if int(row["interface_type"]) == 3:
-                    interface = SPI()
-                    interface.init_spi(int(row["address"]), int(row["setting"]))
-                    strategy = SPIStrategy(interface)
-                    listed_devices.append(device)
-                
-                device.set_strategy(strategy)
-               
-                line_count += 1
-            print(f'Processed {line_count} lines.')
-
-        if line_count > 1:
-            return listed_devices
-        else:
-            print(f"No devices are listed. Configure {csv_parameter} and execute the program again")
-            sys.exit()
-    except RuntimeError:
-        print("Could not open list with devices")
-
-
 if __name__ == "__main__":
     try:
         execute()
@@ -4,13 +4,61 @@ author: Frank Montenij
 Description: A class which represents a testcase with test as method to test the choosing a technology logic.
 
 Changelog: Frank created the file.
+           Frank replaced the stub devices of the concurrency tests with one stub device that proves the calls overlap instead of timing them.
 '''
 
+import os
+import tempfile
+import threading
+import time
 import unittest
 from Folder import Folder
+from File import File
+from Status import Status
 import main
+from Devices.Device import Device
+from Devices.DeviceRegistry import DeviceRegistry, attach_devices
+from Devices.LinkScheduler import LinkScheduler
+from Devices.ReachabilityCache import ReachabilityCache
+from Interface.UART import UART
 from Devices.Strategy import AISStrategy, EthernetStrategy, I2CStrategy
 
+# The seconds a stub device waits at most, so a broken test fails instead of hanging
+STUB_TIMEOUT = 5
+
+"""
+    Creates a device of which has_reach and acknowledge are replaced, so a test controls the answers and when they are given.
+    The device first waits until every device reached device.barrier, which proves that the devices are asked at the same time.
+    Then it waits until device.release is set, so a test can keep the device busy for as long as it needs.
+    device.answered is set when the device answers.
+"""
+def create_stub_device(name, technology, priority, reach=True, reply=None, barrier=None, release=None):
+    device = Device(name, "test", "test", technology, priority)
+    device.set_strategy(EthernetStrategy(None))
+    device.barrier = barrier
+    device.release = release
+    device.answered = threading.Event()
+    device.sent_data = None
+
+    def answer(result):
+        if device.barrier is not None:
+            device.barrier.wait(timeout=STUB_TIMEOUT)
+        if device.release is not None:
+            device.release.wait(timeout=STUB_TIMEOUT)
+        device.answered.set()
+        return result
+
+    def stub_has_reach():
+        return answer(reach)
+
+    def stub_acknowledge(data):
+        device.sent_data = data
+        return answer(reply)
+
+    device.has_reach = stub_has_reach
+    device.acknowledge = stub_acknowledge
+    return device
+
 class ChoosingDevicesTester(unittest.TestCase):
     """A Class to test the part choosing the best device available."""
 
@@ -25,28 +73,28 @@ class ChoosingDevicesTester(unittest.TestCase):
         results = []
 
         # Test has_reach of Wifi
-        test_device = main.attach_devices("csv_test_files/test_devices1.csv")[0]
+        test_device = attach_devices("csv_test_files/test_devices1.csv")[0]
         result = test_device.has_reach()
         results.append(result)
 
         # Test has_reach of LoRa (FiPy)
-        # test_device = main.attach_devices("csv_test_files/test_devices1.csv")[1]
+        # test_device = attach_devices("csv_test_files/test_devices1.csv")[1]
         # result = test_device.has_reach()
         # results.append(result)
 
         # Test has_reach LoRa (on the Sodaq One)
-        # test_device = main.attach_devices("csv_test_files/test_devices1.csv")[2]
+        # test_device = attach_devices("csv_test_files/test_devices1.csv")[2]
         # test_device.set_technology("LoRa")
         # result = test_device.has_reach()
         # results.append(result)
 
         # Test has_reach of LTE
-        test_device = main.attach_devices("csv_test_files/test_devices1.csv")[3]
+        test_device = attach_devices("csv_test_files/test_devices1.csv")[3]
         result = test_device.has_reach()
         results.append(result)
 
         # Test has_reach AIS
-        test_device = main.attach_devices("csv_test_files/test_devices1.csv")[4]
+        test_device = attach_devices("csv_test_files/test_devices1.csv")[4]
         result = test_device.has_reach()
         results.append(result)
 
@@ -80,7 +128,7 @@ class ChoosingDevicesTester(unittest.TestCase):
     """
     def test_filter_devices_on_reach(self):
         # "test_devices1.csv" contains a device that can not determine if they have reach.
-        self.test_monitor.devices = main.attach_devices("csv_test_files/test_devices1.csv")
+        self.test_monitor.devices = attach_devices("csv_test_files/test_devices1.csv")
         expected_no_has_reach_device = self.test_monitor.devices[0]
         devices_have_reach, no_has_reach_devices= self.test_monitor.filter_devices_on_reach()
         result = no_has_reach_devices[0]
@@ -88,13 +136,13 @@ class ChoosingDevicesTester(unittest.TestCase):
         self.assertEqual(result, expected_no_has_reach_device)
 
         # "test_devices2.csv" contains a device that can determine if they have reach. But are out of reach.
-        self.test_monitor.devices = main.attach_devices("csv_test_files/test_devices2.csv")
+        self.test_monitor.devices = attach_devices("csv_test_files/test_devices2.csv")
         devices_have_reach, no_has_reach_devices = self.test_monitor.filter_devices_on_reach()
         self.assertEqual(devices_have_reach, [])
         self.assertEqual(no_has_reach_devices, [])
 
         # "test_devices3.csv" contains a device that can determine if they have reach. Moreover they have reach.
-        self.test_monitor.devices = main.attach_devices("csv_test_files/test_devices3.csv")
+        self.test_monitor.devices = attach_devices("csv_test_files/test_devices3.csv")
         expected_device = self.test_monitor.devices[0]
         devices_have_reach, no_has_reach_devices = self.test_monitor.filter_devices_on_reach()
         result = devices_have_reach[0]
@@ -106,7 +154,7 @@ class ChoosingDevicesTester(unittest.TestCase):
     """
     def test_get_highest_priority_device(self):
         # Test if choose device can choose the device that has priority one.
-        self.test_monitor.devices = main.attach_devices("csv_test_files/test_devices1.csv")
+        self.test_monitor.devices = attach_devices("csv_test_files/test_devices1.csv")
         devices_have_reach = self.test_monitor.devices
 
         # Take the first element because get_highest_priority_device returns a list because
@@ -115,7 +163,7 @@ class ChoosingDevicesTester(unittest.TestCase):
         self.assertEqual(result_device.technology, "Wifi")
 
         # Test if choose device can choose the highest priority device when the device with priority one is not present.
-        self.test_monitor.devices = main.attach_devices("csv_test_files/test_devices2.csv")
+        self.test_monitor.devices = attach_devices("csv_test_files/test_devices2.csv")
         devices_have_reach = self.test_monitor.devices
         result_device = self.test_monitor.get_highest_priority_device(devices_have_reach=devices_have_reach, no_has_reach_devices=[])[0]
         self.assertTrue(isinstance(result_device.strategy, I2CStrategy))
@@ -131,7 +179,7 @@ class ChoosingDevicesTester(unittest.TestCase):
     """
     def test_choose_device(self):
         # Test if the system choosing devices works when the device with priority one is available.
-        self.test_monitor.devices = main.attach_devices("csv_test_files/test_devices1.csv")
+        self.test_monitor.devices = attach_devices("csv_test_files/test_devices1.csv")
         devices_have_reach, no_has_reach_devices = self.test_monitor.filter_devices_on_reach()
 
         result_device = self.test_monitor.choose_device(devices_have_reach, no_has_reach_devices)[0]
@@ -139,7 +187,7 @@ class ChoosingDevicesTester(unittest.TestCase):
         self.assertEqual(result_device.technology, "Wifi")
 
         # Test if the system choosing devices works when the device with priority one is not available. Is it capable of choosing the best from the rest.
-        self.test_monitor.devices = main.attach_devices("csv_test_files/test_devices2.csv")
+        self.test_monitor.devices = attach_devices("csv_test_files/test_devices2.csv")
         devices_have_reach, no_has_reach_devices = self.test_monitor.filter_devices_on_reach()
  
         result_device = self.test_monitor.choose_device(devices_have_reach, no_has_reach_devices)[0]
@@ -147,7 +195,7 @@ class ChoosingDevicesTester(unittest.TestCase):
         self.assertEqual(result_device.technology, "LTE")
 
         # Test if the system choosing devices works when only AIS is available. So a tech which cannot determine if it is within reach.
-        self.test_monitor.devices = main.attach_devices("csv_test_files/test_devices3.csv")
+        self.test_monitor.devices = attach_devices("csv_test_files/test_devices3.csv")
         devices_have_reach, no_has_reach_devices = self.test_monitor.filter_devices_on_reach()
 
         result_device = self.test_monitor.choose_device(devices_have_reach, no_has_reach_devices)[0]
@@ -161,4 +209,203 @@ class ChoosingDevicesTester(unittest.TestCase):
         result_device = self.test_monitor.choose_device(devices_have_reach, no_has_reach_devices)
         self.assertEqual(result_device, [])
 
+    """
+        This test evaluates if the device registry only reads the csv file again when the file changed.
+    """
+    def test_device_registry(self):
+        test_registry = DeviceRegistry("csv_test_files/test_devices1.csv")
+        devices = test_registry.get_devices()
+        self.assertEqual(len(devices), 2)
+
+        # The csv file did not change so the same devices need to be returned.
+        test_registry.reload_if_changed()
+        self.assertIs(test_registry.get_devices(), devices)
+
+        # Pretend the csv file changed since it was read. The devices need to be read again.
+        test_registry.csv_stat = (0, 0, 0)
+        test_registry.reload_if_changed()
+        self.assertIsNot(test_registry.get_devices(), devices)
+        self.assertEqual(len(test_registry.get_devices()), 2)
+
+        # The monitor keeps using the same registry as long as the filename does not change
+        self.test_monitor.devices_csv_filename = "csv_test_files/test_devices1.csv"
+        registry = self.test_monitor.get_device_registry()
+        self.assertIs(self.test_monitor.get_device_registry(), registry)
+
+    """
+        This test evaluates if the reachability cache stores the has_reach verdict, the time of the probe and its latency.
+    """
+    def test_reachability_cache(self):
+        test_device = Device("AIS Base Station", "True Heading", "Carbon Pro", "AIS", 0)
+        test_device.set_strategy(AISStrategy(UART()))
+        test_cache = ReachabilityCache(lambda: [test_device], ttls={"AIS": 60})
+
+        # A device that was never asked is stale and is asked right away.
+        self.assertTrue(test_cache.is_stale(test_device))
+        self.assertEqual(test_cache.has_reach(test_device), None)
+        self.assertFalse(test_cache.is_stale(test_device))
+        self.assertIsNotNone(test_cache.get_last_probe_time(test_device))
+        self.assertGreaterEqual(test_cache.get_probe_latency(test_device), 0)
+
+        # A verdict older than the time to live is refreshed by refresh
+        probed_at = test_cache.get_last_probe_time(test_device) - 61
+        test_cache.entries[test_cache.get_key(test_device)]["probed_at"] = probed_at
+        self.assertTrue(test_cache.is_stale(test_device))
+        test_cache.refresh()
+        self.assertGreater(test_cache.get_last_probe_time(test_device), probed_at)
+
+        # The monitor reads the verdict from the cache
+        self.test_monitor.devices = [test_device]
+        self.test_monitor.reachability_cache = test_cache
+        devices_have_reach, no_has_reach_devices = self.test_monitor.filter_devices_on_reach()
+        self.assertEqual(devices_have_reach, [])
+        self.assertEqual(no_has_reach_devices, [test_device])
+
+    """
+        This test evaluates if asking the devices for reach at the same time still chooses the device with the highest priority.
+        The devices only answer when all of them were asked, so the test fails when the devices are asked one after another.
+    """
+    def test_filter_devices_on_reach_concurrently(self):
+        # The device with the highest priority answers last, but still needs to be chosen.
+        barrier = threading.Barrier(2)
+        fast_device = create_stub_device("device2", "Wifi", 2, barrier=barrier)
+        slow_device = create_stub_device("device1", "Wifi", 1, barrier=barrier, release=fast_device.answered)
+        self.test_monitor.devices = [fast_device, slow_device]
+        devices_have_reach, _ = self.test_monitor.filter_devices_on_reach_concurrently()
+        self.assertEqual(devices_have_reach, [slow_device])
+
+        # The device with the highest priority has no reach, so the next device is chosen without waiting for the device with the lowest priority.
+        barrier = threading.Barrier(3)
+        release = threading.Event()
+        no_reach_device = create_stub_device("device1", "Wifi", 1, reach=False, barrier=barrier)
+        reach_device = create_stub_device("device2", "Wifi", 2, barrier=barrier)
+        slow_device = create_stub_device("device3", "Wifi", 3, barrier=barrier, release=release)
+        self.test_monitor.devices = [no_reach_device, reach_device, slow_device]
+        devices_have_reach, _ = self.test_monitor.filter_devices_on_reach_concurrently()
+        self.assertEqual(devices_have_reach, [reach_device])
+        self.assertFalse(slow_device.answered.is_set())
+        release.set()
+
+        # A device that does not answer within the probe_timeout has no reach.
+        self.test_monitor.probe_timeout = 0.2
+        release = threading.Event()
+        too_slow_device = create_stub_device("device1", "Wifi", 1, release=release)
+        ais_device = create_stub_device("device2", "Wifi", 2, reach=None)
+        self.test_monitor.devices = [too_slow_device, ais_device]
+        devices_have_reach, no_has_reach_devices = self.test_monitor.filter_devices_on_reach_concurrently()
+        self.assertEqual(devices_have_reach, [])
+        self.assertEqual(no_has_reach_devices, [ais_device])
+        self.assertFalse(too_slow_device.answered.is_set())
+        release.set()
+
+    """
+        This test evaluates if acknowledging with multiple devices at the same time takes the time of the fastest device.
+        The devices only reply when all of them sent, and the Wifi device only replies after the file got its status, so it is not waited for.
+    """
+    def test_acknowledge_concurrently(self):
+        test_file = File("test")
+        test_file.dab_id = 7
+        other_file = File("other")
+        other_file.dab_id = 8
+        self.test_monitor.folder.files = [test_file, other_file]
+        data = {"dab_id": 7, "message_type": 1}
+
+        # The file gets the status of the fastest device, without waiting for the slow device
+        barrier = threading.Barrier(3)
+        release = threading.Event()
+        failing_device = create_stub_device("LoRa device", "LoRa", 1, reply=False, barrier=barrier)
+        fast_device = create_stub_device("LTE device", "LTE", 1, reply={"ack_information": [7, True]}, barrier=barrier)
+        wifi_device = create_stub_device("Wifi device", "Wifi", 1, reply={"ack_information": [7, False], "different_ack_information": [[8, True]]}, barrier=barrier, release=release)
+        self.test_monitor.acknowledge(data, [failing_device, fast_device, wifi_device])
+        self.assertEqual(test_file.get_status(), Status.CONFIRMATION_SENT)
+        self.assertFalse(wifi_device.answered.is_set())
+
+        # Every device gets its own data with its own technology
+        self.assertEqual(fast_device.sent_data["technology"], "LTE")
+        self.assertEqual(wifi_device.sent_data["technology"], "Wifi")
+        self.assertNotIn("technology", data)
+
+        # The reply of Wifi arrives later and confirms the file and the other file it received
+        confirmed = threading.Event()
+        self.test_monitor.folder.add_status_listener(lambda file: file is test_file and file.get_status() == Status.CONFIRMED and confirmed.set())
+        release.set()
+        self.assertTrue(confirmed.wait(STUB_TIMEOUT))
+        self.assertFalse(test_file.get_valid())
+        self.assertEqual(other_file.get_status(), Status.CONFIRMED)
+
+        # The file is only skipped when every device failed
+        test_file.set_status(Status.CONFIRMING)
+        self.test_monitor.acknowledge(data, [create_stub_device("LoRa device", "LoRa", 1, reply=False), create_stub_device("LTE device", "LTE", 1, reply=False)])
+        self.assertEqual(test_file.get_status(), Status.SKIP)
+
+    """
+        This test evaluates if the link scheduler chooses the device that is expected to confirm the fastest and explores stale devices.
+    """
+    def test_link_scheduler(self):
+        filename = os.path.join(tempfile.mkdtemp(), "links.json")
+        test_scheduler = LinkScheduler(filename, explore_interval=100)
+        wifi_device = Device("wifi", "test", "test", "Wifi", 1)
+        lte_device = Device("lte", "test", "test", "LTE", 2)
+        self.test_monitor.link_scheduler = test_scheduler
+
+        # Devices that were never used are explored first, the device with the highest priority first
+        self.assertEqual(self.test_monitor.get_highest_priority_device([lte_device, wifi_device]), wifi_device)
+        self.assertEqual(test_scheduler.get_trace()[-1]["reason"], "explore")
+
+        # Wifi often fails, so LTE is expected to confirm faster even though Wifi has a higher priority
+        now = time.time()
+        for success in [True, False, False, False]:
+            test_scheduler.record(wifi_device, success, 1.0, now)
+        for _ in range(4):
+            test_scheduler.record(lte_device, True, 2.0, now)
+        self.assertEqual(test_scheduler.get_statistics(wifi_device, now)["success_rate"], 0.25)
+        self.assertEqual(test_scheduler.get_statistics(lte_device, now)["p95"], 2.0)
+        self.assertEqual(test_scheduler.choose([wifi_device, lte_device], now), lte_device)
+
+        trace = test_scheduler.get_trace()[-1]
+        self.assertEqual(trace["reason"], "expected_time")
+        self.assertEqual([candidate["expected_time"] for candidate in trace["candidates"]], [4.0, 2.0])
+
+        # A device that was not used for explore_interval seconds is chosen once to update its statistics
+        self.assertEqual(test_scheduler.choose([wifi_device, lte_device], now + 100), wifi_device)
+
+        # The statistics survive a restart
+        test_scheduler.save()
+        restarted_scheduler = LinkScheduler(filename)
+        restarted_scheduler.load()
+        self.assertEqual(restarted_scheduler.get_statistics(wifi_device, now), test_scheduler.get_statistics(wifi_device, now))
+
+    """
+        This test evaluates if the link scheduler can choose from all devices that have reach when the devices are asked at the same time.
+    """
+    def test_choose_device_with_link_scheduler(self):
+        class TestRegistry:
+            def __init__(self, devices):
+                self.devices = devices
+            def get_csv_filename(self):
+                return ""
+            def get_devices(self):
+                return self.devices
+
+        # Both devices are asked at the same time and Wifi only answers after LTE
+        barrier = threading.Barrier(2)
+        lte_device = create_stub_device("lte", "LTE", 1, barrier=barrier)
+        wifi_device = create_stub_device("wifi", "Wifi", 2, barrier=barrier, release=lte_device.answered)
+        self.test_monitor.device_registry = TestRegistry([lte_device, wifi_device])
+        self.test_monitor.concurrent_probing = True
+        self.test_monitor.link_scheduler = LinkScheduler()
+
+        # LTE always fails and Wifi always succeeds, so Wifi is chosen even though LTE has a higher priority and answers first
+        now = time.time()
+        for _ in range(5):
+            self.test_monitor.link_scheduler.record(lte_device, False, 1.0, now)
+            self.test_monitor.link_scheduler.record(wifi_device, True, 1.0, now)
+        self.assertEqual(self.test_monitor.choose_device(), [wifi_device])
 
+        # Without a link scheduler the device with the highest priority is chosen as soon as it answers
+        self.test_monitor.link_scheduler = None
+        wifi_device.release = threading.Event()
+        wifi_device.answered.clear()
+        self.assertEqual(self.test_monitor.choose_device(), [lte_device])
+        self.assertFalse(wifi_device.answered.is_set())
+        wifi_device.release.set()
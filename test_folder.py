@@ -0,0 +1,260 @@
+'''
+project: slimmer maken multiconnectivity modem
+author: Frank Montenij
+Description: A testcase to test the indexes of the Folder and the classes that keep its files in memory and on disk:
+             FolderJournal, BodyCache, FolderArchive and Retention.
+
+Changelog: Frank created the file with the tests that were in test_wifi.py.
+'''
+
+from File import File
+from Folder import Folder
+from Status import Status
+from Category import Category
+from FolderJournal import FolderJournal
+from BodyCache import BodyCache
+from FolderArchive import FolderArchive
+from Retention import Retention
+import os
+import tempfile
+import unittest
+
+
+class FolderTester(unittest.TestCase):
+    def test_folder_index(self):
+        """Testcase to test if the indexes of Folder stay up to date when files are added and updated"""
+
+        # Prepare the test
+        test_folder = Folder("./correct")
+        test_files = []
+        for dab_id in range(1, 4):
+            test_file = File(f"test{dab_id}")
+            test_file.lines = [dab_id, 1, "other"]
+            test_file.set_information()
+            test_files.append(test_file)
+            test_folder.add_file(test_file)
+
+        # Test if files can be found by dab_id and field
+        self.assertEqual(test_folder.find_file_by_dab_id(2), test_files[1])
+        self.assertEqual(test_folder.find_file_by_dab_id(4), False)
+        self.assertEqual(test_folder.find_files_by_field("category", Category.OTHER), test_files)
+        self.assertEqual(test_folder.find_files_by_field("unknown_field", 1), False)
+
+        # Test if the index is updated when a file changes. The files need to be returned in the order they were added.
+        test_folder.update_file(3, status=Status.CONFIRMED)
+        test_folder.update_file(1, status=Status.CONFIRMED)
+        test_files[1].set_valid(False)
+        self.assertEqual(test_folder.find_files_by_field("status", Status.CONFIRMED), [test_files[0], test_files[2]])
+        self.assertEqual(test_folder.find_files_by_field("status", Status.CONFIRMING), [test_files[1]])
+        self.assertEqual(test_folder.find_files_by_field("valid", False), [test_files[1]])
+
+        # Test if files that are appended directly or a files list that is replaced are indexed as well
+        test_file = File("test4")
+        test_file.dab_id = 4
+        test_folder.files.append(test_file)
+        self.assertEqual(test_folder.find_file_by_dab_id(4), test_file)
+
+        test_folder.files = [test_file]
+        self.assertEqual(test_folder.find_file_by_dab_id(1), False)
+        self.assertEqual(test_folder.find_files_by_field("status", Status.CONFIRMED), [])
+
+    def test_file_listeners(self):
+        """Testcase to test if a failing file listener does not stop add_file or the other listeners"""
+
+        test_folder = Folder("./correct")
+        received_files = []
+
+        def failing_listener(file):
+            raise RuntimeError("listener failed")
+
+        test_folder.add_file_listener(failing_listener)
+        test_folder.add_file_listener(received_files.append)
+
+        test_file = File("test1")
+        test_file.lines = [1, 1, "other"]
+        test_file.set_information()
+        test_folder.add_file(test_file)
+
+        self.assertEqual(test_folder.find_file_by_dab_id(1), test_file)
+        self.assertEqual(received_files, [test_file])
+
+    def test_folder_journal(self):
+        """Testcase to test if the status of the files survives a restart"""
+
+        with tempfile.TemporaryDirectory() as state_directory:
+            # Prepare the test with a journal that writes a snapshot after every 3 records
+            test_folder = Folder("./correct")
+            journal = FolderJournal(state_directory, snapshot_interval=3)
+            journal.recover(test_folder)
+            journal.start()
+
+            for dab_id in range(1, 4):
+                test_file = File(f"test{dab_id}")
+                test_file.lines = [dab_id, 1, "other"]
+                test_file.set_information()
+                test_folder.add_file(test_file)
+
+            test_file = File("test4")
+            test_file.lines = ["4", "1", "CAP", "<alert>", "</alert>"]
+            test_file.set_information()
+            test_folder.add_file(test_file)
+
+            test_folder.update_file(1, status=Status.CONFIRMED, valid=False)
+            test_folder.update_file(2, status=Status.SKIP)
+            test_folder.find_file_by_dab_id(3).set_sent_to_onboard_systems(True)
+            journal.stop()
+
+            # Restore the files in a new folder as if the system was restarted
+            recovered_folder = Folder("./correct")
+            FolderJournal(state_directory).recover(recovered_folder)
+
+            self.assertEqual([file.get_dab_id() for file in recovered_folder.files], [1, 2, 3, 4])
+            self.assertEqual(recovered_folder.find_file_by_dab_id(1).get_status(), Status.CONFIRMED)
+            self.assertEqual(recovered_folder.find_file_by_dab_id(1).get_valid(), False)
+            self.assertEqual(recovered_folder.find_file_by_dab_id(2).get_status(), Status.SKIP)
+            self.assertEqual(recovered_folder.find_file_by_dab_id(3).get_sent_to_onboard_systems(), True)
+            self.assertEqual(recovered_folder.find_file_by_dab_id(3).get_lines(), [3, 1, "other"])
+
+            # A file that was being confirmed when the system stopped needs to be confirmed again
+            self.assertEqual(recovered_folder.find_file_by_dab_id(3).get_status(), Status.UNCONFIRMED)
+
+            # The body is not in the snapshot, it is read from the body store
+            with open(os.path.join(state_directory, "snapshot.json")) as snapshot_file:
+                self.assertNotIn("<alert>", snapshot_file.read())
+            self.assertEqual(recovered_folder.find_file_by_dab_id(4).get_lines(), ["4", "1", "CAP", "<alert>", "</alert>"])
+
+            # With a BodyCache the body stays in the body store until it is needed, so a restart does not write it again
+            body_filename = os.path.join(state_directory, "bodies", f"{recovered_folder.find_file_by_dab_id(4).get_sequence_number()}.body")
+            modification_time = os.stat(body_filename).st_mtime_ns
+            cached_folder = Folder("./correct")
+            cached_folder.body_cache = BodyCache(os.path.join(state_directory, "bodies"), max_size=0)
+            FolderJournal(state_directory).recover(cached_folder)
+
+            cached_file = cached_folder.find_file_by_dab_id(4)
+            self.assertTrue(cached_file.evicted)
+            self.assertEqual(cached_file.get_lines(), ["4", "1", "CAP", "<alert>", "</alert>"])
+            self.assertEqual(os.stat(body_filename).st_mtime_ns, modification_time)
+            self.assertEqual(os.listdir(os.path.join(state_directory, "bodies")), [os.path.basename(body_filename)])
+
+    def test_body_cache(self):
+        """Testcase to test if the bodies of the least recently used files are evicted to disk and read again when they are needed"""
+
+        with tempfile.TemporaryDirectory() as state_directory:
+            test_folder = Folder("./correct")
+            test_folder.body_cache = BodyCache(state_directory, max_size=2500)
+
+            body = ["<alert>"] + ["x" * 100] * 5 + ["</alert>"]
+            for dab_id in range(1, 6):
+                test_file = File("test")
+                test_file.lines = [str(dab_id), "1", "CAP"] + body
+                test_file.set_information()
+                test_folder.add_file(test_file)
+
+                # The lines are only encoded when the file is requested
+                self.assertIsNone(test_file.encoded_lines)
+                test_file.get_encoded_lines()
+
+            # Every body takes more than 1000 bytes with its encoded lines, so only the last two files are kept in memory
+            test_folder.sync_index()
+            self.assertLessEqual(test_folder.body_cache.get_size(), 2500)
+            self.assertEqual([test_file.evicted for test_file in test_folder.files], [True, True, True, False, False])
+            self.assertEqual(test_folder.files[0].body, None)
+
+            # An evicted body is read from disk
+            self.assertEqual(test_folder.files[0].get_lines(), ["1", "1", "CAP"] + body)
+
+            # Using the encoded lines of a file makes it the most recently used file, so the oldest file in memory is evicted
+            test_folder.files[1].get_encoded_lines()
+            self.assertEqual(test_folder.files[1].encoded_lines, test_folder.files[1].get_encoded_lines())
+            self.assertEqual(test_folder.files[3].encoded_lines, None)
+            self.assertEqual(test_folder.files[3].get_lines(), ["4", "1", "CAP"] + body)
+
+            # While the folder holds its lock no body is written to disk, the bodies are evicted after the lock is released
+            amount_of_bodies = len(os.listdir(state_directory))
+            for dab_id in range(6, 9):
+                test_file = File("test")
+                test_file.lines = [str(dab_id), "1", "CAP"] + body
+                test_file.set_information()
+                test_folder.files.append(test_file)
+
+            with test_folder.lock:
+                test_folder.sync_index()
+            self.assertGreater(len(test_folder.body_cache.victims), 0)
+            self.assertEqual(len(os.listdir(state_directory)), amount_of_bodies)
+
+            test_folder.evict_bodies()
+            self.assertEqual(len(test_folder.body_cache.victims), 0)
+            self.assertLessEqual(test_folder.body_cache.get_size(), 2500)
+            self.assertGreater(len(os.listdir(state_directory)), amount_of_bodies)
+
+            # A file that is removed before its body is written is not evicted
+            test_file = File("test")
+            test_file.lines = ["9", "1", "CAP"] + body
+            test_file.set_information()
+            test_folder.files.append(test_file)
+
+            with test_folder.lock:
+                test_folder.sync_index()
+            removed_file = next(iter(test_folder.body_cache.victims.values()))
+            test_folder.remove_files([removed_file])
+            self.assertFalse(removed_file.evicted)
+            self.assertFalse(os.path.exists(test_folder.body_cache.get_filename(removed_file)))
+            self.assertEqual(removed_file.get_lines()[0], removed_file.lines[0])
+
+            # A File has no __dict__
+            self.assertFalse(hasattr(test_folder.files[0], "__dict__"))
+
+    def test_retention(self):
+        """Testcase to test if old, confirmed and expired files are moved to the archive a batch at a time"""
+
+        with tempfile.TemporaryDirectory() as state_directory:
+            test_folder = Folder("./correct")
+            test_folder.archive = FolderArchive(state_directory + "/archive.jsonl")
+            journal = FolderJournal(state_directory)
+            journal.recover(test_folder)
+            journal.start()
+
+            for dab_id in range(1, 11):
+                test_file = File("test")
+                test_file.lines = [str(dab_id), "1", "other"]
+                test_file.set_information()
+                test_file.set_status(Status.UNCONFIRMED)
+                test_folder.add_file(test_file)
+
+            # A CAP alert that expired and a CAP alert that did not expire yet
+            for dab_id, expires in ((11, "2000-01-01T00:00:00+00:00"), (12, "2999-01-01T00:00:00+00:00")):
+                test_file = File("test")
+                test_file.lines = [str(dab_id), "1", "CAP", "<alert>", f"<expires>{expires}</expires>", "</alert>"]
+                test_file.set_information()
+                test_file.set_status(Status.UNCONFIRMED)
+                test_folder.add_file(test_file)
+
+            # File 5 is being confirmed, so it is never removed
+            test_folder.update_file(5, status=Status.CONFIRMING)
+            test_folder.update_file(6, status=Status.CONFIRMED)
+            test_folder.files[5].time_of_confirmation -= 7200
+
+            retention = Retention(test_folder, max_entries=8, confirmed_retention=3600, batch_size=3, scan_size=20)
+
+            # The oldest files above max_entries are removed first, at most batch_size each tick
+            removed_files = retention.tick()
+            self.assertEqual([file.get_dab_id() for file in removed_files], [1, 2, 3])
+            removed_files = retention.tick()
+            self.assertEqual([file.get_dab_id() for file in removed_files], [4, 6, 11])
+            self.assertEqual(retention.tick(), [])
+            self.assertEqual([file.get_dab_id() for file in test_folder.files], [5, 7, 8, 9, 10, 12])
+
+            # The indexes do not contain the removed files
+            self.assertFalse(test_folder.find_file_by_dab_id(1))
+            self.assertEqual([file.get_dab_id() for file in test_folder.find_files_by_field("category", Category.CAP)], [12])
+
+            # The removed files are in the archive and can still be requested
+            self.assertEqual([file.get_dab_id() for file in test_folder.archive.find_files()], [1, 2, 3, 4, 6, 11])
+            self.assertEqual(test_folder.archive.find_files(Category.CAP)[0].get_lines()[4], "<expires>2000-01-01T00:00:00+00:00</expires>")
+            self.assertEqual([file.get_dab_id() for file in test_folder.archive.find_files(since=4)], [6, 11])
+
+            # The removed files are not restored after a restart
+            journal.stop()
+            recovered_folder = Folder("./correct")
+            FolderJournal(state_directory).recover(recovered_folder)
+            self.assertEqual(sorted(file.get_dab_id() for file in recovered_folder.files), [5, 7, 8, 9, 10, 12])
@@ -27,11 +27,21 @@ Description: A class which represents a testcase with test as method to test the
 Changelog: Alfred created the file and Frank updated the file to make it work again.
 '''
 
+import contextlib
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
 import time
 import unittest
+from aisutils import BitVector, binary, nmea
 from Category import Category
 from Devices.Strategy import AISStrategy, I2CStrategy
-from Interface.Ethernet import Ethernet
+from Interface.Ethernet import Ethernet, connection_pool, pad_msg_length
+from Interface.AISArmor import armor_text, dearmor, dearmor_bits
+from Interface.Framing import ConnectionClosedError, InvalidLengthError, read_message, write_message
 from Interface.I2C import I2C
 from Interface.SPI import SPI
 from Interface.UART import UART
@@ -40,7 +50,8 @@ from Status import Status
 from File import File
 from Folder import Folder
 from Devices.Device import Device
-from main import Monitor, attach_devices
+from main import Monitor
+from Devices.DeviceRegistry import attach_devices
 
 ''''
 project: Half-Duplex
@@ -82,6 +93,41 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(assess_latitude, test_latitude)
         self.assertEqual(assess_longitude, test_longitude)
 
+    """
+        This test checks if set_lines only splits the header in lines and keeps the rest of the file as one body.
+    """
+    def test_file_body(self):
+        with tempfile.TemporaryDirectory() as test_path:
+            contents = {
+                "cap.txt": "7\n1\nCAP\n<alert>\n  <info>ü</info>\n\n</alert>\n",
+                "location.txt": "68\n2\nlocation\n52.6525\n4.7448\n",
+                "no_newline.txt": "3\n3\nweather\nlast line",
+            }
+
+            for filename, content in contents.items():
+                with open(os.path.join(test_path, filename), mode='w') as dab_file:
+                    dab_file.write(content)
+
+                test_file = File(filename)
+                test_file.set_lines(test_path + os.sep)
+                test_file.set_information()
+
+                # The lines are the same as when every line of the file is read separately
+                self.assertEqual(test_file.get_lines(), content.rstrip("\n").split("\n"))
+                self.assertEqual(test_file.get_encoded_lines(), json.dumps(content.rstrip("\n").split("\n")))
+
+                if filename == "location.txt":
+                    self.assertEqual(test_file.get_body(), None)
+                    self.assertEqual(test_file.get_coordinates(), (52.6525, 4.7448))
+
+            self.assertEqual(test_file.get_header(), ["3", "3", "weather"])
+            self.assertEqual(test_file.get_body(), b"last line")
+
+        # Setting the lines splits them in the same way
+        test_file.lines = ["7", "1", "CAP", "<alert>", "</alert>"]
+        self.assertEqual(test_file.get_header(), ["7", "1", "CAP"])
+        self.assertEqual(test_file.get_body(), b"<alert>\n</alert>")
+
     def test_folder(self):
         test_path = "correct/"
         test_folder = Folder(test_path)
@@ -165,6 +211,89 @@ class MyTestCase(unittest.TestCase):
         test_interface.close_socket()
 
 
+    def test_ethernet_keep_alive(self):
+        # A server that supports keep alive. It answers every message on a connection until the client closes it.
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        accepted_connections = []
+
+        def serve():
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except OSError:
+                    return
+                accepted_connections.append(conn)
+
+                with conn:
+                    while True:
+                        message_length = conn.recv(10)
+                        if not message_length:
+                            break
+                        message = json.loads(conn.recv(int(message_length)))
+                        reply = json.dumps({"reply": True, "keep_alive": message.get("keep_alive", False)})
+                        conn.send(pad_msg_length(10, len(reply)))
+                        conn.send(reply.encode())
+
+        threading.Thread(target=serve, daemon=True).start()
+
+        test_interface = Ethernet()
+        test_interface.init_socket("127.0.0.1", server.getsockname()[1])
+        test_interface.set_keep_alive(True)
+
+        # Three messages need to be sent over one connection
+        for _ in range(3):
+            self.assertEqual(test_interface.request({"has_reach": "Wifi"}, 10)["reply"], True)
+        self.assertEqual(len(accepted_connections), 1)
+
+        # When the connection is broken the message is sent again over a new connection
+        accepted_connections[0].shutdown(socket.SHUT_RDWR)
+        time.sleep(0.1)
+        self.assertEqual(test_interface.request({"has_reach": "Wifi"}, 10)["reply"], True)
+        self.assertEqual(len(accepted_connections), 2)
+
+        test_interface.close_socket()
+        connection_pool.close((test_interface.get_ip_address(), test_interface.get_port()))
+        server.close()
+
+    def test_framing(self):
+        sender, receiver = socket.socketpair()
+
+        # A message larger than one TCP segment that arrives in small parts needs to be received completely.
+        message = json.dumps({"reply": True, "information": ["<alert>" + "x" * 100000 + "</alert>"]}).encode()
+        framed_message = pad_msg_length(10, len(message)) + message
+
+        def send_in_parts():
+            for start in range(0, len(framed_message), 7000):
+                sender.sendall(framed_message[start:start + 7000])
+                time.sleep(0.001)
+
+        threading.Thread(target=send_in_parts).start()
+        self.assertEqual(read_message(receiver, 10), message)
+
+        # write_message and read_message need to work together
+        write_message(sender, "test_response", 10)
+        self.assertEqual(read_message(receiver, 10).decode(), "test_response")
+
+        # Closing the connection in the middle of a message raises a ConnectionClosedError
+        sender.sendall(pad_msg_length(10, 100) + b"only a part")
+        sender.close()
+        with self.assertRaises(ConnectionClosedError):
+            read_message(receiver, 10)
+        receiver.close()
+
+        # A length that is not a number or larger than max_length is rejected before the message is received
+        sender, receiver = socket.socketpair()
+        sender.sendall(pad_msg_length(10, 9999999999))
+        with self.assertRaises(InvalidLengthError):
+            read_message(receiver, 10, 65536)
+        sender.sendall(b"no number!")
+        with self.assertRaises(InvalidLengthError):
+            read_message(receiver, 10, 65536)
+        sender.close()
+        receiver.close()
+
     def test_spi(self):
         test_interface = SPI()
         test_interface.init_spi(0, 1)
@@ -217,3 +346,94 @@ class MyTestCase(unittest.TestCase):
 
 
 
+
+    def test_bbm_fragmentation(self):
+        class BaseStation:
+            """Keeps the written sentences and returns the ABKs that are put in abks when they are read."""
+            def __init__(self, test_case):
+                self.test_case = test_case
+                self.sentences = []
+                self.abks = []
+                self.abk_available = threading.Event()
+
+            def write(self, sentence):
+                # Every write needs to be exactly one sentence that ends with <CR><LF>
+                self.test_case.assertTrue(sentence.endswith("\r\n"))
+                self.test_case.assertEqual(sentence.count("!"), 1)
+                self.test_case.assertEqual(sentence.count("\r\n"), 1)
+                self.sentences.append(sentence[:-2])
+
+            def read_rs232(self):
+                self.abk_available.wait()
+                self.abk_available.clear()
+                return self.abks.pop(0).encode()
+
+            def send_abk(self, seq_id, ack_type):
+                sentence = f"AIABK,244000000,A,8,{seq_id},{ack_type}"
+                self.abks.append(f"${sentence}*{nmea.checksumStr(sentence)}\r\n")
+                self.abk_available.set()
+                time.sleep(0.05)
+
+        base_station = BaseStation(self)
+        test_strategy = AISStrategy(base_station, abk_timeout=0.2)
+        failed_broadcasts = []
+        test_strategy.add_abk_listener(lambda dab_ids, broadcasted: failed_broadcasts.append(dab_ids) if not broadcasted else None)
+
+        # A batch that does not fit in one sentence is split. Every sentence is valid and only the last one contains fill bits.
+        batch = [{"dab_id": dab_id, "message_type": 4, "dab_signal": 20} for dab_id in range(1, 6)]
+        self.assertTrue(test_strategy.communicate_batch(batch))
+        self.assertGreater(len(base_station.sentences), 1)
+        decoded = [nmea.bbmDecode(sentence) for sentence in base_station.sentences]
+        self.assertEqual({int(fields["totSent"]) for fields in decoded}, {len(decoded)})
+        self.assertEqual([int(fields["sentNum"]) for fields in decoded], list(range(1, len(decoded) + 1)))
+        self.assertEqual({fields["seqId"] for fields in decoded}, {"0"})
+        self.assertTrue(all(fields["numFillBits"] == "0" for fields in decoded[:-1]))
+
+        # The payload of the sentences together is the payload of the whole message
+        payload, fill_bits = binary.bitvectoais6(BitVector.BitVector(textstring='  ' + ';'.join(test_strategy.build_message(data) for data in batch)))
+        self.assertEqual("".join(fields["data"] for fields in decoded), payload)
+        self.assertEqual(decoded[-1]["numFillBits"], str(fill_bits))
+
+        # The next message gets the next sequence id and the ABKs are matched to the messages
+        base_station.sentences.clear()
+        self.assertTrue(test_strategy.communicate({"dab_id": 7, "message_type": 1}))
+        self.assertEqual(nmea.bbmDecode(base_station.sentences[0])["seqId"], "1")
+        base_station.send_abk(0, 3)
+        base_station.send_abk(1, 2)
+        self.assertEqual(test_strategy.get_ack_type(0), 3)
+        self.assertEqual(test_strategy.wait_for_abk(1, 1), 2)
+        self.assertEqual(failed_broadcasts, [[7]])
+
+        # The sequence id rotates from 9 back to 0. A sequence id with an ABK is used again right away, without an ABK only after the abk_timeout.
+        for _ in range(8):
+            test_strategy.communicate({"dab_id": 8, "message_type": 1})
+        start = time.monotonic()
+        base_station.sentences.clear()
+        test_strategy.communicate_batch([{"dab_id": 9, "message_type": 1}, {"dab_id": 10, "message_type": 1}])
+        self.assertEqual(nmea.bbmDecode(base_station.sentences[0])["seqId"], "0")
+        test_strategy.communicate({"dab_id": 11, "message_type": 1})
+        self.assertLess(time.monotonic() - start, 0.1)
+        test_strategy.communicate({"dab_id": 12, "message_type": 1})
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+        # A message that does not fit in 9 sentences is not sent
+        self.assertFalse(test_strategy.communicate({"dab_id": "9" * 500, "message_type": 1}))
+
+    def test_ais_armor(self):
+        # BitVector turns the characters below 0x10 into 4 bits instead of 8, so only the characters from 0x10 are compared
+        characters = [chr(character) for character in range(0x10, 0x100)]
+        messages = ["  ACK:67,MSG:4,RSSI:20,SNR:-1", "  ACK:6,MSG:1", "Alfred"]
+        messages += ["".join(characters[(length * 7 + index) % len(characters)] for index in range(length)) for length in range(1, 100)]
+
+        # The payload and fill bits need to be the same as with BitVector, and dearmoring needs to give the message back
+        with contextlib.redirect_stdout(io.StringIO()):
+            for message in messages:
+                payload, fill_bits = armor_text(message)
+                self.assertEqual((payload, fill_bits), binary.bitvectoais6(BitVector.BitVector(textstring=message)))
+                self.assertEqual(dearmor(payload, fill_bits), message.encode("latin-1"))
+                self.assertEqual(dearmor_bits(payload, fill_bits), (int.from_bytes(message.encode("latin-1"), "big"), len(message) * 8))
+
+        with self.assertRaises(ValueError):
+            dearmor("XYZ")
+        with self.assertRaises(ValueError):
+            dearmor("0", 0)
@@ -4,9 +4,11 @@ author: Frank Montenij
 Description: This file contains the logic of choosing a test from a supported testcase which the user can choose.
 
 Changelog: Frank created the file.
+           Frank added the tests of the Folder.
 '''
 
 from test_wifi import WifiConfirmTester
+from test_folder import FolderTester
 from test_half_duplex import MyTestCase
 from test_choosing_devices import ChoosingDevicesTester
 from test_retrying_ack import RetryingAckTester
@@ -14,7 +16,7 @@ from test_onboard_interface import OnBoardInterfaceTester
 import unittest
 
 def main():
-    test_classes = [WifiConfirmTester(), ChoosingDevicesTester(), MyTestCase(), RetryingAckTester(), OnBoardInterfaceTester()]
+    test_classes = [WifiConfirmTester(), FolderTester(), ChoosingDevicesTester(), MyTestCase(), RetryingAckTester(), OnBoardInterfaceTester()]
     function_names_of_test_classes = {test_class:get_function_names_startwith_test(test_class) for test_class in test_classes}
 
     test_name = input("Welke test wilt u uitvoeren? ")
@@ -7,15 +7,23 @@ Changelog: Frank created the file.
 '''
 
 import unittest
+import asyncio
 import socket
 import json
+import tempfile
+import threading
+import msgpack
 from unittest.case import expectedFailure
 from Category import Category
+from Codec import CATEGORY_NUMBERS
 from Error import Error
 from File import File
-from InterfaceOnboardSystems import ClientClosedConnectionError, InterfaceOnboardSystems
+from InterfaceOnboardSystems import AsyncInterfaceOnboardSystems, ClientClosedConnectionError, InterfaceOnboardSystems
+from Interface.Framing import read_binary_message, read_message, write_message
 from Request import CategoryRequest, LatestRequest, TestRequest
 from Folder import Folder
+from FolderArchive import FolderArchive
+from Subscription import Subscription
 
 class OnBoardInterfaceTester(unittest.TestCase):
     """
@@ -57,6 +65,19 @@ class OnBoardInterfaceTester(unittest.TestCase):
             _ = self.test_interface.receive_message(conn)
         conn.close()
 
+    """
+        This test checks if the interface answers a request with a length that is not a number or too large with an error and closes the connection.
+    """
+    def test_interface_invalid_length(self):
+        for length in [b"9999999999", b"no number!"]:
+            client, conn = socket.socketpair()
+            client.sendall(length)
+            self.test_interface.handle_client(conn)
+
+            self.assertEqual(json.loads(read_message(client, 10)), {"reply": False, "error_message": Error.INCORRECT_FORMAT.value})
+            self.assertEqual(client.recv(10), b"")
+            client.close()
+
     """
         This test checks if the interface can validate input true when send correctly and validate false when send incorrectly.
     """
@@ -214,7 +235,367 @@ class OnBoardInterfaceTester(unittest.TestCase):
             self.test_interface.handle_client(conn)
             conn.close()
 
-        
+    """
+        This test checks if the asyncio interface answers the same requests as the threaded interface.
+        And if it disconnects clients that do not send their request in time.
+    """
+    def test_async_onboard_interface(self):
+        test_file = File("")
+        test_file.lines = [1, 1, "weather"]
+        test_file.set_information()
+        self.test_interface.folder.files.append(test_file)
+
+        async_interface = AsyncInterfaceOnboardSystems(self.test_interface.folder, host="127.0.0.1", port=0, read_timeout=0.2, max_connections=1)
+        loop = asyncio.new_event_loop()
+        server_thread = threading.Thread(target=loop.run_until_complete, args=(async_interface.serve(),), daemon=True)
+        server_thread.start()
+        while async_interface.server is None:
+            pass
+        port = async_interface.server.sockets[0].getsockname()[1]
+
+        def request(message):
+            client = socket.create_connection(("127.0.0.1", port))
+            write_message(client, message, 10)
+            reply = json.loads(read_message(client, 10))
+            client.close()
+            return reply
+
+        self.assertEqual(request(json.dumps({"request_type": "by_category", "category": "weather"}))["information"], [test_file.lines])
+        self.assertEqual(request(json.dumps({"request_type": "by_category", "category": "unknown"})), {"reply": False, "error_message": Error.INCORRECT_FORMAT.value})
+        self.assertEqual(request("no json"), {"reply": False, "error_message": Error.INCORRECT_JSON_DECODER.value})
+
+        # A client that does not send a request is disconnected after the read_timeout
+        client = socket.create_connection(("127.0.0.1", port))
+        client.settimeout(2)
+
+        # A client that connects while all connections are in use gets an error right away instead of waiting
+        other_client = socket.create_connection(("127.0.0.1", port))
+        other_client.settimeout(0.1)
+        self.assertEqual(json.loads(read_message(other_client, 10)), {"reply": False, "error_message": Error.TOO_MANY_CONNECTIONS.value})
+        other_client.close()
+
+        self.assertEqual(client.recv(10), b"")
+        client.close()
+
+        async_interface.stop()
+        server_thread.join(2)
+        self.assertFalse(server_thread.is_alive())
+        loop.close()
 
+    """
+        This test checks if a session can carry more than one request and if every response carries the request_id of its request.
+        Both the threaded and the asyncio interface are tested.
+    """
+    def test_session(self):
+        test_file = File("")
+        test_file.lines = [1, 1, "weather"]
+        test_file.set_information()
+        self.test_interface.folder.files.append(test_file)
+
+        def run_session(port):
+            client = socket.create_connection(("127.0.0.1", port))
+            write_message(client, json.dumps({"request_type": "session"}), 10)
+            self.assertEqual(json.loads(read_message(client, 10)), {"request_id": None, "reply": True, "request_type": "session"})
+
+            # Send the requests without waiting for the responses
+            for request_id in range(5):
+                write_message(client, json.dumps({"request_type": "by_category", "category": "weather", "request_id": request_id}), 10)
+            write_message(client, json.dumps({"request_type": "unknown", "request_id": "error"}), 10)
+            write_message(client, json.dumps({"request_type": "disconnect"}), 10)
+
+            replies = [json.loads(read_message(client, 10)) for _ in range(7)]
+            client.close()
+
+            # The disconnect response needs to be the last response. The other responses can be in any order.
+            self.assertEqual(replies[-1]["request_type"], "disconnect")
+            replies_by_id = {reply["request_id"]: reply for reply in replies[:-1]}
+            self.assertEqual(sorted(replies_by_id.keys(), key=str), sorted([0, 1, 2, 3, 4, "error"], key=str))
+            self.assertEqual(replies_by_id[3]["information"], [test_file.lines])
+            self.assertEqual(replies_by_id["error"]["error_message"], Error.UNKOWN_REQUEST_TYPE.value)
+
+        # The threaded interface
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        server_thread = threading.Thread(target=lambda: self.test_interface.handle_client(server.accept()[0]))
+        server_thread.start()
+        run_session(server.getsockname()[1])
+        server_thread.join()
+        server.close()
+
+        # The asyncio interface
+        async_interface = AsyncInterfaceOnboardSystems(self.test_interface.folder, host="127.0.0.1", port=0)
+        loop = asyncio.new_event_loop()
+        server_thread = threading.Thread(target=loop.run_until_complete, args=(async_interface.serve(),), daemon=True)
+        server_thread.start()
+        while async_interface.server is None:
+            pass
+        run_session(async_interface.server.sockets[0].getsockname()[1])
+
+        async_interface.stop()
+        server_thread.join(2)
+        loop.close()
 
-        
+    """
+        This test checks if a client that asks for MessagePack receives all responses of its connection in MessagePack with a binary length.
+        Both the threaded and the asyncio interface are tested.
+    """
+    def test_msgpack_codec(self):
+        test_file = File("")
+        test_file.lines = ["1", "1", "location", "52.1", "4.3"]
+        test_file.set_information()
+        self.test_interface.folder.add_file(test_file)
+
+        def run_session(port):
+            client = socket.create_connection(("127.0.0.1", port))
+            write_message(client, json.dumps({"request_type": "session", "codec": "msgpack"}), 10)
+            self.assertEqual(msgpack.unpackb(read_binary_message(client)), {"request_id": None, "reply": True, "request_type": "session"})
+
+            write_message(client, json.dumps({"request_type": "by_category", "category": "location", "fields": ["dab_id", "category", "coordinates"], "request_id": 1}), 10)
+            self.assertEqual(msgpack.unpackb(read_binary_message(client)), {"request_id": 1, "reply": True, "category": CATEGORY_NUMBERS[Category.LOCATION], "information": [[1, CATEGORY_NUMBERS[Category.LOCATION], [52.1, 4.3]]]})
+
+            write_message(client, json.dumps({"request_type": "unknown", "request_id": "error"}), 10)
+            self.assertEqual(msgpack.unpackb(read_binary_message(client)), {"request_id": "error", "reply": False, "error_message": Error.UNKOWN_REQUEST_TYPE.value})
+
+            write_message(client, json.dumps({"request_type": "disconnect"}), 10)
+            self.assertEqual(msgpack.unpackb(read_binary_message(client))["request_type"], "disconnect")
+            client.close()
+
+        # The threaded interface
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        server_thread = threading.Thread(target=lambda: self.test_interface.handle_client(server.accept()[0]))
+        server_thread.start()
+        run_session(server.getsockname()[1])
+        server_thread.join()
+        server.close()
+
+        # The asyncio interface
+        async_interface = AsyncInterfaceOnboardSystems(self.test_interface.folder, host="127.0.0.1", port=0)
+        loop = asyncio.new_event_loop()
+        server_thread = threading.Thread(target=loop.run_until_complete, args=(async_interface.serve(),), daemon=True)
+        server_thread.start()
+        while async_interface.server is None:
+            pass
+        run_session(async_interface.server.sockets[0].getsockname()[1])
+
+        async_interface.stop()
+        server_thread.join(2)
+        loop.close()
+
+        # An unknown codec is not accepted
+        self.assertEqual(self.test_interface.extract_request(json.dumps({"request_type": "latest", "codec": "xml"})), Error.INCORRECT_FORMAT)
+
+    """
+        This test checks if a subscriber receives the new files of its category as soon as they are added to the folder.
+        Both the threaded and the asyncio interface are tested.
+    """
+    def test_subscription(self):
+        def create_file(dab_id, category):
+            test_file = File("")
+            test_file.lines = [dab_id, 1, category]
+            test_file.set_information()
+            return test_file
+
+        def run_subscription(port):
+            client = socket.create_connection(("127.0.0.1", port))
+            client.settimeout(5)
+            write_message(client, json.dumps({"request_type": "subscribe", "category": "weather"}), 10)
+            self.assertEqual(json.loads(read_message(client, 10))["request_type"], "subscribe")
+
+            # Only the weather files need to be sent
+            for dab_id, category in [(1, "weather"), (2, "other"), (3, "weather")]:
+                self.test_interface.folder.add_file(create_file(dab_id, category))
+
+            information = []
+            while len(information) < 2:
+                reply = json.loads(read_message(client, 10))
+                information.extend(reply["information"])
+            self.assertEqual([lines[0] for lines in information], [1, 3])
+
+            write_message(client, json.dumps({"request_type": "disconnect"}), 10)
+            self.assertEqual(json.loads(read_message(client, 10))["request_type"], "disconnect")
+            client.close()
+
+        # The threaded interface
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        server_thread = threading.Thread(target=lambda: self.test_interface.handle_client(server.accept()[0]))
+        server_thread.start()
+        run_subscription(server.getsockname()[1])
+        server_thread.join()
+        server.close()
+        self.assertEqual(self.test_interface.subscriptions, set())
+
+        # The asyncio interface
+        self.test_interface = AsyncInterfaceOnboardSystems(self.test_interface.folder, host="127.0.0.1", port=0)
+        loop = asyncio.new_event_loop()
+        server_thread = threading.Thread(target=loop.run_until_complete, args=(self.test_interface.serve(),), daemon=True)
+        server_thread.start()
+        while self.test_interface.server is None:
+            pass
+        run_subscription(self.test_interface.server.sockets[0].getsockname()[1])
+
+        self.test_interface.stop()
+        server_thread.join(2)
+        loop.close()
+
+    """
+        This test checks if a subscription drops the oldest files when the subscriber is too slow.
+    """
+    def test_subscription_drops_oldest(self):
+        subscription = Subscription(max_queue_length=2)
+
+        for dab_id in range(1, 5):
+            test_file = File("")
+            test_file.lines = [dab_id, 1, "other"]
+            test_file.set_information()
+            subscription.offer(test_file)
+
+        files, dropped = subscription.take_all()
+        self.assertEqual([file.get_dab_id() for file in files], [3, 4])
+        self.assertEqual(dropped, 2)
+
+    """
+        This test checks if a subscription of which the event loop is closed is dropped, instead of failing the folder that adds the file.
+    """
+    def test_subscription_closed_loop(self):
+        loop = asyncio.new_event_loop()
+        subscription = Subscription()
+        subscription.loop = loop
+        subscription.event = asyncio.Event()
+        loop.close()
+
+        with self.test_interface.subscriptions_lock:
+            self.test_interface.subscriptions.add(subscription)
+
+        test_file = File("")
+        test_file.lines = [1, 1, "other"]
+        test_file.set_information()
+        self.assertFalse(subscription.offer(test_file))
+
+        self.test_interface.publish(test_file)
+        self.assertNotIn(subscription, self.test_interface.subscriptions)
+
+    """
+        This test checks if two clients can both receive all latest files by using their own cursor.
+    """
+    def test_latest_since(self):
+        valid = True
+        for dab_id in range(1, 4):
+            test_file = File("")
+            test_file.lines = [dab_id, 1, "other"]
+            test_file.set_information()
+            self.test_interface.folder.add_file(test_file)
+        self.test_interface.folder.files[1].set_valid(False)
+
+        # The first client receives the valid files and the cursor of the last file
+        request = LatestRequest(self.test_interface.folder, valid, since=0)
+        self.assertEqual(request.parse(), [[1, 1, "other"], [3, 1, "other"]])
+        cursor = json.loads(request.build_response([]))["cursor"]
+        self.assertEqual(cursor, 3)
+
+        # The second client still receives the same files, because the files are not changed
+        self.assertEqual(LatestRequest(self.test_interface.folder, valid, since=0).parse(), [[1, 1, "other"], [3, 1, "other"]])
+
+        # With the cursor only the new files are received
+        test_file = File("")
+        test_file.lines = [4, 1, "other"]
+        test_file.set_information()
+        self.test_interface.folder.add_file(test_file)
+        request = LatestRequest(self.test_interface.folder, valid, since=cursor)
+        self.assertEqual(request.parse(), [[4, 1, "other"]])
+        self.assertEqual(json.loads(request.build_response([]))["cursor"], 4)
+
+        # Without new files the cursor stays the same
+        request = LatestRequest(self.test_interface.folder, valid, since=4)
+        self.assertEqual(request.parse(), [])
+        self.assertEqual(json.loads(request.build_response([]))["cursor"], 4)
+
+        # since must be a positive int
+        self.assertEqual(self.test_interface.extract_request(json.dumps({"request_type": "latest", "since": -1})), Error.INCORRECT_FORMAT)
+        self.assertEqual(self.test_interface.extract_request(json.dumps({"request_type": "latest", "since": True})), Error.INCORRECT_FORMAT)
+
+    """
+        This test checks if a response built from the encoded lines of the files is the same as a response built with json.dumps.
+    """
+    def test_encoded_response(self):
+        for dab_id in range(1, 4):
+            test_file = File("")
+            test_file.lines = [str(dab_id), "1", "other", "ü \"quoted\""]
+            test_file.set_information()
+            self.test_interface.folder.add_file(test_file)
+
+        request = CategoryRequest(self.test_interface.folder, True, "other")
+        information = request.parse()
+        expected = json.dumps({"reply": True, "category": Category.OTHER.value, "information": [file.get_lines() for file in self.test_interface.folder.files]})
+        self.assertEqual(request.build_response(information), expected)
+        # The response is built from the encoded lines, so the lines themselves are not built
+        self.assertIsNone(information.values)
+
+        # A plain list is still encoded with json.dumps
+        self.assertEqual(request.build_response([]), json.dumps({"reply": True, "category": Category.OTHER.value, "information": []}))
+
+    """
+        This test checks if a client can receive the files of a category in pages with only the fields it asks for.
+    """
+    def test_pagination(self):
+        for dab_id in range(1, 6):
+            test_file = File("")
+            test_file.lines = [str(dab_id), "1", "other"]
+            test_file.set_information()
+            self.test_interface.folder.add_file(test_file)
+
+        # Only the files that are sent are marked as sent
+        request = LatestRequest(self.test_interface.folder, True, limit=3, offset=1)
+        information = request.parse()
+        self.assertEqual(information, [["2", "1", "other"], ["3", "1", "other"], ["4", "1", "other"]])
+        self.assertEqual(json.loads(request.build_response(information))["continuation"], 4)
+        self.assertEqual([file.get_sent_to_onboard_systems() for file in self.test_interface.folder.files], [False, True, True, True, False])
+
+        # Receive the pages by sending the continuation of the previous page as since
+        pages = []
+        request = {"request_type": "by_category", "category": "other", "limit": 2, "fields": ["dab_id", "category"]}
+        while True:
+            response = json.loads(self.test_interface.handle_message(json.dumps(request)))
+            pages.append(response["information"])
+            if response["continuation"] is None:
+                break
+            request["since"] = response["continuation"]
+
+        self.assertEqual(pages, [[[1, "other"], [2, "other"]], [[3, "other"], [4, "other"]], [[5, "other"]]])
+
+        # Without limit the response does not change
+        self.assertNotIn("continuation", json.loads(self.test_interface.handle_message(json.dumps({"request_type": "latest"}))))
+
+        for invalid in ({"limit": 0}, {"limit": True}, {"offset": -1}, {"fields": []}, {"fields": ["status"]}, {"fields": ["dab_id", "dab_id"]}, {"fields": [["lines"]]}):
+            self.assertEqual(self.test_interface.extract_request(json.dumps({"request_type": "latest", **invalid})), Error.INCORRECT_FORMAT)
+
+    """
+        This test checks if the files that are moved to the archive can still be requested.
+    """
+    def test_archive_request(self):
+        # Without an archive the request type is not known
+        self.assertEqual(json.loads(self.test_interface.handle_message(json.dumps({"request_type": "archive"})))["error_message"], Error.UNKOWN_REQUEST_TYPE.value)
+
+        with tempfile.TemporaryDirectory() as state_directory:
+            self.test_interface.folder.archive = FolderArchive(state_directory + "/archive.jsonl")
+
+            for dab_id, category in ((1, "CAP"), (2, "other"), (3, "CAP")):
+                test_file = File("")
+                test_file.lines = [str(dab_id), "1", category]
+                test_file.set_information()
+                self.test_interface.folder.add_file(test_file)
+
+            archived_files = self.test_interface.folder.files[:2]
+            self.test_interface.folder.archive.add_files(archived_files)
+            self.test_interface.folder.remove_files(archived_files)
+
+            response = json.loads(self.test_interface.handle_message(json.dumps({"request_type": "archive", "category": "CAP"})))
+            self.assertEqual(response["information"], [["1", "1", "CAP"]])
+
+            response = json.loads(self.test_interface.handle_message(json.dumps({"request_type": "archive", "limit": 1, "fields": ["dab_id"]})))
+            self.assertEqual(response["information"], [[1]])
+            self.assertEqual(response["continuation"], 1)
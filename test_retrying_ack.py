@@ -6,11 +6,21 @@ Description: A testcase to test the retrying of failed acknowledgments
 Changelog: Frank created the file.
 '''
 
+import os
+import tempfile
+import threading
 import time
 import unittest
 from Folder import Folder
 from File import File
 from Status import Status
+from RetryScheduler import RetryScheduler
+from IngestPipeline import IngestPipeline
+from Backfill import backfill
+from FolderArchive import FolderArchive
+from AcknowledgmentBatcher import AcknowledgmentBatcher
+from Devices.Device import Device
+from Devices.Strategy import AISStrategy, EthernetStrategy
 import main
 
 class RetryingAckTester(unittest.TestCase):
@@ -27,7 +37,7 @@ class RetryingAckTester(unittest.TestCase):
             
             # Set the status of the file, so every status is tested.
             file_to_add.set_status(status)
-            status = status.nextStatus()
+            status = status.next_status()
 
             # Finally add the file to the monitor
             self.test_monitor.folder.files.append(file_to_add)
@@ -38,20 +48,249 @@ class RetryingAckTester(unittest.TestCase):
 
         for file in self.test_monitor.folder.files:
             if file.dab_id == 1:
+                # A file that is unconfirmed gets a retry scheduled, it is only acknowledged when the retry is due
+                self.assertEqual(file.get_status(), Status.UNCONFIRMED)
+                self.assertTrue(self.test_monitor.retry_scheduler.is_scheduled(file.dab_id))
+
+                # Do the retry right away instead of waiting for the scheduler
+                self.test_monitor.retry_confirmation(file.dab_id)
+
                 # Based on the time it takes to confirm a message with wifi
                 time.sleep(3)
-                
+
                 self.assertEqual(file.get_status(), Status.CONFIRMED)
             elif file.dab_id in [2, 3, 5]:
                 self.assertEqual(file.get_status(), Status(file.dab_id))
             elif file.dab_id == 4:
-                self.assertEqual(file.get_status(), Status.UNCONFIRMED)
+                # A file that is skipped is not flipped back to UNCONFIRMED, but gets a retry scheduled.
+                self.assertEqual(file.get_status(), Status.SKIP)
+                self.assertTrue(self.test_monitor.retry_scheduler.is_scheduled(file.dab_id))
             else:
                 raise NotImplementedError(f"There is not test defined for a file with dab_id: {file.dab_id}")
 
+    def test_retry_scheduler(self):
+        retried_dab_ids = []
+        test_scheduler = RetryScheduler(retried_dab_ids.append, base_delay=0.05, max_delay=0.2, jitter=0)
+        test_scheduler.start()
+
+        # The retry with the shortest delay needs to be executed first
+        test_scheduler.attempts[1] = 2
+        test_scheduler.schedule(1)
+        test_scheduler.schedule(2)
+        time.sleep(0.5)
+        self.assertEqual(retried_dab_ids, [2, 1])
+
+        # The delay doubles every attempt, but never exceeds max_delay
+        self.assertEqual(test_scheduler.get_delay(2), 0.1)
+        self.assertEqual(test_scheduler.get_delay(1), 0.2)
+
+        # Cancelled retries are never executed and start over with the base_delay
+        test_scheduler.schedule(1)
+        test_scheduler.cancel(1)
+        time.sleep(0.3)
+        self.assertEqual(retried_dab_ids, [2, 1])
+        self.assertEqual(test_scheduler.get_delay(1), 0.05)
+
+        test_scheduler.stop()
+        test_scheduler.join()
+
+    def test_ingest_pipeline(self):
+        directory = tempfile.mkdtemp()
+        ingested_paths = []
+        release_ack = threading.Event()
+
+        def ingest_file(path):
+            ingested_paths.append(path)
+            file = File(os.path.basename(path))
+            # Every file contains the same dab_id, like a message that is received twice
+            file.dab_id = 1
+            return file
+
+        def acknowledge_file(file):
+            release_ack.wait(2)
+
+        pipeline = IngestPipeline(ingest_file, acknowledge_file, settle_time=0.1)
+        pipeline.start()
+
+        # The events of a file that is still being written are merged and the file is read once after it settled
+        first_path = os.path.join(directory, "first.txt")
+        for line in range(3):
+            with open(first_path, mode='a') as dab_file:
+                dab_file.write(f"line {line}\n")
+            pipeline.submit(first_path)
+        time.sleep(0.5)
+        self.assertEqual(ingested_paths, [first_path])
+
+        # A closed file is read right away. Its dab_id is still being acknowledged, so it is not acknowledged again.
+        second_path = os.path.join(directory, "second.txt")
+        with open(second_path, mode='w') as dab_file:
+            dab_file.write("line\n")
+        pipeline.file_closed(second_path)
+        time.sleep(0.05)
+        self.assertEqual(ingested_paths, [first_path, second_path])
+
+        # An event for a file that did not change is ignored
+        pipeline.file_closed(second_path)
+        release_ack.set()
+        time.sleep(0.1)
+
+        metrics = pipeline.get_metrics()
+        self.assertEqual(metrics["events"], 5)
+        self.assertEqual(metrics["merged_events"], 2)
+        self.assertEqual(metrics["unchanged_files"], 1)
+        self.assertEqual(metrics["duplicate_dab_ids"], 1)
+        self.assertEqual(metrics["acknowledged"], 1)
+        self.assertEqual(metrics["pending"], 0)
+
+        pipeline.stop()
+
+    def test_backfill(self):
+        directory = tempfile.mkdtemp()
+        test_folder = Folder(directory + os.sep)
+        test_folder.archive = FolderArchive(os.path.join(directory, "state", "archive.jsonl"))
+
+        # dab_id 1 is in the Folder already and dab_id 2 is archived, so only dab_id 3 and 4 arrived while the system was down
+        known_file = File("known.txt")
+        known_file.dab_id = 1
+        test_folder.add_file(known_file)
+        archived_file = File("archived.txt")
+        archived_file.dab_id = 2
+        archived_file.status = Status.CONFIRMED
+        test_folder.archive.add_files([archived_file])
+
+        os.makedirs(os.path.join(directory, "sub"))
+        for filename, dab_id, modification_time in [("known.txt", 1, 100), ("archived.txt", 2, 200), ("newest.txt", 3, 400),
+                                                     (os.path.join("sub", "oldest.TXT"), 4, 300), ("notes.md", 5, 50), ("broken.txt", "x", 50)]:
+            path = os.path.join(directory, filename)
+            with open(path, mode='w') as dab_file:
+                dab_file.write(f"{dab_id}\n1\nother\n")
+            os.utime(path, (modification_time, modification_time))
+
+        handled_paths = []
+        amount_of_files = backfill(test_folder, handled_paths.append, max_workers=2)
+
+        self.assertEqual(amount_of_files, 2)
+        self.assertEqual(handled_paths, [os.path.join(directory, "sub", "oldest.TXT"), os.path.join(directory, "newest.txt")])
+
+        # A message that is archived already is not acknowledged again when it is received again
+        test_monitor = main.Monitor(test_folder)
+        self.assertIsNone(test_monitor.ingest_file(os.path.join(directory, "archived.txt")))
+        self.assertEqual(test_monitor.ingest_file(os.path.join(directory, "newest.txt")).get_dab_id(), 3)
+
+        # Retention also archives files that were never acknowledged. Such a message is acknowledged when it is received again.
+        unconfirmed_file = File("unconfirmed.txt")
+        unconfirmed_file.dab_id = 6
+        test_folder.archive.add_files([unconfirmed_file])
+        with open(os.path.join(directory, "unconfirmed.txt"), mode='w') as dab_file:
+            dab_file.write("6\n1\nother\n")
+        self.assertEqual(test_monitor.ingest_file(os.path.join(directory, "unconfirmed.txt")).get_dab_id(), 6)
+        self.assertIsNotNone(test_folder.find_file_by_dab_id(6))
+
+    def test_batched_retries(self):
+        sent_batches = []
+        broadcasts = []
+
+        # The FiPy acknowledges every dab_id except 4 and lets the system know dab_id 5 was received before
+        wifi_device = Device("FiPy", "Pycom", "FiPy", "Wifi", 1)
+        wifi_device.set_strategy(EthernetStrategy(None))
+        def acknowledge_batch(batch):
+            sent_batches.append([data["dab_id"] for data in batch])
+            return {"ack_information": [[data["dab_id"], True] for data in batch if data["dab_id"] != 4], "different_ack_information": [[5, True]]}
+        wifi_device.acknowledge_batch = acknowledge_batch
+
+        class BroadcastInterface:
+            def write(self, buffer):
+                broadcasts.append(buffer)
+        ais_device = Device("AIS Base Station", "True Heading", "Carbon Pro", "AIS", 2)
+        ais_device.set_strategy(AISStrategy(BroadcastInterface()))
+
+        test_batcher = AcknowledgmentBatcher(self.test_monitor.folder, lambda: [wifi_device, ais_device], policies={"Wifi": (1, 0.1), "AIS": (5, 0.2)})
+        test_batcher.start()
+        self.test_monitor.acknowledgment_batcher = test_batcher
+
+        # Both files that need to be acknowledged again are sent right away. Wifi sends one per batch, AIS sends both in one broadcast.
+        self.test_monitor.retry_failed_confirmation()
+        time.sleep(0.1)
+        self.assertEqual(sorted(sent_batches), [[1], [4]])
+        self.assertEqual(len(broadcasts), 1)
+
+        # Wifi confirms dab_id 1 and 5. dab_id 4 failed with Wifi, but was broadcasted with AIS.
+        statuses = {file.dab_id: file.get_status() for file in self.test_monitor.folder.files}
+        self.assertEqual(statuses[1], Status.CONFIRMED)
+        self.assertEqual(statuses[4], Status.CONFIRMATION_SENT)
+        self.assertEqual(statuses[5], Status.CONFIRMED)
+
+        # An acknowledgment waits at most the maximum wait of the technology for its batch
+        test_batcher.add([{"dab_id": 2, "message_type": 1}])
+        time.sleep(0.05)
+        self.assertEqual(len(broadcasts), 1)
+        time.sleep(0.3)
+        self.assertEqual(len(broadcasts), 2)
+
+        test_batcher.stop()
+        test_batcher.join()
+
+    def test_batch_fallback(self):
+        sent_batches = []
+        sent_acknowledgments = []
+        choices = []
+
+        # A FiPy with older firmware replies to a batch as if it was one acknowledgment without a dab_id
+        wifi_device = Device("FiPy", "Pycom", "FiPy", "Wifi", 1)
+        wifi_device.set_strategy(EthernetStrategy(None))
+        def acknowledge_batch(batch):
+            sent_batches.append([data["dab_id"] for data in batch])
+            return {"ack_information": [None, False], "different_ack_information": []}
+        def acknowledge(data):
+            sent_acknowledgments.append(data["dab_id"])
+            return {"ack_information": [data["dab_id"], True], "different_ack_information": []}
+        wifi_device.acknowledge_batch = acknowledge_batch
+        wifi_device.acknowledge = acknowledge
+
+        def choose_device():
+            choices.append(time.monotonic())
+            return [wifi_device]
+
+        test_batcher = AcknowledgmentBatcher(self.test_monitor.folder, choose_device, policies={"Wifi": (5, 0.1)})
+        self.test_monitor.acknowledgment_batcher = test_batcher
+
+        # The retries that are due at the same time are submitted to the batcher, which chooses the device once for all of them
+        self.test_monitor.retry_confirmation(1)
+        self.test_monitor.retry_confirmation(4)
+        test_batcher.start()
+        time.sleep(0.3)
+        self.assertEqual(len(choices), 1)
+
+        # The reply is not a reply to a batch, so the acknowledgments are sent one by one
+        self.assertEqual(sent_batches, [[1, 4]])
+        self.assertEqual(sent_acknowledgments, [1, 4])
+        statuses = {file.dab_id: file.get_status() for file in self.test_monitor.folder.files}
+        self.assertEqual(statuses[1], Status.CONFIRMED)
+        self.assertEqual(statuses[4], Status.CONFIRMED)
+
+        # From then on the FiPy does not get batches anymore
+        test_batcher.submit({"dab_id": 2, "message_type": 1})
+        time.sleep(0.3)
+        self.assertEqual(sent_batches, [[1, 4]])
+        self.assertEqual(sent_acknowledgments, [1, 4, 2])
 
-        
-        
+        test_batcher.stop()
+        test_batcher.join()
 
+        # A FiPy that fails on the batch message, for example by closing the connection, gets the acknowledgments one by one as well
+        other_device = Device("Other FiPy", "Pycom", "FiPy", "LTE", 2)
+        other_device.set_strategy(EthernetStrategy(None))
+        other_device.acknowledge_batch = lambda batch: False
+        other_device.acknowledge = acknowledge
+        failing_batcher = AcknowledgmentBatcher(self.test_monitor.folder, lambda: [other_device], policies={"LTE": (5, 0)})
 
+        # A dab_id that is being acknowledged already is not added again, so its outcome is not lost
+        failing_batcher.add([{"dab_id": 3, "message_type": 1}, {"dab_id": 3, "message_type": 1}])
+        failing_batcher.add([{"dab_id": 3, "message_type": 1}])
+        self.assertEqual(len(failing_batcher.get_queue(other_device).entries), 1)
 
+        failing_batcher.send_batch(other_device, failing_batcher.get_queue(other_device).take_batch())
+        self.assertEqual(sent_acknowledgments, [1, 4, 2, 3])
+        self.assertEqual(self.test_monitor.folder.find_file_by_dab_id(3).get_status(), Status.CONFIRMATION_SENT)
+        self.assertIn(("Other FiPy", "LTE"), failing_batcher.unbatched_devices)
+        self.assertEqual(failing_batcher.acknowledgments, {})